@@ -92,16 +92,21 @@ class Agilent_DSO(Instrument):
 		self._visainstrument.write(':SYST:HEAD OFF')
 		self._visainstrument.write(':SYST:LONG OFF')
 		self._visainstrument.write(':WAV:BYT LSBF') # faster
+		
+		# preambles are cached until the acquisition is reconfigured
+		self._preambles = {}
 			
 	# memory management: points, segments and averages
 	def do_get_points(self):
 		return int(self._visainstrument.ask(':ACQ:POIN?'))
 	def do_set_points(self, value):
 		self._visainstrument.write(':ACQ:POIN %d'%value)
+		self._preambles.clear()
 	def do_get_segments(self):
 		return int(self._visainstrument.ask(':ACQ:SEGM:COUN?'))
 	def do_set_segments(self, value):
 		self._visainstrument.write(':ACQ:SEGM:COUN %d'%value)
+		self._preambles.clear()
 	def do_get_averages(self):
 		avgon = 1 == int(self._visainstrument.ask(':ACQ:AVER?'))
 		if(avgon):
@@ -114,6 +119,7 @@ class Agilent_DSO(Instrument):
 			self._visainstrument.write(':ACQ:AVER:COUN %d'%value)
 		else:
 			self._visainstrument.write(':ACQ:AVER 0')
+		self._preambles.clear()
 
 
 	# acquisition options bandwidth
@@ -149,6 +155,7 @@ class Agilent_DSO(Instrument):
 		self._visainstrument.write(':ACQ:MODE HRES')
 	def acqmode_segmented(self):
 		self._visainstrument.write(':ACQ:MODE SEGM')
+		self._preambles.clear()
 	def acqmode_averaging(self, count):
 		self._visainstrument.write(':ACQ:TYPE AVERage')
 		self._visainstrument.write(':ACQ:COUNT {0}'.format(count))
@@ -167,6 +174,7 @@ class Agilent_DSO(Instrument):
 		"""
 		return float(self._visainstrument.ask(':TIM:RANG?'))
 	def do_set_xrange(self, value):
+		self._preambles.clear()
 		return self._visainstrument.write(':TIM:RANG %d'%value)	
 	def do_get_refclock(self):
 		"""
@@ -180,10 +188,12 @@ class Agilent_DSO(Instrument):
 	def do_get_yoffset(self, channel):
 		return float(self._visainstrument.ask(':CHAN%d:OFFS?'%channel))
 	def do_set_yoffset(self, value, channel):
+		self._forget_preambles(channel)
 		return self._visainstrument.write(':CHAN%d:OFFS %d'%(channel, value))
 	def do_get_yrange(self, channel):
 		return float(self._visainstrument.ask(':CHAN%d:RANG?'%channel))
 	def do_set_yrange(self, value, channel):
+		self._forget_preambles(channel)
 		return self._visainstrument.write(':CHAN%d:RANG %d'%(channel, value))
 		
 	# functions
@@ -337,4 +347,69 @@ class Agilent_DSO(Instrument):
         
 		data = np.asarray(data)*preamble['Yincrement']
 		
-		return data, preamble
\ No newline at end of file
+		return data, preamble
+		
+	def get_data_binary(self, channels, segmented=False):
+		"""
+			retrieve waveform data for several channels in the WORD format,
+			the preambles are queried only once after each change of the
+			acquisition setup
+			
+			Input:
+				channels - numbers of the channels
+				segmented - if True, all segments are transferred in a single
+					block per channel (the acquisition should be in the
+					segmented mode, see acqmode_segmented())
+			Returns:
+				data as a numpy array of floats of the shape
+				(channels, points) or (channels, segments, points)
+				preambles for the channels
+		"""
+		self._visainstrument.write(':WAV:FORM WORD; :WAV:SEGM:ALL %d'%int(segmented))
+		preambles = [self._get_cached_preamble(channel, segmented) for channel in channels]
+		points = int(preambles[0]['points'])
+		segments = preambles[0]['segments']
+		data = np.empty((len(channels), segments, points))
+		for idx, channel in enumerate(channels):
+			self._visainstrument.write(':WAV:SOUR CHAN%d; :WAV:DATA?'%channel)
+			raw_data = self._parse_binary_block(self._visainstrument.read_raw())
+			if len(raw_data) != segments*points:
+				raise ValueError("Channel %d returned %d points instead of %d segments "
+					"of %d points, the acquisition setup has changed" %
+					(channel, len(raw_data), segments, points))
+			np.multiply(raw_data.reshape(segments, points),
+				preambles[idx]['Yincrement'], out=data[idx])
+			data[idx] += preambles[idx]['Yorigin']
+		return (data if segmented else data[:, 0, :]), preambles
+		
+	def _get_cached_preamble(self, channel, segmented):
+		"""
+			the preambles and the number of segments are cached for each
+			channel and transfer mode (:WAV:SEGM:ALL), which should be set
+			before the call
+		"""
+		key = (channel, segmented)
+		if key not in self._preambles:
+			values = self._visainstrument.ask(':WAV:SOUR CHAN%d; :WAV:PRE?'%channel).split(',')
+			parts = [
+				'format', 'type', 'points', 'count', 
+				'Xincrement', 'Xorigin', 'Xreference',
+				'Yincrement', 'Yorigin', 'Yreference'
+			]
+			preamble = dict(zip(parts, [float(x) for x in values[:len(parts)]]))
+			preamble['segments'] = self.do_get_segments() if segmented else 1
+			self._preambles[key] = preamble
+		return self._preambles[key]
+		
+	def _forget_preambles(self, channel):
+		for segmented in (False, True):
+			self._preambles.pop((channel, segmented), None)
+		
+	def _parse_binary_block(self, block):
+		"""
+			returns the int16 view of the IEEE 488.2 definite length block
+		"""
+		header_length = int(block[1:2])
+		data_length = int(block[2:2 + header_length])
+		start = 2 + header_length
+		return np.frombuffer(block, dtype='<i2', count=data_length//2, offset=start)
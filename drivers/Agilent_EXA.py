@@ -38,6 +38,9 @@ class Agilent_EXA_N9010A(Instrument):
         self._nop = 0
 
         self._visainstrument.timeout = 1000
+        self._sweep_timeout = 10000
+        self._list_sweep_config = None
+        self._binary_transfer = False
 
         # Implement parameters
 
@@ -103,6 +106,7 @@ class Agilent_EXA_N9010A(Instrument):
         self.add_function('wait_for_stb')
         self.add_function('set_electrical_delay')
         self.add_function("setup_list_sweep")
+        self.add_function("sweep_and_fetch")
         self.add_function("set_parameters")
         #self.add_function('avg_clear')
         #self.add_function('avg_status')
@@ -113,6 +117,7 @@ class Agilent_EXA_N9010A(Instrument):
         #  self.set_zerospan(True)
 
         self.get_all()
+        self.setup_binary_transfer()
         #self.setup_swept_sa()
 
 
@@ -202,26 +207,53 @@ class Agilent_EXA_N9010A(Instrument):
         if int(self.get_avg_status()) == 1: return True
         else: return False
 
+    def setup_binary_transfer(self):
+        """
+        Configures the EXA to transfer traces as little-endian 32-bit floats.
+        This is done once, the setting persists until the EXA is reset.
+        """
+        self._visainstrument.write(":FORMat:DATA REAL,32;:FORMat:BORDer SWAP")
+        self._binary_transfer = True
+
     def get_tracedata(self):
         """
         Get the data of the current trace
 
-        Output: (Frequency_List, Signal_List)
+        Output: numpy.array of the signal values (for the list sweep: one value
+        for each frequency of the list)
 
         """
-        self._visainstrument.write(":FORMat:DATA REAL,32")
-        self._visainstrument.write(":FORMat:BORDer SWAP")
-        data = self._visainstrument.ask_for_values(":CALC:DATA1?")
-
-        if self._list_sweep:
-            return data
+        if not self._binary_transfer:
+            self.setup_binary_transfer()
+        data = self._visainstrument.query_binary_values(":CALC:DATA1?", "f",
+                                                        False, container=numpy.array)
+        return self._extract_signal(data)
 
-        data_size = numpy.size(data)
-        freq = numpy.array(data[0:data_size:2])
-        signal = numpy.array(data[1:data_size:2])
+    def sweep_and_fetch(self):
+        """
+        Triggers a single sweep and returns the trace data when it is finished.
+        All of that is done in one query (the EXA is switched to the single
+        sweep mode), so it is the fastest way to get one spectrum, i.e. for
+        each point of a list sweep.
 
-        return signal
+        Output: same as get_tracedata()
+        """
+        if not self._binary_transfer:
+            self.setup_binary_transfer()
+        self._visainstrument.timeout = self._sweep_timeout
+        try:
+            data = self._visainstrument.query_binary_values(
+                ":INIT:CONT OFF;:INIT:IMM;*WAI;:CALC:DATA1?", "f", False,
+                container=numpy.array)
+        finally:
+            self._visainstrument.timeout = 1000
+        return self._extract_signal(data)
 
+    def _extract_signal(self, data):
+        if self._list_sweep:
+            return data
+        # the swept SA trace contains (frequency, signal) pairs
+        return data[1::2]
 
     def get_freqpoints(self, query = False):
       self._freqpoints = numpy.linspace(self._start,self._stop,self._nop)
@@ -415,18 +447,22 @@ class Agilent_EXA_N9010A(Instrument):
             List of the center frequencies for which the EXA will record data
         rbw_list: array-like
             list of the resolution bandwidths to be used for corresponding frequencies
-        """
-        self._visainstrument.write(":CONFigure:LIST")
-        self._list_sweep = True
 
-        freqs_str = "".join(["%f,"%freq for freq in frequency_list])
-        self._visainstrument.write(":LIST:FREQ "+freqs_str[:-1])
-
-        rbws_str = "".join(["%f,"%rbw for rbw in rbw_list])
-        self._visainstrument.write(":LIST:BAND:RES "+rbws_str[:-1])
+        The EXA is not reprogrammed if the list sweep with the same lists is
+        already set up.
+        """
+        list_sweep_config = (tuple(frequency_list), tuple(rbw_list))
+        if self._list_sweep and self._list_sweep_config == list_sweep_config:
+            return
 
-        sweep_times = "".join(["%f,"%swt for swt in ones_like(frequency_list)/1e3])
-        self._visainstrument.write(":LIST:SWEep:TIME "+sweep_times[:-1])
+        freqs_str = ",".join(["%f" % freq for freq in frequency_list])
+        rbws_str = ",".join(["%f" % rbw for rbw in rbw_list])
+        sweep_times = ",".join(["%f" % swt for swt in ones_like(frequency_list)/1e3])
+        self._visainstrument.write(":CONFigure:LIST;:LIST:FREQ " + freqs_str +
+                                   ";:LIST:BAND:RES " + rbws_str +
+                                   ";:LIST:SWEep:TIME " + sweep_times)
+        self._list_sweep = True
+        self._list_sweep_config = list_sweep_config
 
     def setup_swept_sa(self, center_freq=5e9, span=1e9, nop=1001, rbw=1e6):
         """
@@ -446,6 +482,7 @@ class Agilent_EXA_N9010A(Instrument):
         self._visainstrument.write(":CONFigure:SAN")
         self._visainstrument.write(":DET:trace1 POS")
         self._list_sweep = False
+        self._list_sweep_config = None
         self.do_set_centerfreq(center_freq)
         self.do_set_span(span)
         self.do_set_nop(nop)
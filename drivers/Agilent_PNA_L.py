@@ -59,6 +59,7 @@ class Agilent_PNA_L(Instrument):
         self._start = 0
         self._stop = 0
         self._nop = 0
+        self._segments = None
 
         # Implement parameters
 
@@ -172,6 +173,8 @@ class Agilent_PNA_L(Instrument):
         self.add_function('sweep_hold')
         self.add_function('sweep_continuous')
         self.add_function('autoscale_all')
+        self.add_function('set_segments')
+        self.add_function('get_segments')
 
         #self.add_function('avg_clear')
         #self.add_function('avg_status')
@@ -339,9 +342,54 @@ class Agilent_PNA_L(Instrument):
       #if query == True:
         #self._freqpoints = numpy.array(self._visainstrument.ask_for_values('SENS%i:FREQ:DATA:SDAT?'%self._ci,format=1)) / 1e9
         #self._freqpoints = numpy.array(self._visainstrument.ask_for_values(':FORMAT REAL,32;*CLS;CALC1:DATA:STIM?;*OPC',format=1)) / 1e9
-      self._freqpoints = numpy.linspace(self._start,self._stop,self._nop)
+      if self._segments is not None:
+        self._freqpoints = numpy.concatenate([numpy.linspace(start, stop, nop)
+                                              for start, stop, nop in self._segments])
+      else:
+        self._freqpoints = numpy.linspace(self._start,self._stop,self._nop)
       return self._freqpoints
 
+    def set_segments(self, segments):
+        """
+        Switches to the segmented sweep over the given frequency windows, so
+        that only the interesting parts of the spectrum are measured in one
+        sweep. The data of all the segments is returned as one trace.
+
+        Input:
+            segments (list) : [(start, stop, nop), ...] in Hz, sorted and
+                not overlapping
+        """
+        segments = [(float(start), float(stop), int(nop)) for start, stop, nop in segments]
+        for (start, stop, nop), next_segment in zip(segments, segments[1:] + [None]):
+            if stop < start or (next_segment is not None and next_segment[0] <= stop):
+                raise ValueError("Segments must be sorted and must not overlap")
+
+        self.logger.debug(__name__ + ' : setting %i segments' % len(segments))
+        self._visainstrument.write('SENS%i:SEGM:DEL:ALL' % self._ci)
+        for idx, (start, stop, nop) in enumerate(segments, 1):
+            self._visainstrument.write('SENS%i:SEGM%i:ADD' % (self._ci, idx))
+            self._visainstrument.write('SENS%i:SEGM%i:FREQ:STAR %f' % (self._ci, idx, start))
+            self._visainstrument.write('SENS%i:SEGM%i:FREQ:STOP %f' % (self._ci, idx, stop))
+            self._visainstrument.write('SENS%i:SEGM%i:SWE:POIN %i' % (self._ci, idx, nop))
+            self._visainstrument.write('SENS%i:SEGM%i ON' % (self._ci, idx))
+        self._visainstrument.write('SENS%i:SWE:TYPE SEGM' % self._ci)
+        self._segments = segments
+        self._start, self._stop = segments[0][0], segments[-1][1]
+        self._nop = sum(nop for start, stop, nop in segments)
+        self.get_frequencies()
+
+    def get_segments(self):
+        """
+        Returns the list of (start, stop, nop) of the segmented sweep or None
+        if the sweep is not segmented
+        """
+        return self._segments
+
+    def _leave_segmented_sweep(self):
+        if self._segments is not None:
+            self._segments = None
+            self.set_sweep_type("LIN")
+
     def set_electrical_delay(self, delay):
         self._visainstrument.write("CALC{0}:CORRection:EDELay:TIME {1}".format(self._ci, delay))
 
@@ -349,6 +397,7 @@ class Agilent_PNA_L(Instrument):
         return float(self._visainstrument.query("CALC{0}:CORRection:EDELay:TIME?".format(self._ci)))
 
     def set_xlim(self, start, stop):
+        self._leave_segmented_sweep()
         self.logger.debug(__name__ + ' : setting start freq to %s Hz' % start)
         self._visainstrument.write('SENS%i:FREQ:STAR %f' % (self._ci,start))
         self._start = start
@@ -370,6 +419,7 @@ class Agilent_PNA_L(Instrument):
         return self._start, self._stop
 
     def set_freq_limits(self, start, stop):
+        self._leave_segmented_sweep()
         self.logger.debug(__name__ + ' : setting start freq to %s Hz' % start)
         self._visainstrument.write('SENS%i:FREQ:STAR %f' % (self._ci,start))
         self._start = start
@@ -395,7 +445,8 @@ class Agilent_PNA_L(Instrument):
                   "sweep_type":self.get_sweep_type(),
                   "power":self.get_power(),
                   "averages":self.get_averages(),
-                  "freq_limits":self.get_freq_limits()}
+                  "freq_limits":self.get_freq_limits(),
+                  "segments":self.get_segments()}
 
     def set_parameters(self, parameters_dict):
         """
@@ -421,6 +472,9 @@ class Agilent_PNA_L(Instrument):
             self.set_centerfreq(parameters_dict["centerfreq"])
         if "sweep_type" in parameters_dict.keys():
             self.set_sweep_type(parameters_dict["sweep_type"])
+        if parameters_dict.get("segments") is not None:
+            # after the other sweep settings, which switch to a linear sweep
+            self.set_segments(parameters_dict["segments"])
 
         if "aux_num" in parameters_dict.keys():
             self.set_aux_num(parameters_dict["aux_num"])
@@ -561,6 +615,8 @@ class Agilent_PNA_L(Instrument):
             return int(self._visainstrument.query('SENS%i:AVER:COUN?' % self._ci))
 
     def set_sweep_type(self,sweep_type = "LIN"):
+        if not sweep_type.upper().startswith("SEGM"):
+            self._segments = None
         self._visainstrument.write("SENS:SWE:TYPE "+sweep_type)
 
     def do_set_power(self,pow):
@@ -32,6 +32,23 @@ class AWGChannel():
         self._host_awg.output_arbitrary_waveform(waveform, frequency,
                                 self._channel_number, asynchronous = asynchronous)
 
+    def get_host_awg(self):
+        return self._host_awg
+
+    def get_channel_number(self):
+        return self._channel_number
+
+    def supports_preloading(self):
+        return hasattr(self._host_awg, "preload_arbitrary_waveform")
+
+    def preload_arbitrary_waveform(self, waveform):
+        """
+        Loads the waveform into the idle buffer of the channel if the AWG
+        has one (e.g. KeysightM3202ASimpleSync), so that its output for the
+        next point of a sweep is fast
+        """
+        self._host_awg.preload_arbitrary_waveform(waveform, self._channel_number)
+
 
 class CalibratedAWG():
 
@@ -55,6 +72,12 @@ class CalibratedAWG():
     def get_calibration(self):
         return self._calibration
 
+    def get_host_awgs(self):
+        """
+        Returns the AWGs whose channels are used
+        """
+        return [self._channel.get_host_awg()]
+
 
     def get_pulse_builder(self):
         """
@@ -74,6 +97,16 @@ class CalibratedAWG():
         self._channel.output_arbitrary_waveform(pulse_sequence\
                         .get_waveform(), frequency, asynchronous=asynchronous)
 
+    def supports_preloading(self):
+        return self._channel.supports_preloading()
+
+    def preload_pulse_sequence(self, pulse_sequence):
+        """
+        Loads the PulseSequence to be output next into the idle buffer of
+        the AWG, see AWGChannel.preload_arbitrary_waveform
+        """
+        self._channel.preload_arbitrary_waveform(pulse_sequence.get_waveform())
+
 class IQAWG():
 
     def __init__(self, channel_I, channel_Q, triggered=False):
@@ -96,6 +129,12 @@ class IQAWG():
     def get_calibration(self):
         return self._calibration
 
+    def get_host_awgs(self):
+        """
+        Returns the AWGs whose channels are used
+        """
+        return [channel.get_host_awg() for channel in self._channels]
+
     # def set_channel_coupling(self, state):
     #     '''
     #     Assuming that user knows what he is doing here. Make sure your channels
@@ -182,9 +221,30 @@ class IQAWG():
             end_idx = length
 
         frequency = 1 / duration * 1e9
+        host_awg = self._channels[0].get_host_awg()
+        if hasattr(host_awg, "output_iq_waveforms") and \
+                self._channels[1].get_host_awg() is host_awg and \
+                [channel.get_channel_number() for channel in self._channels] == [1, 2]:
+            # both of the waveforms are loaded in one transfer
+            host_awg.output_iq_waveforms(pulse_sequence.get_I_waveform()[:end_idx],
+                                         pulse_sequence.get_Q_waveform()[:end_idx],
+                                         frequency, asynchronous=asynchronous)
+            return
         self._channels[0].output_arbitrary_waveform(pulse_sequence \
                                                     .get_I_waveform()[:end_idx], frequency,
                                                     asynchronous=True)
         self._channels[1].output_arbitrary_waveform(pulse_sequence
                                                     .get_Q_waveform()[:end_idx], frequency,
                                                     asynchronous=asynchronous)
+
+    def supports_preloading(self):
+        return all(channel.supports_preloading() for channel in self._channels)
+
+    def preload_pulse_sequence(self, pulse_sequence):
+        """
+        Loads the IQPulseSequence to be output next into the idle buffers of
+        the AWG, see AWGChannel.preload_arbitrary_waveform
+        """
+        end_idx = len(pulse_sequence.get_I_waveform()) - (1000 if self._triggered else 0)
+        self._channels[0].preload_arbitrary_waveform(pulse_sequence.get_I_waveform()[:end_idx])
+        self._channels[1].preload_arbitrary_waveform(pulse_sequence.get_Q_waveform()[:end_idx])
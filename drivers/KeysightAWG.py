@@ -47,6 +47,7 @@ class KeysightAWG(Instrument):
         self._visainstrument = rm.open_resource(self._address)
 
         self._visainstrument.write(":DIG:TRAN:INT 1")
+        self._channels_coupled = False
 
         self.add_parameter('outp1',
                            flags=Instrument.FLAG_GETSET, units='', type=int)
@@ -89,13 +90,43 @@ class KeysightAWG(Instrument):
         channel: 1 or 2
             channel which will output the waveform
         """
-        waveform = array(waveform)
-        if len(set((waveform * 8191).astype(int))) == 1:
-            # Crest data out of range KOSTYL FUCK YOU KEYSIGHT look carefully.
-            waveform = waveform[:3]
-            self.load_arbitrary_waveform_to_volatile_memory(waveform[:-1], channel)
-            self.prepare_waveform(WaveformType.arbitrary, repetition_rate, 2, 0, channel)
+        if self._channels_coupled:
+            # the channel may be used at its own frequency
+            self.set_channel_coupling(False)
+        codes = self._get_dac_codes(waveform)
+        self._write_dac_codes(codes, channel)
+        self._visainstrument.query("*OPC?")
+        self.prepare_waveform(WaveformType.arbitrary, repetition_rate, 2, 0, channel)
+        self.set_output(channel, 1)
+
+    def output_iq_waveforms(self, waveform_I, waveform_Q, repetition_rate,
+                            asynchronous=False):
+        """
+        Prepare and output the I and Q waveforms on the channels 1 and 2 at
+        once. The channels are coupled, so the frequency is set only for the
+        first one, and both of the waveforms are written one after another
+        with a single completion wait at the end.
+
+        Parameters:
+        -----------
+        waveform_I, waveform_Q: array
+            ADC levels, in Volts
+        repetition_rate: foat, Hz
+            frequency at which the waveforms will be repeated
+        asynchronous: bool
+            if True, does not wait for the AWG to finish loading
+        """
+        if not self._channels_coupled:
+            self.set_channel_coupling(True)
+        for channel, waveform in ((1, waveform_I), (2, waveform_Q)):
+            self._write_dac_codes(self._get_dac_codes(waveform), channel)
+        self._visainstrument.write(":FREQ1 %f" % repetition_rate)
+        for channel in (1, 2):
+            self._visainstrument.write(":FUNC{0} {1}; :VOLT{0} 2; :VOLT{0}:OFFS 0"
+                                       .format(channel, WaveformType.arbitrary.value))
             self.set_output(channel, 1)
+        if not asynchronous:
+            self._visainstrument.query("*OPC?")
 
     def output_continuous_wave(self, frequency=100e6, amplitude=0.1, phase=0, offset=0, waveform_resolution=1,
                                channel=1):
@@ -127,6 +158,24 @@ class KeysightAWG(Instrument):
     def set_channel_coupling(self, state):
         self._visainstrument.write(":TRAC:CHAN1:%s" % ("ON" if state == True else "OFF"))
         self._visainstrument.write(":TRAC:CHAN2:%s" % ("ON" if state == True else "OFF"))
+        self._channels_coupled = state == True
+
+    @staticmethod
+    def _get_dac_codes(waveform):
+        """
+        Converts the waveform in Volts to the DAC codes; a constant waveform is
+        shortened to two points
+        """
+        codes = around(asarray(waveform) * 8191).astype(int16)
+        if codes.min() == codes.max():
+            # Crest data out of range KOSTYL FUCK YOU KEYSIGHT look carefully.
+            return codes[:2]
+        # the last point coincides with the first one of the next period
+        return codes[:-1]
+
+    def _write_dac_codes(self, codes, channel):
+        self._visainstrument.write_binary_values(":DATA%d:DAC VOLATILE," % channel,
+                                                 codes, "h", True)
 
     def apply_waveform(self, waveform, freq, amp, offset, channel=1):
         """
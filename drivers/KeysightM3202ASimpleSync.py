@@ -1,3 +1,4 @@
+import hashlib
 import sys
 
 sys.path.append('C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
@@ -17,50 +18,70 @@ class KeysightM3202ASimpleSync(KeysightM3202ABase):
         self.trigger_delays = [0] * 4
         self.trigger_behaviours = [0] * 4
         self.waveforms = [None] * 4
-        self.waiting_waveforms = [[None, None]] * 4
+        self.waiting_waveforms = [None] * 4
+        # waveforms are compared by their hashes; the waiting (idle) buffer
+        # of each channel has its own waveform id, so that it can be loaded
+        # while the current one is played
+        self.waveform_hashes = [None] * 4
+        self.waiting_waveform_hashes = [None] * 4
         self.waveform_ids = [None] * 4
         self.waiting_waveform_ids = [None] * 4
         self.marker_delay = [None] * 4
         self.marker_length = [None] * 4
 
+    def output_arbitrary_waveform(self, waveform, repetition_rate, channel,
+                                  asynchronous=True):
+        """
+        Outputs the waveform in Volts on the channel, the same interface as
+        the one of the other AWG drivers used by drivers.IQAWG
+        """
+        self.set_waveform(self._normalize(waveform, channel), channel)
+        self.set_output(1, channel)
+        self.run()
+
+    def preload_arbitrary_waveform(self, waveform, channel):
+        """
+        Loads the waveform in Volts into the idle buffer of the channel, so
+        that the following output_arbitrary_waveform with the same waveform
+        only switches the buffers
+        """
+        self.prepare_set_waveform_async(self._normalize(waveform, channel), channel)
+
     def prepare_set_waveform_async(self, waveform, channel):
-        wave = keysightSD1.SD_Wave()
+        waveform = np.asarray(waveform, dtype=float)
+        waveform_hash = self._waveform_hash(waveform)
+        if waveform_hash in (self.waveform_hashes[channel],
+                             self.waiting_waveform_hashes[channel]):
+            return
         if self.waiting_waveform_ids[channel] is None:
-            wave.newFromArrayDouble(0, np.zeros((50000,)).tolist())  # WAVE_ANALOG_32
-            self.module.waveformLoad(wave, channel)
-            wave = keysightSD1.SD_Wave()
-            self.waiting_waveform_ids[channel] = channel
-        waveform_id = self.waiting_waveform_ids[channel];
-
-        waveform_data = np.asarray(waveform).tolist()
-        wave.newFromArrayDouble(0, waveform_data)  # WAVE_ANALOG_32
-        self.module.waveformReLoad(wave, waveform_id, 0)
-
-        self.waiting_waveforms[channel] = waveform_data
+            self.waiting_waveform_ids[channel] = channel + 4
+            self._allocate_waveform(self.waiting_waveform_ids[channel])
+        self._reload_waveform(waveform, self.waiting_waveform_ids[channel])
+        self.waiting_waveforms[channel] = waveform
+        self.waiting_waveform_hashes[channel] = waveform_hash
 
     ### infinite cycles of a single waveform mode with synchronisation across channels
     def set_waveform(self, waveform, channel):
-        if self.waiting_waveforms[
-            channel] != waveform:  # if the current waveform has not been preloaded by prepare_set_waveform_async
-            wave = keysightSD1.SD_Wave()
+        waveform = np.asarray(waveform, dtype=float)
+        waveform_hash = self._waveform_hash(waveform)
+        if waveform_hash == self.waiting_waveform_hashes[channel] and \
+                waveform_hash != self.waveform_hashes[channel]:
+            # the waveform has been preloaded by prepare_set_waveform_async,
+            # exchange the current waveform for the waiting one
+            self.waveform_ids[channel], self.waiting_waveform_ids[channel] = \
+                self.waiting_waveform_ids[channel], self.waveform_ids[channel]
+            self.waveforms[channel], self.waiting_waveforms[channel] = \
+                self.waiting_waveforms[channel], self.waveforms[channel]
+            self.waveform_hashes[channel], self.waiting_waveform_hashes[channel] = \
+                self.waiting_waveform_hashes[channel], self.waveform_hashes[channel]
+        elif waveform_hash != self.waveform_hashes[channel]:
             if self.waveform_ids[channel] is None:
-                wave.newFromArrayDouble(0, np.zeros((50000,)).tolist())  # WAVE_ANALOG_32
-                self.module.waveformLoad(wave, channel)
-                wave = keysightSD1.SD_Wave()
                 self.waveform_ids[channel] = channel
-            waveform_id = self.waveform_ids[channel];
-
-            waveform_data = np.asarray(waveform).tolist()
-            wave.newFromArrayDouble(0, waveform_data)  # WAVE_ANALOG_32
-            self.module.waveformReLoad(wave, waveform_id, 0)
-            self.waveforms[channel] = waveform
-        else:  # in case the waveform has been preloaded, exchange the current waveform for the waiting_waveform
-            waveform_id = self.waiting_waveform_ids[channel]
-            waveform = self.waiting_waveforms[channel]
-            self.waiting_waveform_ids[channel] = self.waveform_ids[channel]
-            self.waiting_waveforms[channel] = self.waveforms[channel]
-            self.waveform_ids[channel] = waveform_id
+                self._allocate_waveform(channel)
+            self._reload_waveform(waveform, self.waveform_ids[channel])
             self.waveforms[channel] = waveform
+            self.waveform_hashes[channel] = waveform_hash
+        waveform_id = self.waveform_ids[channel]
 
         trigger_source_type = self.trigger_source_types[channel]
         trigger_source_channel = self.trigger_source_channels[channel]
@@ -102,7 +123,7 @@ class KeysightM3202ASimpleSync(KeysightM3202ABase):
             self.module.AWGqueueConfig(channel, 1)  # infnite cycles
             # self.module.AWGfromArray(channel, trigger, 0, 0, 0, keysightSD1.SD_WaveformTypes.WAVE_ANALOG, waveform[:32576])
             self.module.AWGqueueWaveform(channel,
-                                         channel,
+                                         self.waveform_ids[channel],
                                          trigger_source_type,
                                          # keysightSD1.SD_TriggerModes.AUTOTRIG,
                                          trigger_delay,
@@ -120,6 +141,29 @@ class KeysightM3202ASimpleSync(KeysightM3202ABase):
                                              self.marker_delay[channel]);  # delay5Tclk
             self.module.AWGqueueSyncMode(channel, 1)
 
+    def _normalize(self, waveform, channel):
+        return np.asarray(waveform, dtype=float) / self.amplitudes[channel]
+
+    def _allocate_waveform(self, waveform_id):
+        wave = keysightSD1.SD_Wave()
+        wave.newFromArrayDouble(0, np.zeros(50000))  # WAVE_ANALOG_32
+        self.module.waveformLoad(wave, waveform_id)
+
+    def _reload_waveform(self, waveform, waveform_id):
+        if hasattr(self.module, "waveformReLoadArrayInt16"):
+            # native DAC codes, no conversion in the SD1 library
+            codes = np.round(np.clip(waveform, -1, 1) * 32767).astype(np.int16)
+            self.module.waveformReLoadArrayInt16(0, codes, waveform_id, 0)  # WAVE_ANALOG
+        else:
+            wave = keysightSD1.SD_Wave()
+            wave.newFromArrayDouble(0, waveform)  # WAVE_ANALOG_32
+            self.module.waveformReLoad(wave, waveform_id, 0)
+
+    @staticmethod
+    def _waveform_hash(waveform):
+        return hashlib.blake2b(np.ascontiguousarray(waveform).tobytes(),
+                               digest_size=16).digest()
+
     ## TODO: this function is broken
     def do_set_repetition_period(self, repetition_period):
         pass
@@ -60,17 +60,32 @@ class Keysight_DSOX2014(Instrument):
         self._visainstrument.write(":WAV:UNSIGNED 0")
         self._visainstrument.write(":TIMebase:REFerence LEFT")
 
+        self._io_timeout = 1000
+        self._acquisition_timeout = 100e3
+        self._visainstrument.timeout = self._io_timeout
+
+        # preambles do not change until the acquisition is reconfigured
+        self._preambles = {}
+
         Channel.ALL = [Channel.ONE, Channel.TWO, Channel.THREE, Channel.FOUR]
         self.set_offset(0, *Channel.ALL)
 
-    def digitize(self):
+    def digitize(self, *channels):
         """
         Initiates a measurement, blocks until measurement finished.
+
+        Parameters:
+        -----------
+        channels: zero or several Keysight_DSOX2014.Channel objects
+            If specified, only these channels are acquired, which is faster
         """
-        self._visainstrument.timeout = 100e3
-        self._visainstrument.write(":DIGitize")
-        self._visainstrument.query("*OPC?")
-        self._visainstrument.timeout = 1000
+        sources = " " + ",".join([channel.value for channel in channels]) \
+            if len(channels) > 0 else ""
+        self._visainstrument.timeout = self._acquisition_timeout
+        try:
+            self._visainstrument.query(":DIGitize%s;*OPC?" % sources)
+        finally:
+            self._visainstrument.timeout = self._io_timeout
 
     def get_data(self, *channels):
         """
@@ -78,6 +93,10 @@ class Keysight_DSOX2014(Instrument):
         The channel must be displayed on the screen of the DSO for this function
         to work!
 
+        The preambles are queried only once after each change of the
+        acquisition setup, and the data for all channels is stored into one
+        preallocated array.
+
         Parameters:
         -----------
         channels: one or several Keysight_DSOX2014.Channel objects
@@ -87,20 +106,90 @@ class Keysight_DSOX2014(Instrument):
         --------
         times: numpy.array
             Time axis for the waveforms, channel independent
-        data: numpy.array or tuple of numpy.arrays
+        data: numpy.array
             Depending on the value of the channel argument may return data for one
-            selected channel or data for all channels
+            selected channel or a 2D array with rows for each of the channels
         Example:
         >>> dso.set_averages(100)
         >>> dso.digitize() # acquire data for all channels, blocks until finished
         >>> channel1data, channel2data = dso.get_data(Channel.ONE, Channel.TWO)
 
         """
-        data = []
-        for channel in channels:
-            preamble = self.get_preamble(channel)
-            data.append(self.apply_preamble(self.get_data_raw(channel), preamble))
-        return self.get_times(preamble), data if len(data)>1 else data[0]
+        preambles = [self._get_cached_preamble(channel) for channel in channels]
+        data = np.empty((len(channels), preambles[0]["nop"]))
+        for idx, (channel, preamble) in enumerate(zip(channels, preambles)):
+            self._read_waveform(channel, preamble, data[idx])
+        return self.get_times(preambles[0]), data if len(channels) > 1 else data[0]
+
+    def get_segmented_data(self, *channels):
+        """
+        Get the data for all acquired segments from the specified channels when
+        the oscilloscope is in the segmented mode (see set_segments(...))
+
+        Parameters:
+        -----------
+        channels: one or several Keysight_DSOX2014.Channel objects
+            Channel enum value, i.e. Channel.ONE
+
+        Returns:
+        --------
+        times: numpy.array
+            Time axis for the waveforms, channel and segment independent
+        data: numpy.array
+            Array of the shape (segments, nop) for one channel or
+            (channels, segments, nop) for several channels
+        """
+        segments = self.get_segments()
+        preambles = [self._get_cached_preamble(channel) for channel in channels]
+        data = np.empty((len(channels), segments, preambles[0]["nop"]))
+        for segment_idx in range(segments):
+            self._visainstrument.write(":ACQuire:SEGMented:INDex %d" % (segment_idx + 1))
+            for idx, (channel, preamble) in enumerate(zip(channels, preambles)):
+                self._read_waveform(channel, preamble, data[idx, segment_idx])
+        return self.get_times(preambles[0]), data if len(channels) > 1 else data[0]
+
+    def set_segments(self, segments):
+        """
+        Set the number of segments to acquire per digitize() call. Segmented
+        mode is turned off if the number of segments is 1.
+        """
+        if segments == 1:
+            self._visainstrument.write(":ACQuire:MODE RTIMe")
+        else:
+            self._visainstrument.write(":ACQuire:MODE SEGMented;"
+                                       ":ACQuire:SEGMented:COUNt %d" % segments)
+        self._segments = segments
+        self._preambles.clear()
+
+    def get_segments(self):
+        """
+        Get the number of segments acquired per digitize() call
+        """
+        if not hasattr(self, "_segments"):
+            if self._visainstrument.query(":ACQuire:MODE?").strip() == "SEGM":
+                self._segments = \
+                    int(self._visainstrument.query(":ACQuire:SEGMented:COUNt?"))
+            else:
+                self._segments = 1
+        return self._segments
+
+    def get_x_increment(self, channel):
+        """
+        Returns the time between the points of the waveforms of the channel,
+        the preamble is queried only after the acquisition is reconfigured
+        """
+        return self._get_cached_preamble(channel)["xincrement"]
+
+    def _get_cached_preamble(self, channel):
+        if channel not in self._preambles:
+            self._preambles[channel] = self.get_preamble(channel)
+        return self._preambles[channel]
+
+    def _read_waveform(self, channel, preamble, out):
+        raw_data = self._visainstrument.query_binary_values(
+            ":WAV:SOURce " + channel.value + "; :WAV:DATA?", "h", True,
+            container=np.array)
+        np.multiply(raw_data, preamble["yincrement"], out=out)
 
     def get_data_raw(self, *channels):
         """
@@ -181,6 +270,7 @@ class Keysight_DSOX2014(Instrument):
             The new range for the time axis, in seconds
         """
         self._visainstrument.write(":TIMebase:RANGe %.2e"%time_range)
+        self._preambles.clear()
 
     def get_time_range(self):
         """
@@ -200,6 +290,7 @@ class Keysight_DSOX2014(Instrument):
         Set the time offset from the trigger event in seconds
         """
         self._visainstrument.write(":TIMebase:POSition %.2e"%time_offset)
+        self._preambles.clear()
         return self.get_time_offset()
 
     def do_set_nop(self, nop):
@@ -212,6 +303,7 @@ class Keysight_DSOX2014(Instrument):
             Channel number of points, from 100 to 1000 in NORMal mode
         """
         self._visainstrument.write(":WAV:POINts "+str(nop))
+        self._preambles.clear()
 
     def do_get_nop(self):
         """
@@ -232,6 +324,7 @@ class Keysight_DSOX2014(Instrument):
             self._visainstrument.write(":ACQuire:TYPE NORMal")
         else:
             self._visainstrument.write(":ACQuire:TYPE AVERage; :ACQuire:COUNt "+str(averages))
+        self._preambles.clear()
 
     def do_get_averages(self):
         """
@@ -255,6 +348,7 @@ class Keysight_DSOX2014(Instrument):
         """
         for channel in channels:
             self._visainstrument.write("%s:OFFSet %f"%(channel.value, offset))
+            self._preambles.pop(channel, None)
 
     def get_offset(self, *channels):
         """
@@ -22,7 +22,7 @@ import visa
 import types
 import logging
 import numpy as np
-import struct
+from contextlib import contextmanager
 from itertools import chain
 
 
@@ -72,6 +72,11 @@ class Tektronix_AWG5014(Instrument):
         self._waveforms = [None] * 4
         self._amplitudes = [None] * 4
         self._markers = [None] * 8
+        # {channel: waveform} and {marker_id: waveform} staged until
+        # commit(), None when the waveforms are output immediately
+        self._staged_waveforms = None
+        self._staged_markers = None
+        self._staged_repetition_rate = None
         self._clear_all_waveforms()
         self._marker_enob = marker_enob
         self._marker_voltages = [{} for _ in range(8)]
@@ -94,6 +99,9 @@ class Tektronix_AWG5014(Instrument):
         channel: int
             1..4 for DACs or -1..-8 for corresponding marker outputs, two for one
             DAC
+
+        Between stage() and commit() the waveforms are only stored and are
+        sent all together by commit()
         """
 
         def clear_unmatched_waveforms(channel):
@@ -110,6 +118,11 @@ class Tektronix_AWG5014(Instrument):
 
         waveform = np.array(waveform)
 
+        if self._staged_waveforms is not None and channel in [1, 2, 3, 4]:
+            self._staged_waveforms[channel] = waveform
+            self._staged_repetition_rate = repetition_rate
+            return
+
         if channel in [1, 2, 3, 4]:
             clear_unmatched_waveforms(channel)
             self._waveforms[channel - 1] = waveform
@@ -148,6 +161,11 @@ class Tektronix_AWG5014(Instrument):
 
                 self.set_marker_voltages(marker_id, marker_low, marker_high)
 
+            if self._staged_waveforms is not None:
+                self._staged_markers[marker_id] = marker_waveform
+                self._staged_repetition_rate = repetition_rate
+                return
+
             self._markers[marker_id - 1] = marker_waveform
 
             if not asynchronous:
@@ -169,6 +187,84 @@ class Tektronix_AWG5014(Instrument):
                 self.run()
                 self._visainstrument.query("*OPC?")
 
+    def stage(self):
+        """
+        Starts collecting the waveforms of all the channels and markers
+        passed to output_arbitrary_waveform, so that they are sent by
+        commit() with a single run and completion wait
+        """
+        if self._staged_waveforms is None:
+            self._staged_waveforms = {}
+            self._staged_markers = {}
+
+    def commit(self, asynchronous=False):
+        """
+        Sends the staged waveforms, loads them into their channels and
+        starts the output once
+
+        Parameters:
+        -----------
+        asynchronous: bool
+            if False, waits until the AWG has finished loading
+        """
+        waveforms, self._staged_waveforms = self._staged_waveforms, None
+        markers, self._staged_markers = self._staged_markers, None
+        if not waveforms and not markers:
+            return
+
+        lengths = set([len(waveform) for waveform in waveforms.values()] +
+                      [len(marker) for marker in markers.values()])
+        if len(lengths) != 1:
+            raise ValueError("Staged waveforms have different lengths: %s" %
+                             sorted(lengths))
+        length = lengths.pop()
+
+        for channel, waveform in waveforms.items():
+            self._waveforms[channel - 1] = waveform
+        for marker_id, marker_waveform in markers.items():
+            self._markers[marker_id - 1] = marker_waveform
+        channels = set(waveforms) | \
+            set(marker_id // 2 + marker_id % 2 for marker_id in markers)
+
+        # the channels that were not staged are cleared if they do not match
+        # the new length, as in output_arbitrary_waveform
+        for idx, existing_waveform in enumerate(self._waveforms):
+            if idx + 1 not in channels and existing_waveform is not None \
+                    and len(existing_waveform) != length:
+                self._waveforms[idx] = None
+                self._markers[idx * 2] = None
+                self._markers[idx * 2 + 1] = None
+                self._clear_waveform(idx + 1)
+
+        for channel in sorted(channels):
+            waveform = self._waveforms[channel - 1]
+            if waveform is None or len(waveform) != length:
+                # only the markers of this channel were staged
+                waveform = np.zeros(length)
+            norm = self._amplitudes[channel - 1] / 2
+            self.set_waveform(waveform / norm, self._staged_repetition_rate, channel)
+            self.set_output(1, channel)
+        self.run()
+        if not asynchronous:
+            self._visainstrument.query("*OPC?")
+
+    @contextmanager
+    def staged_output(self, asynchronous=False):
+        """
+        Stages the waveforms output within the with-block and commits them
+        at its end; nested blocks are committed by the outermost one
+        """
+        if self._staged_waveforms is not None:
+            yield self
+            return
+        self.stage()
+        try:
+            yield self
+        except:
+            self._staged_waveforms = self._staged_markers = None
+            raise
+        self.commit(asynchronous)
+
     def _clear_waveform(self, channel):
         self._visainstrument.write('WLIST:WAVeform:DELETE "CH%iWFM"' % channel)
 
@@ -251,10 +347,12 @@ class Tektronix_AWG5014(Instrument):
         self._values['files'][filename]['clock'] = clock
         self._values['files'][filename]['nop'] = len(w)
 
-        m = m1 + np.multiply(m2, 2)
-        ws = bytes()
-        for i in range(0, len(w)):
-            ws = ws + struct.pack('<fB', w[i], int(m[i]))
+        # packed records of a float32 sample and a byte of markers, the same
+        # as struct.pack('<fB', ...) for each point
+        records = np.empty(len(w), dtype=[('w', '<f4'), ('m', 'u1')])
+        records['w'] = w
+        records['m'] = m1 + np.multiply(m2, 2)
+        ws = records.tobytes()
 
         s1 = str.encode('MMEM:DATA "%s",' % filename)
         s3 = str.encode('MAGIC 1000\n')
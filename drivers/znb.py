@@ -9,6 +9,11 @@ class Znb(instr.Instr):
         self.cls()
         # self.current_channel = 0
         # self.current_measurement_name = None
+        self._binary_transfer = False
+        # the format is switched back to REAL,32 by the next trace query
+        # after the frequencies are read as REAL,64
+        self._restore_real32 = False
+        self._segments = None
         self._visainstrument.read_termination = '\n'
         self._visainstrument.timeout = 5000
         self.write("ROSCillator EXT")
@@ -23,7 +28,7 @@ class Znb(instr.Instr):
         else:
             return False
         self.set_current_channel_and_trace(self.current_channel, self.current_measurement_name)
-        self.set_data_format("ASCII")
+        self.setup_binary_transfer()
 
     def get_parameters(self):
         """
@@ -34,7 +39,8 @@ class Znb(instr.Instr):
                   "nop":self.get_nop(),
                   "power":self.get_power(),
                   "averages":self.get_averages(),
-                  "freq_limits":self.get_freq_limits()}
+                  "freq_limits":self.get_freq_limits(),
+                  "segments":self.get_segments()}
 
     def set_parameters(self, parameters_dict):
         """
@@ -53,6 +59,8 @@ class Znb(instr.Instr):
             self.set_freq_limits(*parameters_dict["freq_limits"])
         if "trigger_type" in parameters_dict.keys():
             self.set_trigger_type(parameters_dict["trigger_type"])
+        if parameters_dict.get("segments") is not None:
+            self.set_segments(parameters_dict["segments"])
 
     def select_S_param(self, S_param, channel=1):
         """
@@ -77,6 +85,27 @@ class Znb(instr.Instr):
             return None
         else:
             self.write("FORMat {1}".format(self.current_channel, data_format))
+            self._binary_transfer = data_format.upper().replace(" ", "") == "REAL,32"
+            self._restore_real32 = False
+
+    def setup_binary_transfer(self):
+        """
+        Switches the trace transfer to little-endian REAL,32 binary blocks,
+        which are read directly into numpy arrays by get_sdata and get_fdata
+        """
+        self.write("FORMat REAL,32;:FORMat:BORDer SWAPped")
+        self._binary_transfer = True
+        self._restore_real32 = False
+
+    def _query_trace(self, command):
+        if self._binary_transfer:
+            if self._restore_real32:
+                command = "FORMat REAL,32;:" + command
+                self._restore_real32 = False
+            return self._visainstrument.query_binary_values(command, datatype='f',
+                                                            is_big_endian=False,
+                                                            container=np.array)
+        return self._visainstrument.query_ascii_values(command, container=np.array)
 
     def set_power(self, power_dBm):
         self.write("SOURce{0}:POWer {1}".format(self.current_channel, power_dBm))
@@ -85,6 +114,12 @@ class Znb(instr.Instr):
     def get_power(self):
         return float(self.query("SOURce%d:POWer?"%self.current_channel))
 
+    def do_set_power(self, power_dBm):
+        """
+        Same as set_power, for compatibility with the Agilent_PNA_L driver
+        """
+        self.set_power(power_dBm)
+
     def set_power_off(self):
         self.write("SOURce{0}:POWer:STATe OFF".format(self.current_channel))
 
@@ -140,29 +175,31 @@ class Znb(instr.Instr):
 
     def set_bandwidth(self, if_bw):
         self.write("SENSe{0}:BANDwidth {1}".format(self.current_channel, if_bw))
-        bla = self.query("SENSe{0}:BANDwidth?".format(self.current_channel))
-        try:
-            actual_bw = int(bla)
-        except:
-            print("ERROR in set_if_bw(): value returned by ZNB is not an integer.")
-            actual_bw = -1
-        return actual_bw
 
     def get_bandwidth(self):
         return int(self.query("SENSe{0}:BANDwidth?".format(self.current_channel)))
 
     def get_frequencies(self):
-        freqtext = self.query("CALCulate{0}:DATA:STIMulus?".format(self.current_channel))
-        return np.array([float(txt) for txt in freqtext.split(',')])
+        command = "CALCulate{0}:DATA:STIMulus?".format(self.current_channel)
+        if not self._binary_transfer:
+            return self._visainstrument.query_ascii_values(command, container=np.array)
+        # single precision is not enough for the frequencies, so they are
+        # transferred as REAL,64 in the same query that switches the format
+        self._restore_real32 = True
+        return self._visainstrument.query_binary_values("FORMat REAL,64;:" + command,
+                                                        datatype='d',
+                                                        is_big_endian=False,
+                                                        container=np.array)
 
     def get_sdata(self):
-        text = self.query("CALCulate{0}:DATA? SDATA".format(self.current_channel))
-        values_interlaced = np.array([float(txt) for txt in text.split(',')])
+        values_interlaced = self._query_trace("CALCulate{0}:DATA? SDATA".format(self.current_channel))
+        if self._binary_transfer:
+            # interlaced float32 pairs are reinterpreted as complex64 in place
+            return values_interlaced.view(np.complex64)
         return values_interlaced[0::2] + 1j*values_interlaced[1::2]
 
     def get_fdata(self):
-        text = self.query("CALCulate{0}:DATA? FDATA".format(self.current_channel))
-        return np.array([float(txt) for txt in text.split(',')])
+        return self._query_trace("CALCulate{0}:DATA? FDATA".format(self.current_channel))
 
 
     def set_format(self, format):
@@ -205,17 +242,52 @@ class Znb(instr.Instr):
     def set_freq_limits(self, start, stop):
         self.set_xlim(start, stop)
 
+    def set_segments(self, segments):
+        """
+        Switches to the segmented sweep over the given frequency windows, so
+        that only the interesting parts of the spectrum are measured in one
+        sweep. The data of all the segments is returned as one trace.
+
+        Parameters:
+        -----------
+        segments: list
+            [(start, stop, nop), ...] in Hz, sorted and not overlapping
+        """
+        segments = [(float(start), float(stop), int(nop)) for start, stop, nop in segments]
+        for (start, stop, nop), next_segment in zip(segments, segments[1:] + [None]):
+            if stop < start or (next_segment is not None and next_segment[0] <= stop):
+                raise ValueError("Segments must be sorted and must not overlap")
+
+        self.write("SENSe{0}:SEGMent:DELete:ALL".format(self.current_channel))
+        for idx, (start, stop, nop) in enumerate(segments, 1):
+            self.write("SENSe{0}:SEGMent{1}:ADD".format(self.current_channel, idx))
+            self.write("SENSe{0}:SEGMent{1}:FREQuency:STARt {2}".format(self.current_channel, idx, round(start)))
+            self.write("SENSe{0}:SEGMent{1}:FREQuency:STOP {2}".format(self.current_channel, idx, round(stop)))
+            self.write("SENSe{0}:SEGMent{1}:SWEep:POINts {2}".format(self.current_channel, idx, nop))
+            self.write("SENSe{0}:SEGMent{1}:STATe ON".format(self.current_channel, idx))
+        self.write("SENSe{0}:SWEep:TYPE SEGMent".format(self.current_channel))
+        self._segments = segments
+
+    def get_segments(self):
+        """
+        Returns the list of (start, stop, nop) of the segmented sweep or None
+        if the sweep is not segmented
+        """
+        return self._segments
+
     def get_freq_limits(self):
         start = float(self.query("SENSe{0}:FREQuency:STARt?".format(self.current_channel)))
         stop = float(self.query("SENSe{0}:FREQuency:STOP?".format(self.current_channel)))
         return start, stop
 
     def set_xlim(self, fstart, fstop):
+        self._segments = None
         self.write("SENSe{0}:SWEep:TYPE LINear".format(self.current_channel))
         self.write("SENSe{0}:FREQuency:STARt {1}".format(self.current_channel, int(fstart)))
         self.write("SENSe{0}:FREQuency:STOP {1}".format(self.current_channel, int(fstop)))
 
     def set_freq_center_span(self, fcenter, fspan):
+        self._segments = None
         self.write("SENSe{0}:SWEep:TYPE LINear".format(self.current_channel))
         self.write("SENSe{0}:FREQuency:CENTer {1}".format(self.current_channel, int(fcenter)))
         self.write("SENSe{0}:FREQuency:SPAN {1}".format(self.current_channel, int(fspan)))
@@ -4,47 +4,277 @@ import os
 from lib import plotting as pl
 from lib.measurement import Measurement
 import numpy as np
+from datetime import datetime
+from lib.iq_mixer_calibration import IQCalibrationData
 
 
-def save_IQMX_calibration(iqmx_calibration):
-    directory = 'Data\\IQMXCalibration'
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+class IQCalibrationDatabase():
+    """
+    Storage of the IQ mixer calibrations where every calibration is written
+    into a separate file:
 
-    filename = iqmx_calibration.get_mixer_parameters()["mixer_id"]
-    try:
-        with open(directory + "\\" + filename + '.pkl', 'rb') as f:
-            known_cal_data = pkl.load(f)
+        <directory>/<mixer_id>/<iq_attenuation>/lo=... if=... ... .pkl
 
-        try:
-            cal_for_known_attenuation = known_cal_data[iqmx_calibration.get_mixer_parameters()["iq_attenuation"]]
-            cal_for_known_attenuation[frozenset(iqmx_calibration.get_radiation_parameters().items())] = iqmx_calibration
-        except KeyError:
-            known_cal_data[iqmx_calibration.get_mixer_parameters()["iq_attenuation"]] = \
-                {frozenset(iqmx_calibration.get_radiation_parameters().items()): iqmx_calibration}
+    The radiation parameters are encoded in the file names with all the
+    digits needed to restore them exactly, so the index over (attenuation, LO
+    frequency, IF frequency, LO power, SSB power, waveform resolution) of a
+    mixer is built by listing its directory without unpickling anything, and
+    it is the same in every session. Calibrations are unpickled lazily and
+    cached. The modification times and sizes of the files are checked on each
+    access, and the index entries and cached calibrations of the files added,
+    removed or rewritten by somebody else are updated.
 
-        with open(directory + "\\" + filename + '.pkl', 'wb') as f:
-            pkl.dump(known_cal_data, f)
+    Calibrations from the old single-file database of a mixer are moved into
+    the new storage the first time the mixer is accessed.
+    """
 
-    except FileNotFoundError:
-        new_cal_data = {iqmx_calibration.get_mixer_parameters()["iq_attenuation"]: {
-            frozenset(iqmx_calibration.get_radiation_parameters().items()): iqmx_calibration}}
+    # %.17g restores any float exactly
+    _record_format = "lo=%.17g if=%.17g lop=%.17g ssb=%.17g res=%.17g.pkl"
 
-        with open(directory + "\\" + filename + '.pkl', 'w+b') as f:
-            pkl.dump(new_cal_data, f)
+    def __init__(self, directory=os.path.join("Data", "IQMXCalibration")):
+        self._directory = directory
+        self._indices = {}
+        self._calibrations = {}
 
+    def save(self, iqmx_calibration):
+        mixer_pars = iqmx_calibration.get_mixer_parameters()
+        rad_pars = iqmx_calibration.get_radiation_parameters()
+        index = self._get_index(mixer_pars["mixer_id"])
+        record_directory = os.path.join(self._directory, mixer_pars["mixer_id"],
+                                        str(mixer_pars["iq_attenuation"]))
+        if not os.path.exists(record_directory):
+            os.makedirs(record_directory)
 
-def load_IQMX_calibration_database(mixer_id, iq_attenuation):
-    directory = 'Data\\IQMXCalibration'
-    filename = mixer_id
+        key = (mixer_pars["iq_attenuation"], rad_pars["lo_frequency"],
+               rad_pars["if_frequency"], rad_pars["lo_power"],
+               rad_pars["ssb_power"], rad_pars["waveform_resolution"])
+        path = os.path.join(record_directory, self._record_format % key[1:])
+        with open(path + ".tmp", 'w+b') as f:
+            pkl.dump(iqmx_calibration, f)
+        os.replace(path + ".tmp", path)
 
-    try:
-        with open(directory + "\\" + filename + '.pkl', 'rb') as f:
-            known_cal_data = pkl.load(f)
+        # the same calibration may be stored under a name in an older format
+        for old_path in [old_path for old_key, old_path in
+                         zip(index["keys"], index["paths"])
+                         if old_path != path and tuple(old_key) == key]:
+            os.remove(old_path)
+
+        self._calibrations[path] = iqmx_calibration
+        self._get_index(mixer_pars["mixer_id"])
+
+    def get(self, mixer_id, iq_attenuation, lo_frequency, if_frequency,
+            lo_power, ssb_power, waveform_resolution=1):
+        """
+        Returns the calibration with exactly the same parameters or None
+        """
+        keys, paths = self._select(mixer_id, iq_attenuation, if_frequency,
+                                   lo_power, waveform_resolution)
+        match = np.nonzero((keys[:, 1] == lo_frequency) &
+                           (keys[:, 2] == if_frequency) &
+                           (keys[:, 4] == ssb_power))[0]
+        return self._load(paths[match[0]]) if len(match) > 0 else None
 
-    except FileNotFoundError:
+    def get_nearest(self, mixer_id, iq_attenuation, lo_frequency, if_frequency,
+                    lo_power, ssb_power, waveform_resolution=1):
+        """
+        Returns the calibration with the same attenuation, LO power and
+        waveform resolution that is the closest in LO and IF frequencies
+        and SSB power, or None if there are no such calibrations
+        """
+        keys, paths = self._select(mixer_id, iq_attenuation, if_frequency,
+                                   lo_power, waveform_resolution)
+        if len(paths) == 0:
+            return None
+        distances = abs(keys[:, 1] - lo_frequency) / 1e9 + \
+                    abs(keys[:, 2] - if_frequency) / 1e8 + \
+                    abs(keys[:, 4] - ssb_power) / 10
+        return self._load(paths[np.argmin(distances)])
+
+    def get_interpolated(self, mixer_id, iq_attenuation, lo_frequency,
+                         if_frequency, lo_power, ssb_power,
+                         waveform_resolution=1, max_lo_gap=100e6):
+        """
+        Returns the calibration for the requested parameters obtained by the
+        linear interpolation over the LO frequency between two calibrations
+        that differ from the requested one only in the LO frequency and are
+        not more than max_lo_gap apart. If the requested LO frequency is not
+        bracketed, the closest calibration not further than max_lo_gap / 2 is
+        returned. Otherwise returns None.
+        """
+        keys, paths = self._select(mixer_id, iq_attenuation, if_frequency,
+                                   lo_power, waveform_resolution)
+        same = np.nonzero((keys[:, 2] == if_frequency) &
+                          (keys[:, 4] == ssb_power))[0]
+        lo_frequencies = keys[same, 1]
+        exact = same[lo_frequencies == lo_frequency]
+        if len(exact) > 0:
+            return self._load(paths[exact[0]])
+
+        below = same[lo_frequencies < lo_frequency]
+        above = same[lo_frequencies > lo_frequency]
+        lower = below[np.argmax(keys[below, 1])] if len(below) > 0 else None
+        upper = above[np.argmin(keys[above, 1])] if len(above) > 0 else None
+
+        if lower is not None and upper is not None and \
+                keys[upper, 1] - keys[lower, 1] <= max_lo_gap:
+            weight = (lo_frequency - keys[lower, 1]) / \
+                     (keys[upper, 1] - keys[lower, 1])
+            return self._interpolate(self._load(paths[lower]),
+                                     self._load(paths[upper]),
+                                     weight, lo_frequency)
+
+        for neighbour in (lower, upper):
+            if neighbour is not None and \
+                    abs(keys[neighbour, 1] - lo_frequency) <= max_lo_gap / 2:
+                return self._load(paths[neighbour])
         return None
-    return known_cal_data[iq_attenuation]
+
+    def get_calibrations(self, mixer_id, iq_attenuation):
+        """
+        Returns a dictionary with all calibrations for the mixer and the
+        attenuation keyed by frozensets of their radiation parameters
+        """
+        index = self._get_index(mixer_id)
+        calibrations = [self._load(path) for key, path in
+                        zip(index["keys"], index["paths"])
+                        if key[0] == iq_attenuation]
+        return {frozenset(cal.get_radiation_parameters().items()): cal
+                for cal in calibrations}
+
+    def invalidate(self, mixer_id=None):
+        """
+        Drops the cached index and calibrations for the mixer or for all mixers
+        """
+        mixer_ids = list(self._indices.keys()) if mixer_id is None else [mixer_id]
+        for mixer_id in mixer_ids:
+            index = self._indices.pop(mixer_id, None)
+            if index is not None:
+                for path in index["paths"]:
+                    self._calibrations.pop(path, None)
+
+    def _select(self, mixer_id, iq_attenuation, if_frequency, lo_power,
+                waveform_resolution):
+        index = self._get_index(mixer_id)
+        keys = index["keys"]
+        mask = (keys[:, 0] == iq_attenuation) & \
+               (keys[:, 3] == lo_power) & \
+               (keys[:, 5] == waveform_resolution) & \
+               ((keys[:, 2] == 0) == (if_frequency == 0))
+        selected = np.nonzero(mask)[0]
+        return keys[selected], [index["paths"][idx] for idx in selected]
+
+    def _get_index(self, mixer_id):
+        mixer_directory = os.path.join(self._directory, mixer_id)
+        if not os.path.exists(mixer_directory):
+            first_access = mixer_id not in self._indices
+            self.invalidate(mixer_id)
+            self._indices[mixer_id] = {"keys": np.zeros((0, 6)), "paths": [],
+                                       "signatures": {}}
+            if first_access:
+                self._import_legacy_database(mixer_id)
+            return self._indices[mixer_id]
+
+        signatures = self._get_signatures(mixer_directory)
+        index = self._indices.get(mixer_id)
+        if index is not None and index["signatures"] == signatures:
+            return index
+
+        if index is not None:
+            # only the changed files are unpickled again
+            for path, signature in index["signatures"].items():
+                if signatures.get(path) != signature:
+                    self._calibrations.pop(path, None)
+
+        keys, paths = [], []
+        for path in sorted(signatures):
+            attenuation, filename = path.split(os.sep)[-2:]
+            try:
+                values = [float(item.split("=")[1]) for item in
+                          filename[:-len(".pkl")].split(" ")]
+                keys.append([float(attenuation)] + values)
+            except (IndexError, ValueError):
+                continue
+            paths.append(path)
+
+        self._indices[mixer_id] = {"keys": np.array(keys).reshape(-1, 6),
+                                   "paths": paths,
+                                   "signatures": signatures}
+        return self._indices[mixer_id]
+
+    @staticmethod
+    def _get_signatures(mixer_directory):
+        """
+        Returns {path: (modification time in ns, size)} of the records
+        """
+        signatures = {}
+        for attenuation_entry in os.scandir(mixer_directory):
+            if not attenuation_entry.is_dir():
+                continue
+            for entry in os.scandir(attenuation_entry.path):
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed while listing
+                    continue
+                signatures[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def _import_legacy_database(self, mixer_id):
+        try:
+            with open(os.path.join(self._directory, mixer_id + '.pkl'), 'rb') as f:
+                known_cal_data = pkl.load(f)
+        except FileNotFoundError:
+            return
+        for cal_for_attenuation in known_cal_data.values():
+            for iqmx_calibration in cal_for_attenuation.values():
+                self.save(iqmx_calibration)
+
+    def _load(self, path):
+        iqmx_calibration = self._calibrations.get(path)
+        if iqmx_calibration is None:
+            with open(path, 'rb') as f:
+                iqmx_calibration = pkl.load(f)
+            self._calibrations[path] = iqmx_calibration
+        return iqmx_calibration
+
+    @staticmethod
+    def _interpolate(lower, upper, weight, lo_frequency):
+        lower_pars, lower_results = lower.get_optimization_results()
+        upper_pars = upper.get_optimization_results()[0]
+
+        def interpolate(name):
+            if lower_pars[name] is None or upper_pars[name] is None:
+                return None
+            return (1 - weight) * np.asarray(lower_pars[name]) + \
+                   weight * np.asarray(upper_pars[name])
+
+        rad_pars = lower.get_radiation_parameters()
+        mixer_pars = lower.get_mixer_parameters()
+        return IQCalibrationData(mixer_pars["mixer_id"],
+                                 mixer_pars["iq_attenuation"],
+                                 lo_frequency, rad_pars["lo_power"],
+                                 rad_pars["if_frequency"], rad_pars["ssb_power"],
+                                 rad_pars["waveform_resolution"],
+                                 interpolate("dc_offsets"),
+                                 interpolate("dc_offset_open"),
+                                 interpolate("if_offsets"),
+                                 interpolate("if_amplitudes"),
+                                 interpolate("if_phase"),
+                                 lower_results, 0, datetime.now())
+
+
+IQMX_calibration_database = IQCalibrationDatabase()
+
+
+def save_IQMX_calibration(iqmx_calibration):
+    IQMX_calibration_database.save(iqmx_calibration)
+
+
+def load_IQMX_calibration_database(mixer_id, iq_attenuation):
+    calibrations = IQMX_calibration_database.get_calibrations(mixer_id,
+                                                              iq_attenuation)
+    return calibrations if len(calibrations) > 0 else None
 
 
 def save_measurement(measurement, filename, plot_amps_kwargs={}, plot_phas_kwargs={}, plot_kwargs={}):
@@ -118,8 +118,7 @@ class IQCalibrator():
                 amplitudes=(0,0), relative_phase=0, offsets=dc_offsets,
                 waveform_resolution=waveform_resolution,
                 optimized = self._optimized_awg_calls)
-            self._sa.prepare_for_stb();self._sa.sweep_single();self._sa.wait_for_stb()
-            data = self._sa.get_tracedata()
+            data = list(self._sa.sweep_and_fetch())
             self._iterations += 1
             print("\rDC offsets: ", format_number_list(dc_offsets),
                                     format_number_list(data), self._iterations,
@@ -135,8 +134,7 @@ class IQCalibrator():
                 waveform_resolution=waveform_resolution,
                 optimized = self._optimized_awg_calls)
 
-            self._sa.prepare_for_stb();self._sa.sweep_single();self._sa.wait_for_stb()
-            data = self._sa.get_tracedata()
+            data = list(self._sa.sweep_and_fetch())
 
             print("\rDC offsets open: ", format_number_list([dc_offset_open]*2),
                                          format_number_list(data),
@@ -155,8 +153,7 @@ class IQCalibrator():
                 amplitudes=if_amplitudes, relative_phase=phase, offsets=if_offsets,
                 waveform_resolution=waveform_resolution,
                 optimized = self._optimized_awg_calls)
-            self._sa.prepare_for_stb();self._sa.sweep_single();self._sa.wait_for_stb()
-            data = self._sa.get_tracedata()
+            data = list(self._sa.sweep_and_fetch())
 
             print("\rIF offsets: ", format_number_list(if_offsets),
                                     format_number_list(data),
@@ -176,8 +173,7 @@ class IQCalibrator():
                 amplitudes=if_amplitudes, relative_phase=phase, offsets=if_offsets,
                 waveform_resolution=waveform_resolution,
                 optimized = self._optimized_awg_calls)
-            self._sa.prepare_for_stb();self._sa.sweep_single();self._sa.wait_for_stb()
-            data = self._sa.get_tracedata()
+            data = list(self._sa.sweep_and_fetch())
 
             answer = None
             if abs(abs(amp1)-abs(amp2))<.2:
@@ -207,8 +203,7 @@ class IQCalibrator():
                 amplitudes=if_amplitudes, relative_phase=phase, offsets=if_offsets,
                 waveform_resolution=waveform_resolution,
                 optimized = self._optimized_awg_calls)
-            self._sa.prepare_for_stb();self._sa.sweep_single();self._sa.wait_for_stb()
-            data = self._sa.get_tracedata()
+            data = list(self._sa.sweep_and_fetch())
 
             print("\rPhase: ", "%3.2f"%(phase/pi*180), format_number_list(data), end="             ", flush=True)
             clear_output(wait=True)
@@ -300,6 +295,263 @@ class IQCalibrator():
              self._sa.setup_swept_sa(lo_frequency, 10*if_frequency if if_frequency>0 else 1e9, nop=1001, rbw=1e5)
              self._sa.set_continuous()
 
+class IQSurrogateCalibrator(IQCalibrator):
+
+    def __init__(self, awg, sa, lo, mixer_id, iq_attenuation,
+                 sideband_to_maintain="left", sidebands_to_suppress=6,
+                 optimized_awg_calls=True):
+        """
+        IQSurrogateCalibrator performs the same calibration as IQCalibrator
+        but instead of running Nelder-Mead directly on the instruments it
+        measures small batches of probe points around the current guess, fits
+        a local quadratic model of the linear (mW) power of the unwanted
+        spectral components and jumps to the optimum of that model.
+
+        The LO leakage and the image power are quadratic in the dc offsets,
+        amplitude imbalance and phase error near the optimum, so a few rounds
+        are usually enough. Previous calibrations from the database may be
+        used as warm starts, then the probe steps are reduced accordingly.
+        """
+        super().__init__(awg, sa, lo, mixer_id, iq_attenuation,
+                         sideband_to_maintain, sidebands_to_suppress,
+                         optimized_awg_calls)
+        self._dc_offsets_step = 0.05
+        self._if_amplitudes_step = 0.05
+        self._if_phase_step = 0.1
+        self._warm_start_step_factor = 0.2
+
+    def calibrate(self, lo_frequency, if_frequency, lo_power, ssb_power,
+                  waveform_resolution=1, initial_guess=None,
+                  sa_res_bandwidth=500, iterations=2, max_rounds=4):
+        """
+        Perform the calibration routine to suppress LO and upper sideband
+        LO+IF while maintaining the lower sideband at ssb_power.
+
+        Parameters are the same as for IQCalibrator.calibrate(...) except:
+        ----------
+        initial_guess=None : dict or IQCalibrationData
+            Initial guess for the optimization parameters; a known
+            calibration, e.g. from IQCalibrationDatabase.get_nearest(...),
+            is used as a warm start with smaller initial steps
+        iterations=2: int
+            The number of iterations of the cycle {optimize_if_offsets,
+            optimize_image, adjust_ssb_power}
+        max_rounds=4: int
+            The maximum number of probe batches for each quadratic search
+
+        Returns:
+        iqmx_calibration: IQCalibrationData
+            Object containing the parameters and results of the optimization
+        """
+        self._iterations = 0
+        step_factor = 1
+
+        if isinstance(initial_guess, IQCalibrationData):
+            step_factor = self._warm_start_step_factor
+            initial_guess = initial_guess.get_optimization_results()[0]
+
+        results = {"dc_offsets": (1, 1), "dc_offset_open": 1,
+                   "if_offsets": None, "if_amplitudes": (0.5, 0.5),
+                   "if_phase": pi * 0.54}
+        if initial_guess is not None:
+            results.update({key: value for key, value in initial_guess.items()
+                            if value is not None})
+
+        def measure(offsets, amplitudes=(0, 0), phase=0, frequency=0):
+            self._awg.output_continuous_IQ_waves(frequency=frequency,
+                amplitudes=amplitudes, relative_phase=phase, offsets=offsets,
+                waveform_resolution=waveform_resolution,
+                optimized=self._optimized_awg_calls)
+            data = list(self._sa.sweep_and_fetch())
+            self._iterations += 1
+            if self.side == "right":
+                data.reverse()
+            return data
+
+        def sideband_amplitudes(x, mean_amplitude):
+            return (mean_amplitude * (1 + x[1]), mean_amplitude * (1 - x[1]))
+
+        try:
+            start = datetime.now()
+
+            self._lo.set_power(lo_power)
+            self._lo.set_frequency(lo_frequency)
+            self._lo.set_output_state("ON")
+
+            self._sa.setup_list_sweep([lo_frequency], [sa_res_bandwidth])
+
+            dc_offsets, dc_power = self._quadratic_search(
+                lambda x: 10 ** (measure(x)[0] / 10),
+                results["dc_offsets"], self._dc_offsets_step * step_factor,
+                max_rounds, "DC offsets")
+            results["dc_offsets"] = dc_offsets
+
+            if if_frequency == 0:
+                dc_offset_open = float(ravel(results["dc_offset_open"])[0])
+                data = measure((dc_offset_open,) * 2)
+                for i in range(iterations * max_rounds):
+                    if abs(data[0] - ssb_power) < 0.1:
+                        break
+                    # LO power is quadratic in the open offset, so scale it
+                    dc_offset_open = clip(dc_offset_open *
+                                          10 ** ((ssb_power - data[0]) / 20),
+                                          -1, 1)
+                    data = measure((dc_offset_open,) * 2)
+                results["dc_offset_open"] = array([dc_offset_open])
+                spectral_values = {"dc": 10 * log10(dc_power), "dc_open": data}
+                elapsed_time = (datetime.now() - start).total_seconds()
+                print("\nCalibration finished after %d spectra" % self._iterations)
+                return IQCalibrationData(self._mixer_id, self._iq_attenuation,
+                    lo_frequency, lo_power, if_frequency, ssb_power, waveform_resolution,
+                    results["dc_offsets"], array([results["dc_offset_open"]] * 2),
+                    None, None, None, spectral_values,
+                    elapsed_time, datetime.now())
+
+            self._sa.setup_list_sweep(list(arange(lo_frequency-self._N_sup//2*if_frequency,\
+                                                     lo_frequency+(self._N_sup//2+1)*if_frequency,\
+                                                      if_frequency)-if_frequency), [sa_res_bandwidth]*3)
+            ssb_idx = self._N_sup // 2
+            lo_idx = ssb_idx + 1
+            if results["if_offsets"] is None:
+                results["if_offsets"] = results["dc_offsets"]
+
+            amplitudes = array(results["if_amplitudes"], dtype=float)
+            mean_amplitude = mean(abs(amplitudes))
+            image_x = array([float(ravel(results["if_phase"])[0]),
+                             (abs(amplitudes[0]) - abs(amplitudes[1])) /
+                             (2 * mean_amplitude)])
+
+            for i in range(iterations):
+                if_offsets, lo_power_lin = self._quadratic_search(
+                    lambda x: 10 ** (measure(x, sideband_amplitudes(image_x, mean_amplitude),
+                                             image_x[0], if_frequency)[lo_idx] / 10),
+                    results["if_offsets"], self._dc_offsets_step * step_factor,
+                    max_rounds, "IF offsets")
+                results["if_offsets"] = if_offsets
+
+                image_x, image_power = self._quadratic_search(
+                    lambda x: sum([10 ** (psd / 10) for idx, psd in
+                                   enumerate(measure(if_offsets,
+                                                     sideband_amplitudes(x, mean_amplitude),
+                                                     x[0], if_frequency))
+                                   if idx not in (ssb_idx, lo_idx)]),
+                    image_x, (self._if_phase_step * step_factor,
+                              self._if_amplitudes_step * step_factor),
+                    max_rounds, "Phase and imbalance")
+
+                # sideband power is quadratic in the amplitude, so rescale it
+                data = measure(if_offsets, sideband_amplitudes(image_x, mean_amplitude),
+                               image_x[0], if_frequency)
+                mean_amplitude = minimum(mean_amplitude *
+                                         10 ** ((ssb_power - data[ssb_idx]) / 20),
+                                         1 / (1 + abs(image_x[1])))
+                step_factor = self._warm_start_step_factor
+
+            results["if_amplitudes"] = array(sideband_amplitudes(image_x, mean_amplitude))
+            results["if_phase"] = image_x[0]
+            data = measure(results["if_offsets"], results["if_amplitudes"],
+                           results["if_phase"], if_frequency)
+            if self.side == "right":
+                # store the spectrum in the analyzer order as IQCalibrator does
+                data.reverse()
+            spectral_values = {"dc": 10 * log10(dc_power), "if": data}
+            elapsed_time = (datetime.now() - start).total_seconds()
+            print("\nCalibration finished after %d spectra" % self._iterations)
+            return IQCalibrationData(self._mixer_id, self._iq_attenuation,
+                lo_frequency, lo_power, if_frequency, ssb_power, waveform_resolution,
+                results["dc_offsets"], None, results["if_offsets"], results["if_amplitudes"],
+                results["if_phase"], spectral_values, elapsed_time, datetime.now())
+
+        except KeyboardInterrupt:
+            return results
+
+        finally:
+             self._sa.setup_swept_sa(lo_frequency, 10*if_frequency if if_frequency>0 else 1e9, nop=1001, rbw=1e5)
+             self._sa.set_continuous()
+
+    def _quadratic_search(self, loss_function, x0, steps, max_rounds, label):
+        """
+        Minimizes the loss function by repeatedly measuring a batch of probe
+        points around the current guess, fitting a quadratic model to them
+        and moving to the optimum of the model (limited to a trust region of
+        two steps). The steps are reduced each round.
+
+        Returns:
+        x, loss: tuple
+            the best point found and the loss value measured there
+        """
+        x = array(x0, dtype=float)
+        steps = array(steps, dtype=float) * ones_like(x)
+        best_x, best_loss = x, loss_function(x)
+
+        for round_idx in range(max_rounds):
+            previous_loss = best_loss
+            points = x + _quadratic_design(len(x)) * steps
+            losses = [best_loss if all(point == best_x) else loss_function(point)
+                      for point in points]
+            idx = argmin(losses)
+            if losses[idx] < best_loss:
+                best_x, best_loss = points[idx], losses[idx]
+
+            model_optimum = _quadratic_model_optimum((points - x) / steps, losses)
+            if model_optimum is not None:
+                candidate = x + clip(model_optimum, -2, 2) * steps
+                candidate_loss = loss_function(candidate)
+                if candidate_loss < best_loss:
+                    best_x, best_loss = candidate, candidate_loss
+
+            print("\r%s: " % label, format_number_list(best_x),
+                  "loss: %.3e" % best_loss, "spectra:", self._iterations,
+                  end="            ", flush=True)
+
+            if best_loss > 0.9 * previous_loss:
+                break
+            if all(abs(best_x - x) < steps / 2):
+                steps = steps / 4
+            else:
+                steps = steps / 2
+            x = best_x
+        return best_x, best_loss
+
+
+def _quadratic_design(dimension):
+    """
+    Probe points (in units of the step) sufficient to fit a full quadratic
+    model: center, axial points and both diagonals for each pair of axes
+    """
+    eye_ = eye(dimension)
+    design = [zeros(dimension)] + [sign * e for e in eye_ for sign in (1, -1)]
+    for i in range(dimension):
+        for j in range(i + 1, dimension):
+            design += [eye_[i] + eye_[j], -eye_[i] - eye_[j]]
+    return array(design)
+
+
+def _quadratic_model_optimum(points, values):
+    """
+    Least-squares fit of c + g.x + x.H.x/2 to the values, returns the
+    stationary point if the fitted model is convex and None otherwise
+    """
+    dimension = points.shape[1]
+    pairs = [(i, j) for i in range(dimension) for j in range(i, dimension)]
+    design_matrix = column_stack([ones(len(points))] +
+                                 [points[:, i] for i in range(dimension)] +
+                                 [points[:, i] * points[:, j] for i, j in pairs])
+    coefficients = linalg.lstsq(design_matrix, array(values, dtype=float),
+                                rcond=None)[0]
+    gradient = coefficients[1:dimension + 1]
+    hessian = zeros((dimension, dimension))
+    for (i, j), c in zip(pairs, coefficients[dimension + 1:]):
+        hessian[i, j] += c
+        hessian[j, i] += c
+    try:
+        if any(linalg.eigvalsh(hessian) <= 0):
+            return None
+        return linalg.solve(hessian, -gradient)
+    except linalg.LinAlgError:
+        return None
+
+
 def format_number_list(number_list):
     formatted_string = "[ "
     for number in number_list:
@@ -0,0 +1,130 @@
+"""
+Adaptive frequency windows for the 2D (parameter x frequency) scans: only a
+band around the predicted line is measured in each row. The points outside
+the windows stay zero in the data.
+"""
+
+from numpy import *
+from scipy.optimize import curve_fit
+
+
+class AdaptiveWindow:
+
+    def __init__(self, model, params=(), band=100e6, refitted_params=None):
+        """
+        Parameters
+        ----------
+        model: callable
+            model(x, *params) -> predicted frequency of the line
+        params: sequence
+            initial parameters of the model
+        band: float
+            width of the frequency window around the predicted line
+        refitted_params: list of int
+            indices of the parameters refitted on the found line points, all
+            of them by default; the model is not refitted when it is empty
+        """
+        self._model = model
+        self._params = array(params, dtype=float)
+        self._band = band
+        self._refitted_params = list(range(len(self._params))) \
+            if refitted_params is None else list(refitted_params)
+        self._line_points = []
+
+    def predict(self, x):
+        return self._model(x, *self._params)
+
+    def get_window(self, x):
+        """
+        Returns the (low, high) frequency limits to be measured at x
+        """
+        center = self.predict(x)
+        return center - self._band / 2, center + self._band / 2
+
+    def contains(self, x, frequency):
+        low, high = self.get_window(x)
+        return low <= frequency <= high
+
+    def get_params(self):
+        return self._params.copy()
+
+    def get_line_points(self):
+        return array(self._line_points)
+
+    def add_line_point(self, x, frequency):
+        """
+        Adds the position of the line found in a recorded row and refits the
+        model if there are more points than refitted parameters
+        """
+        self._line_points.append((x, frequency))
+        if 0 < len(self._refitted_params) < len(self._line_points):
+            self._refit()
+
+    def _refit(self):
+        xs, frequencies = self.get_line_points().T
+
+        def partial_model(x, *refitted_values):
+            params = self._params.copy()
+            params[self._refitted_params] = refitted_values
+            return self._model(x, *params)
+
+        try:
+            popt = curve_fit(partial_model, xs, frequencies,
+                             p0=self._params[self._refitted_params])[0]
+        except (RuntimeError, ValueError):
+            return
+        new_params = self._params.copy()
+        new_params[self._refitted_params] = popt
+        # a refit that moves the line out of the band at the found points is
+        # not trusted
+        if all(abs(self._model(xs, *new_params) - frequencies) < self._band / 2):
+            self._params = new_params
+
+
+def find_line(frequencies, row, dip=False, threshold=5):
+    """
+    Finds the spectral line in a row of complex data
+
+    Parameters
+    ----------
+    frequencies: array
+    row: array
+    dip: bool
+        if True, the line is the minimum of the absolute value (e.g. the
+        resonator dip), else the point deviating most from the median
+    threshold: float
+        minimal deviation of the line from the median in the units of the
+        median absolute deviation
+
+    Returns
+    -------
+    frequency: float or None
+        None if no significant line is found
+    """
+    if len(row) < 3:
+        return None
+    if dip:
+        deviations = median(abs(row)) - abs(row)
+    else:
+        deviations = abs(row - (median(real(row)) + 1j * median(imag(row))))
+    noise = median(abs(deviations - median(deviations)))
+    peak = argmax(deviations)
+    if deviations[peak] - median(deviations) <= threshold * noise:
+        return None
+    return frequencies[peak]
+
+
+def fill_unmeasured(data):
+    """
+    Returns a copy of the 2D data where the points that were not measured
+    (zeros) are replaced by the median of the measured points of their row,
+    so that the analysis of a map recorded with adaptive windows sees a flat
+    background there
+    """
+    data = array(data, dtype=complex)
+    for row in data:
+        measured = row != 0
+        if any(measured) and not all(measured):
+            row[~measured] = median(real(row[measured])) + \
+                             1j * median(imag(row[measured]))
+    return data
@@ -0,0 +1,190 @@
+"""
+Fitting of the same model to many rows of a 2D map at once with a batched
+Levenberg-Marquardt iteration, and initial guesses for the models used in this
+library.
+"""
+
+from numpy import *
+
+
+class BatchFitter:
+
+    def __init__(self, model, max_iterations=100, ftol=1e-10):
+        """
+        Parameters
+        ----------
+        model: callable
+            model(x, *params) -> array, real or complex; it is called with x
+            of the shape (1, n_points) and each of the parameters of the
+            shape (n_rows, 1), so usual fit functions work without changes
+        max_iterations: int
+            maximum number of Levenberg-Marquardt iterations
+        ftol: float
+            a row is converged when the relative decrease of its cost
+            function in a successful step is below ftol
+        """
+        self._model = model
+        self._max_iterations = max_iterations
+        self._ftol = ftol
+
+    def fit(self, x, data, p0, bounds=None):
+        """
+        Fits the model to each of the rows of data
+
+        Parameters
+        ----------
+        x: array of shape (n_points,)
+        data: array of shape (n_rows, n_points), real or complex
+        p0: array of shape (n_rows, n_params)
+            initial guesses for each row
+        bounds: tuple of two arrays of shape (n_params,) or (n_rows, n_params)
+            lower and upper bounds for the parameters, optional
+
+        Returns
+        -------
+        params: array of shape (n_rows, n_params)
+        errors: array of shape (n_rows, n_params)
+            standard errors estimated from the Jacobian
+        success: bool array of shape (n_rows,)
+        """
+        x = asarray(x)[newaxis, :]
+        data = asarray(data)
+        params = array(p0, dtype=float)
+        n_rows, n_params = params.shape
+        if bounds is None:
+            bounds = (-inf, inf)
+        lower = broadcast_to(bounds[0], params.shape)
+        upper = broadcast_to(bounds[1], params.shape)
+        params = clip(params, lower, upper)
+
+        residuals = self._residuals(x, data, params)
+        costs = sum(residuals ** 2, axis=1)
+        damping = full(n_rows, 1e-3)
+        active = isfinite(costs)
+
+        for iteration in range(self._max_iterations):
+            rows = nonzero(active)[0]
+            if len(rows) == 0:
+                break
+
+            jacobian = self._jacobian(x, data[rows], params[rows], residuals[rows])
+            normal_matrix = einsum("rmp,rmq->rpq", jacobian, jacobian)
+            gradient = einsum("rmp,rm->rp", jacobian, residuals[rows])
+            diagonal_ = maximum(diagonal(normal_matrix, axis1=1, axis2=2), 1e-300)
+            damped_matrix = normal_matrix + \
+                            damping[rows, newaxis, newaxis] * \
+                            (diagonal_[:, :, newaxis] * eye(n_params))
+            steps = _batch_solve(damped_matrix, -gradient)
+
+            new_params = clip(params[rows] + steps, lower[rows], upper[rows])
+            new_residuals = self._residuals(x, data[rows], new_params)
+            new_costs = sum(new_residuals ** 2, axis=1)
+
+            improved = isfinite(new_costs) & (new_costs < costs[rows])
+            improved_rows = rows[improved]
+            converged = improved & \
+                        (costs[rows] - new_costs <= self._ftol * costs[rows])
+
+            params[improved_rows] = new_params[improved]
+            residuals[improved_rows] = new_residuals[improved]
+            costs[improved_rows] = new_costs[improved]
+            damping[improved_rows] /= 10
+            damping[rows[~improved]] *= 10
+
+            active[rows[converged]] = False
+            active[rows[damping[rows] > 1e10]] = False
+
+        jacobian = self._jacobian(x, data, params, residuals)
+        normal_matrix = einsum("rmp,rmq->rpq", jacobian, jacobian)
+        dof = maximum(residuals.shape[1] - n_params, 1)
+        covariance = linalg.pinv(normal_matrix) * (costs / dof)[:, newaxis, newaxis]
+        errors = sqrt(abs(diagonal(covariance, axis1=1, axis2=2)))
+        success = isfinite(costs) & all(isfinite(params), axis=1)
+        return params, errors, success
+
+    def _residuals(self, x, data, params):
+        model_data = self._model(x, *[params[:, idx, newaxis]
+                                      for idx in range(params.shape[1])])
+        residuals = broadcast_to(model_data, data.shape) - data
+        if iscomplexobj(residuals):
+            residuals = concatenate((real(residuals), imag(residuals)), axis=1)
+        return residuals
+
+    def _jacobian(self, x, data, params, residuals):
+        jacobian = empty(residuals.shape + (params.shape[1],))
+        for idx in range(params.shape[1]):
+            step = 1.5e-8 * where(params[:, idx] != 0, abs(params[:, idx]), 1)
+            shifted_params = params.copy()
+            shifted_params[:, idx] += step
+            jacobian[:, :, idx] = \
+                (self._residuals(x, data, shifted_params) - residuals) / step[:, newaxis]
+        return jacobian
+
+
+def _batch_solve(matrices, vectors):
+    try:
+        return linalg.solve(matrices, vectors[:, :, newaxis])[:, :, 0]
+    except linalg.LinAlgError:
+        return einsum("rpq,rq->rp", linalg.pinv(matrices), vectors)
+
+
+def lorentzian_initial_guess(frequencies, rows):
+    """
+    Initial guesses (amplitude, offset, peak_frequency, width) for Lorentzian
+    peaks in each of the rows; the width is estimated from the number of
+    points above the half maximum
+    """
+    frequencies = asarray(frequencies)
+    rows = asarray(rows)
+    offsets = median(rows, axis=1)
+    maxima = rows.max(axis=1)
+    peak_frequencies = frequencies[argmax(rows, axis=1)]
+    frequency_step = abs(frequencies[1] - frequencies[0])
+    half_maximum = (maxima + offsets) / 2
+    widths = maximum(sum(rows > half_maximum[:, newaxis], axis=1), 1) * frequency_step
+    return column_stack((maxima - offsets, offsets, peak_frequencies, widths))
+
+
+def oscillation_initial_guess(t, rows, oversampling=4):
+    """
+    Initial guesses (A_r, A_i, T, Omega, phase, offset_r, offset_i) for damped
+    oscillations (A_r + 1j*A_i)*exp(-t/T)*cos(Omega*t + phase) + offset in
+    each of the complex rows
+
+    The complex data is projected on its main axis of oscillation, the
+    frequency is found as the maximum of the zero-padded FFT refined by
+    parabolic interpolation between the neighbouring bins, and the amplitude
+    and phase are taken from the Fourier component at that frequency
+    """
+    t = asarray(t)
+    rows = asarray(rows, dtype=complex)
+    n_points = len(t)
+    offsets = mean(rows, axis=1)
+    centered = rows - offsets[:, newaxis]
+
+    axis_angles = angle(sum(centered ** 2, axis=1)) / 2
+    projected = real(centered * exp(-1j * axis_angles)[:, newaxis])
+
+    n_fft = oversampling * n_points
+    spectrum = abs(fft.rfft(projected, n=n_fft, axis=1))
+    spectrum[:, 0] = 0
+    peaks = argmax(spectrum, axis=1)
+    inner = (peaks > 0) & (peaks < spectrum.shape[1] - 1)
+    row_idx = arange(len(rows))
+    left = spectrum[row_idx, where(inner, peaks - 1, peaks)]
+    center = spectrum[row_idx, peaks]
+    right = spectrum[row_idx, where(inner, peaks + 1, peaks)]
+    denominators = left - 2 * center + right
+    shifts = 0.5 * (left - right) / where(denominators != 0, denominators, 1)
+    time_step = t[1] - t[0]
+    omegas = 2 * pi * (peaks + shifts) / (n_fft * time_step)
+
+    components = sum(projected * exp(-1j * omegas[:, newaxis] * t[newaxis, :]), axis=1)
+    amplitudes = 2 * abs(components) / n_points
+    phases = angle(components)
+
+    decay_times = full(len(rows), ptp(t))
+    return column_stack((amplitudes * cos(axis_angles),
+                         amplitudes * sin(axis_angles),
+                         decay_times, omegas, phases,
+                         real(offsets), imag(offsets)))
@@ -0,0 +1,145 @@
+"""
+Registry of the standard devices used by the measurements, with cached VISA
+discovery and drivers imported on first use.
+"""
+
+import importlib
+from threading import Lock
+from time import time
+
+from lib2.SessionManager import SessionManager
+
+
+class DeviceProxy:
+    """
+    Stands in for a device object and creates it on the first access to any
+    of its attributes
+
+    Method calls are made under the session lock of the device, so that calls
+    from different threads are not interleaved.
+    """
+
+    def __init__(self, registry, name, address):
+        self._registry = registry
+        self._name = name
+        self._session_name = name
+        self._address = address
+        self._device = None
+        self._connection_lock = Lock()
+
+    def get_device(self):
+        if self._device is None:
+            with self._connection_lock:
+                if self._device is None:
+                    self._device = self._registry.connect(self._name, self._address)
+        return self._device
+
+    def is_connected(self):
+        return self._device is not None
+
+    def __getattr__(self, attr):
+        # only called for the attributes not found in the proxy itself; the
+        # special ones are not forwarded so that copy and pickle do not
+        # connect to the device or recurse before __init__ is called
+        if attr.startswith("__") or attr in ("_device", "_registry"):
+            raise AttributeError(attr)
+        attribute = getattr(self.get_device(), attr)
+        if not callable(attribute):
+            return attribute
+        lock = SessionManager.getInstance().get_lock(self)
+
+        def locked_call(*args, **kwargs):
+            with lock:
+                return attribute(*args, **kwargs)
+
+        return locked_call
+
+    def __repr__(self):
+        return "DeviceProxy(%s, %s%s)" % (self._name, self._address,
+                                          "" if self.is_connected() else ", not connected")
+
+
+class DeviceRegistry:
+
+    # a scan is repeated for an unknown alias only if the cached map is older
+    _rescan_interval = 10
+
+    def __init__(self, devs_dict):
+        """
+        Parameters
+        ----------
+        devs_dict: dict
+            {name: [[visa aliases], [driver module name, driver class name]]}
+        """
+        self._devs_dict = devs_dict
+        self._resource_map = None
+        self._resource_map_time = 0
+        self._lock = Lock()
+
+    def get_resource_map(self):
+        """
+        Returns a cached dict {visa alias: resource name} of the devices
+        present in VISA, scanning the interfaces only on the first call or
+        after invalidate()
+        """
+        with self._lock:
+            if self._resource_map is None:
+                self._scan_resources()
+            return self._resource_map
+
+    def invalidate(self):
+        """
+        Forgets the cached VISA resources, so that they are scanned again on
+        the next request, e.g. after a device was connected or switched on
+        """
+        with self._lock:
+            self._resource_map = None
+
+    def find_address(self, name):
+        """
+        Returns the VISA alias under which the device with the standard name
+        is available, None if it is not found
+        """
+        aliases = self._devs_dict[name][0]
+        address = self._match(aliases, self.get_resource_map())
+        if address is None and time() - self._resource_map_time > self._rescan_interval:
+            with self._lock:
+                self._scan_resources()
+            address = self._match(aliases, self._resource_map)
+        return address
+
+    def get_device(self, name):
+        """
+        Returns a DeviceProxy for the device with the standard name or None
+        if it is not found in VISA; the driver is not imported and the device
+        is not contacted until the proxy is used
+        """
+        address = self.find_address(name)
+        if address is None:
+            return None
+        return DeviceProxy(self, name, address)
+
+    def get_driver_class(self, name):
+        module_name, class_name = self._devs_dict[name][1]
+        module = importlib.import_module("drivers." + module_name)
+        return getattr(module, class_name)
+
+    def connect(self, name, address):
+        device_object = self.get_driver_class(name)(address)
+        print("The device %s is connected as %s" % (name, address))
+        return device_object
+
+    def _scan_resources(self):
+        import pyvisa
+        resources = pyvisa.ResourceManager().list_resources_info()
+        self._resource_map = {info.alias: resource_name
+                              for resource_name, info in resources.items()
+                              if info.alias is not None}
+        self._resource_map_time = time()
+
+    @staticmethod
+    def _match(aliases, resource_map):
+        for alias in aliases:
+            if alias in resource_map:
+                return alias
+        return None
@@ -0,0 +1,150 @@
+"""
+Readout of the time-domain measurements with a digitizer instead of the VNA,
+demodulated in numpy.
+"""
+
+from numpy import *
+
+
+class Demodulator:
+
+    def __init__(self, if_frequency=0, integration_window=None):
+        """
+        Parameters
+        ----------
+        if_frequency: float
+            intermediate frequency of the captured signal in Hz, 0 for
+            the DC (homodyne) readout
+        integration_window: tuple
+            (start, stop) in seconds from the beginning of the trace, the
+            whole trace by default
+        """
+        self._if_frequency = if_frequency
+        self._integration_window = integration_window
+        self._reference = None
+        self._reference_key = None
+
+    def get_reference(self, times, complex_signal=False):
+        """
+        Returns the reference vector for the time axis; it is recalculated
+        only when the time axis changes
+        """
+        key = (len(times), times[0], times[-1], complex_signal)
+        if key != self._reference_key:
+            weights = ones(len(times))
+            if self._integration_window is not None:
+                start, stop = self._integration_window
+                weights[(times < start) | (times > stop)] = 0
+            reference = weights * exp(-2j * pi * self._if_frequency * times) / sum(weights)
+            if self._if_frequency != 0 and not complex_signal:
+                # a real signal A*cos(w*t + phi) has A/2 in the positive
+                # frequency component
+                reference *= 2
+            self._reference, self._reference_key = reference, key
+        return self._reference
+
+    def demodulate(self, times, traces, q_traces=None):
+        """
+        Complex amplitudes of the traces
+
+        Parameters
+        ----------
+        times: array of shape (nop,)
+        traces: array of shape (..., nop)
+            the signal or its I quadrature if q_traces are given
+        q_traces: array of shape (..., nop)
+            the Q quadrature
+
+        Returns
+        -------
+        amplitudes: complex array of shape (...)
+        """
+        if q_traces is None:
+            return asarray(traces).dot(self.get_reference(times))
+        reference = self.get_reference(times, complex_signal=True)
+        return asarray(traces).dot(reference) + 1j * asarray(q_traces).dot(reference)
+
+
+class DigitizerReadout:
+    """
+    Replaces the VNA in the VNATimeResolvedDispersiveMeasurement: digitizes
+    the readout signal and returns its demodulated complex amplitude
+    """
+
+    def __init__(self, dso, channels, if_frequency=0, integration_window=None,
+                 shots=1):
+        """
+        Parameters
+        ----------
+        dso: Keysight_DSOX2014, Agilent_DSO or a digitizer with the same
+            interface as one of them
+        channels: list
+            one channel with the IF signal or two with I and Q quadratures
+        if_frequency: float
+        integration_window: tuple
+            see Demodulator
+        shots: int
+            number of segments acquired per point; if more than one, the
+            digitizer is switched to the segmented mode
+        """
+        self._dso = dso
+        self._channels = list(channels)
+        self._demodulator = Demodulator(if_frequency, integration_window)
+        self._shots = shots
+        if shots > 1:
+            self._setup_segments()
+
+    def get_demodulator(self):
+        return self._demodulator
+
+    def get_shots_number(self):
+        return self._shots
+
+    def measure(self):
+        """
+        Returns the complex amplitude of the averaged readout signal
+        """
+        if self._shots > 1:
+            return mean(self.measure_shots())
+        return self._demodulate(*self._acquire(segmented=False))
+
+    def measure_shots(self):
+        """
+        Acquires a segment for each shot and demodulates all of them at once
+
+        Returns
+        -------
+        shots: complex array of shape (shots,)
+        """
+        return self._demodulate(*self._acquire(segmented=True))
+
+    def _acquire(self, segmented):
+        # the time axis is built here for all the digitizers, so that the
+        # integration window and the reference mean the same for all of them
+        if hasattr(self._dso, "get_data_binary"):
+            # drivers.Agilent_DSO transfers each channel in one binary block
+            self._dso.acq_digitize(self._channels, [])
+            data, preambles = self._dso.get_data_binary(self._channels,
+                                                        segmented=segmented)
+            data = data if len(self._channels) == 2 else data[0]
+            x_increment = preambles[0]["Xincrement"]
+        else:
+            self._dso.digitize(*self._channels)
+            if segmented:
+                data = self._dso.get_segmented_data(*self._channels)[1]
+            else:
+                data = self._dso.get_data(*self._channels)[1]
+            x_increment = self._dso.get_x_increment(self._channels[0])
+        return arange(data.shape[-1]) * x_increment, data
+
+    def _demodulate(self, times, data):
+        if len(self._channels) == 2:
+            return self._demodulator.demodulate(times, data[0], data[1])
+        return self._demodulator.demodulate(times, data)
+
+    def _setup_segments(self):
+        if hasattr(self._dso, "acqmode_segmented"):
+            self._dso.acqmode_segmented()
+            self._dso.do_set_segments(self._shots)
+        else:
+            self._dso.set_segments(self._shots)
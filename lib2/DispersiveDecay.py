@@ -1,6 +1,7 @@
 
 from lib2.IQPulseSequence import *
 from lib2.VNATimeResolvedDispersiveMeasurement1D import *
+from lib2.SignalEstimation import estimate_exponential_decay
 
 class DispersiveDecay(VNATimeResolvedDispersiveMeasurement1D):
 
@@ -26,7 +27,9 @@ class DispersiveDecayResult(VNATimeResolvedDispersiveMeasurement1DResult):
 
     def _generate_fit_arguments(self, x, data):
         bounds =([-1, -1, 0.1, -1, -1], [1, 1, 100, 1, 1])
-        p0 = [ptp(real(data))/2, ptp(imag(data))/2, 1, min(real(data)), min(imag(data))]
+        amplitude, T_1, offset = estimate_exponential_decay(x, data)
+        # the model has the real and imaginary parts of the amplitude swapped
+        p0 = [imag(amplitude), real(amplitude), T_1, real(offset), imag(offset)]
         return p0, bounds
 
     def _generate_annotation_string(self, opt_params, err):
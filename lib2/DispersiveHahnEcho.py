@@ -1,6 +1,7 @@
 
 from lib2.IQPulseSequence import *
 from lib2.VNATimeResolvedDispersiveMeasurement1D import *
+from lib2.SignalEstimation import estimate_exponential_decay
 from lib2.DispersiveRamsey import *
 
 class DispersiveHahnEcho(VNATimeResolvedDispersiveMeasurement1D):
@@ -21,7 +22,8 @@ class DispersiveHahnEchoResult(VNATimeResolvedDispersiveMeasurement1DResult):
         return (A_r+1j*A_i)*exp(-1/T_2_ast*t)+(offset_r+1j*offset_i)
 
     def _generate_fit_arguments(self, x, data):
-        p0=[-ptp(real(data)), -ptp(imag(data)), 1, max(real(data)), max(imag(data))]
+        amplitude, T_2_ast, offset = estimate_exponential_decay(x, data)
+        p0=[real(amplitude), imag(amplitude), T_2_ast, real(offset), imag(offset)]
         bounds =([-5, -5, 0.1, -5, -5], [5, 5, 20, 5, 5])
         return p0, bounds
 
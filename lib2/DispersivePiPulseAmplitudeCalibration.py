@@ -1,6 +1,7 @@
 
 from lib2.IQPulseSequence import *
 from lib2.VNATimeResolvedDispersiveMeasurement1D import *
+from lib2.SignalEstimation import estimate_frequency, fit_linear_coefficients
 
 class DispersivePiPulseAmplitudeCalibration(VNATimeResolvedDispersiveMeasurement1D):
 
@@ -40,20 +41,19 @@ class DispersivePiPulseAmplitudeCalibrationResult(VNATimeResolvedDispersiveMeasu
 
     def _generate_fit_arguments(self, x, data):
         amp_r, amp_i = ptp(real(data))/2, ptp(imag(data))/2
-        if abs(max(real(data)) - real(data[0])) < abs(real(data[0])-min(real(data))):
-            amp_r = -amp_r
-        if abs(max(imag(data)) - imag(data[0])) < abs(imag(data[0])-min(imag(data))):
-            amp_i = -amp_i
-        offset_r, offset_i = max(real(data))-abs(amp_r), max(imag(data))-abs(amp_i)
         amp_step = x[1]-x[0]
         min_pi_pulse_amp = amp_step*2*5
         max_pi_pulse_amp = (x[-1]-x[0])*2*10
-        pi_pulse_amp = random.random(1)*(max_pi_pulse_amp-min_pi_pulse_amp)+min_pi_pulse_amp
+        frequency = estimate_frequency(x, data)
+        pi_pulse_amp = pi/frequency if frequency > 0 else max_pi_pulse_amp
+        amplitude, offset = fit_linear_coefficients(
+            [-cos(pi*x/pi_pulse_amp), ones_like(x)], data)
         bounds =([-abs(amp_r)*1.5, -abs(amp_i)*1.5,
                         min_pi_pulse_amp, -10, -10],
                     [abs(amp_r)*1.5, abs(amp_i)*1.5,
                             max_pi_pulse_amp, 10, 10])
-        p0 = [amp_r, amp_i, pi_pulse_amp, offset_r, offset_i]
+        p0 = [real(amplitude), imag(amplitude), pi_pulse_amp,
+              real(offset), imag(offset)]
         return p0, bounds
 
     def _prepare_data_for_plot(self, data):
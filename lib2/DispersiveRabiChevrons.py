@@ -17,10 +17,12 @@ class DispersiveRabiChevrons(VNATimeResolvedDispersiveMeasurement2D):
             .get_radiation_parameters()["if_frequency"]
         swept_pars = {"excitation_duration": \
                           (self._output_pulse_sequence,
-                           excitation_durations),
+                           excitation_durations,
+                           self._q_awg + self._ro_awg),
                       "excitation_frequency":
                           (lambda x: self._q_lo.set_frequency(x + q_if_frequency),
-                           excitation_freqs)}
+                           excitation_freqs,
+                           self._q_lo)}
         super().set_swept_parameters(**swept_pars)
 
     def _output_pulse_sequence(self, excitation_duration):
@@ -1,6 +1,7 @@
 
 from lib2.IQPulseSequence import *
 from lib2.VNATimeResolvedDispersiveMeasurement1D import *
+from lib2.SignalEstimation import estimate_damped_oscillation
 
 
 class DispersiveRabiOscillations(VNATimeResolvedDispersiveMeasurement1D):
@@ -24,17 +25,14 @@ class DispersiveRabiOscillationsResult(VNATimeResolvedDispersiveMeasurement1DRes
 
     def _generate_fit_arguments(self, x, data):
         amp_r, amp_i = ptp(real(data))/2, ptp(imag(data))/2
-        if abs(max(real(data)) - real(data[0])) < abs(real(data[0])-min(real(data))):
-            amp_r = -amp_r
-        if abs(max(imag(data)) - imag(data[0])) < abs(imag(data[0])-min(imag(data))):
-            amp_i = -amp_i
-        offset_r, offset_i = max(real(data))-abs(amp_r), max(imag(data))-abs(amp_i)
 
         time_step = x[1]-x[0]
         max_frequency = 1/time_step/2/5
         min_frequency = 0.1
-        frequency = random.random(1)*(max_frequency-.1)+.1
-        p0 = [amp_r, amp_i, 1, frequency*2*pi, offset_r, offset_i]
+        amplitude, T_R, Omega_R, phase, offset = \
+            estimate_damped_oscillation(x, data, phase=0)
+        p0 = [-real(amplitude), -imag(amplitude), T_R, Omega_R,
+              real(offset), imag(offset)]
 
         bounds =([-abs(amp_r)*1.5, -abs(amp_i)*1.5, 0.1,
                         min_frequency*2*pi, -10, -10],
@@ -3,7 +3,7 @@ from lib2.VNATimeResolvedDispersiveMeasurement2D import *
 from scipy.interpolate import interp2d
 from lib2.QuantumState import *
 import numpy as np
-from qutip import qeye, sigmax, sigmay, sigmaz, fidelity, Qobj, expect
+from qutip import qeye, sigmax, sigmay, sigmaz, fidelity, Qobj
 from scipy.optimize import least_squares
 from IPython.display import clear_output
 
@@ -49,22 +49,52 @@ class DispersiveRadialTomographyResult(VNATimeResolvedDispersiveMeasurementResul
         return 1 / 2 * (qeye(2) + x * sigmax() + y * sigmay() + z * sigmaz())
 
     def _model(self, amps, phis, r, theta, phi, A, offset):
-        tomo_z_data = []
-        rho_0 = self._dm_from_sph_coords(r, theta, phi)
-        for amp in amps:
-            phi_data = []
-            for phi in phis:
-                gate = (-1j * amp * pi / 2 * (cos(phi) * sigmax() + sin(phi) * sigmay())).expm()
-                rho_1 = gate * rho_0 * gate.dag()
-                phi_data.append(expect(sigmaz(), rho_1))
-            tomo_z_data.append(phi_data)
-        return (array(tomo_z_data) + 1) / 2 * A + offset
+        """
+        Population of the excited state after the tomography rotation by
+        amp * pi around the (cos(phi), sin(phi), 0) axis, evaluated over the
+        whole (amps, phis) grid at once.
+
+        The rotation is applied to the Bloch vector of the initial state
+        analytically instead of exponentiating a gate for every point.
+        """
+        z_rotated = r * self._rotated_z_projection(amps, phis, theta, phi)
+        return (z_rotated + 1) / 2 * A + offset
+
+    def _rotated_z_projection(self, amps, phis, theta, phi):
+        alpha, phi_diff = self._rotation_grid(amps, phis, phi)
+        return sin(theta) * cos(alpha) + \
+               cos(theta) * sin(alpha) * sin(phi_diff)
+
+    @staticmethod
+    def _rotation_grid(amps, phis, phi):
+        alpha = pi * asarray(amps)[:, newaxis]
+        phi_diff = phi - asarray(phis)[newaxis, :]
+        return alpha, phi_diff
+
+    def _model_jacobian(self, amps, phis, r, theta, phi, A, offset):
+        """
+        Analytical derivatives of the model with respect to
+        (r, theta, phi, A, offset), shape (len(amps) * len(phis), 5)
+        """
+        alpha, phi_diff = self._rotation_grid(amps, phis, phi)
+        cos_alpha, sin_alpha = cos(alpha), sin(alpha)
+        z_projection = sin(theta) * cos_alpha + \
+                       cos(theta) * sin_alpha * sin(phi_diff)
+
+        d_r = A / 2 * z_projection
+        d_theta = A / 2 * r * (cos(theta) * cos_alpha -
+                               sin(theta) * sin_alpha * sin(phi_diff))
+        d_phi = A / 2 * r * cos(theta) * sin_alpha * cos(phi_diff)
+        d_A = (r * z_projection + 1) / 2
+        d_offset = ones_like(z_projection)
+        return stack([d.ravel() for d in
+                      (d_r, d_theta, d_phi, d_A, d_offset)], axis=-1)
 
     def _cost_function(self, params, amps, phis, data):
-        loss = (self._model(amps, phis, *params) - data).ravel()
-        # clear_output(wait=True)
-        print("\rLoss:", sum(loss ** 2), " params:", params, end="")
-        return loss
+        return (self._model(amps, phis, *params) - data).ravel()
+
+    def _cost_function_jacobian(self, params, amps, phis, data):
+        return self._model_jacobian(amps, phis, *params)
 
     def fit_and_plot(self, quadrature):
         converter = imag if quadrature == "imag" else real
@@ -79,7 +109,6 @@ class DispersiveRadialTomographyResult(VNATimeResolvedDispersiveMeasurementResul
         # data_exp = data_exp/data_exp.max()
 
         bounds = [0, -pi / 2, -pi, 0.9, -1], [1, pi / 2, pi, 1.1, 1]
-        step_size = max((len(amplitudes_exp), len(phases_exp))) // 10
         prep_pulse_seq = self._pulse_sequence_parameters['prep_pulse']
         expected_state = QuantumState('pulses', prep_pulse_seq)
         expected_state.change_represent('spherical')
@@ -88,9 +117,11 @@ class DispersiveRadialTomographyResult(VNATimeResolvedDispersiveMeasurementResul
         ig = list(expected_state._coords * (np.random.random(1) * (1.1 - 0.9) + 0.9))
         print(ig)
         fit_result = least_squares(self._cost_function, ig + [1, 0],
-                                   args=(amplitudes_exp[::step_size], phases_exp[::step_size],
-                                         converter(data_exp[::step_size, ::step_size])),
+                                   jac=self._cost_function_jacobian,
+                                   args=(amplitudes_exp, phases_exp,
+                                         converter(data_exp)),
                                    ftol=1e-4, bounds=bounds)
+        print("Loss:", 2 * fit_result.cost, " params:", fit_result.x)
         z = self._model(amplitudes_exp, phases_exp, *fit_result.x)
         expected_state.change_represent('dens_mat')
         fidelya = fidelity(self._dm_from_sph_coords(*fit_result.x[:3]), \
@@ -1,5 +1,6 @@
 
 from lib2.VNATimeResolvedDispersiveMeasurement1D import *
+from lib2.SignalEstimation import estimate_damped_oscillation
 
 
 class DispersiveRamsey(VNATimeResolvedDispersiveMeasurement1D):
@@ -25,14 +26,13 @@ class DispersiveRamseyResult(VNATimeResolvedDispersiveMeasurement1DResult):
     def _generate_fit_arguments(self, x, data):
         time_step = x[1]-x[0]
         max_frequency = 1/time_step/2/3
-        frequency = random.random(1)*max_frequency
-        phase = random.random(1)*2*pi-pi
 
         bounds =([-10, -10, 0.1, 0*2*pi, -10, -10, -pi],
                         [10, 10, 100, max_frequency*2*pi, 10, 10, pi])
-        amp_r, amp_i = ptp(real(data))/2, ptp(imag(data))/2
-        p0 = (amp_r, amp_i, 3, frequency, max(real(data))-amp_r,
-                                max(imag(data))-amp_i, 0)
+        amplitude, T_2_ast, Delta_Omega, phase, offset = \
+            estimate_damped_oscillation(x, data)
+        p0 = (real(amplitude), imag(amplitude), T_2_ast, Delta_Omega,
+              real(offset), imag(offset), phase)
         return p0, bounds
 
     def get_ramsey_frequency(self):
@@ -36,6 +36,8 @@ class DispersiveRamseyZPulseCalibration2D(VNATimeResolvedDispersiveMeasurement2D
 
 class DispersiveRamseyZPulseCalibrationResult2D(VNATimeResolvedDispersiveMeasurement2DResult):
 
+    _time_axis = 1
+
     def _prepare_data_for_plot(self, data):
         return data["z_pulse_duration"], \
                data["z_pulse_offset_voltage"], \
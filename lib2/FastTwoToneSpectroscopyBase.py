@@ -9,6 +9,7 @@ from lib2.SingleToneSpectroscopy import *
 from datetime import datetime as dt
 from lib2.Measurement import *
 from scipy.optimize import curve_fit
+from lib2.BatchFitter import BatchFitter, lorentzian_initial_guess
 
 
 class FastTwoToneSpectroscopyBase(Measurement):
@@ -119,7 +120,9 @@ class FastTwoToneSpectroscopyBase(Measurement):
                           parameter_name != "Frequency [Hz]"]
         raw_data_shape = \
             [len(indices) for indices in cycle_par_idxs]
-        total_iterations = reduce(mul, [len(indices) for indices in cycle_par_idxs], 1)
+        self._progress.start([parameter_name for parameter_name in par_names
+                              if parameter_name != "Frequency [Hz]"],
+                             raw_data_shape, self.get_setters_timing)
 
         for idx_group, values_group in zip(product(*cycle_par_idxs), product(*cycle_par_vals)):
 
@@ -140,25 +143,14 @@ class FastTwoToneSpectroscopyBase(Measurement):
             self._measurement_result.set_data(measurement_data)
 
             done_iterations += 1
-
-            avg_time = (dt.now() - start_time).total_seconds() / done_iterations
-            time_left = self._format_time_delta(avg_time * (total_iterations - done_iterations))
-
-            formatted_values_group = \
-                '[' + "".join(["%s: %.2e, " % (par_names[idx], value) \
-                               for idx, value in enumerate(values_group)])[:-2] + ']'
-
-            print("\rTime left: " + time_left + ", %s" % formatted_values_group + \
-                  ", average cycle time: " + str(round(avg_time, 2)) + " s       ",
-                  end="", flush=True)
+            self._progress.update(idx_group, values_group)
 
             if self._interrupted:
                 self._interrupted = False
+                self._progress.finish()
                 return
         self._measurement_result.set_recording_time(dt.now() - start_time)
-        print("\nElapsed time: %s" % \
-              self._format_time_delta((dt.now() - start_time) \
-                                      .total_seconds()))
+        self._progress.finish()
         self._measurement_result.set_is_finished(True)
 
     def _recording_iteration(self):
@@ -224,16 +216,14 @@ class TwoToneSpectroscopyResult(SingleToneSpectroscopyResult):
                 (frequency - res_frequency) ** 2 + (0.5 * width) ** 2) + offset
 
     def _find_peaks(self, freqs, data):
-        peaks = []
-        for row in data:
-            try:
-                popt = curve_fit(self._lorentzian_peak,
-                                 freqs, row, p0=(ptp(row), median(row),
-                                                 freqs[argmax(row)], 10e6))[0]
-                peaks.append(popt[2])
-            except:
-                peaks.append(freqs[argmax(row)])
-        return array(peaks)
+        data = asarray(data)
+        fitter = BatchFitter(self._lorentzian_peak)
+        popt, perr, success = \
+            fitter.fit(freqs, data, lorentzian_initial_guess(freqs, data))
+        peaks = popt[:, 2]
+        failed = ~success | (peaks < freqs.min()) | (peaks > freqs.max())
+        peaks[failed] = freqs[argmax(data[failed], axis=1)]
+        return peaks
 
     def find_transmon_spectrum(self, axes, parameter_limits=(0, -1),
                                format="abs"):
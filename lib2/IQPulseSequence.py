@@ -1,6 +1,53 @@
 from numpy import *
 from matplotlib import pyplot as plt
 from scipy.signal import *
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def _envelope(N_time_steps, waveform_resolution, window, hd_amplitude):
+    """
+    Returns the window of a sine pulse with the half derivative correction as
+    a complex array w - 1j * hd, so that the pulse is real(carrier * envelope)
+    """
+    duration = N_time_steps * waveform_resolution
+    points = linspace(0, duration, N_time_steps + 1)
+
+    def rectangular():
+        return ones_like(points), zeros_like(points)
+
+    def gaussian():
+        B = exp(-(duration / 2) ** 2 / 2 / (duration / 3) ** 2)
+        window = (exp(-(points - duration / 2) ** 2 / 2 / (duration / 3) ** 2) - B) / (1 - B)
+        derivative = gradient(window, waveform_resolution)
+        return window, derivative
+
+    def hahn():
+        window = sin(pi * linspace(0, N_time_steps, N_time_steps + 1) / N_time_steps) ** 2
+        derivative = gradient(window, waveform_resolution)
+        derivative[0] = derivative[-1] = 0
+        return window, derivative
+
+    windows = {"rectangular": rectangular, "gaussian": gaussian, "hahn": hahn}
+    window, derivative = windows[window]()
+
+    hd_correction = - derivative * hd_amplitude / 2 / (-2 * pi * 0.2)  # anharmonicity
+    envelope = window - 1j * hd_correction
+    envelope.flags.writeable = False
+    return envelope
+
+
+@lru_cache(maxsize=256)
+def _modulated_envelope(N_time_steps, waveform_resolution, window, hd_amplitude,
+                        frequency):
+    """
+    Returns the envelope multiplied by the unit carrier exp(1j*frequency*t)
+    """
+    points = linspace(0, N_time_steps * waveform_resolution, N_time_steps + 1)
+    modulated = _envelope(N_time_steps, waveform_resolution, window, hd_amplitude) * \
+                exp(1j * frequency * points)
+    modulated.flags.writeable = False
+    return modulated
 
 
 class PulseSequence():
@@ -91,6 +138,9 @@ class PulseBuilder():
         self._waveform_resolution = \
             calibration["waveform_resolution"]
         self._pulse_seq = PulseSequence(self._waveform_resolution)
+        # number of time steps preceding the sequence being built, used by
+        # lib2.PulseSequenceTemplate to build single segments in place
+        self._start_point = 0
 
     def add_zero_pulse(self, duration):
         """
@@ -178,7 +228,7 @@ class PulseBuilder():
             Duration of the whole sequence
         """
         total_time_steps = round(total_duration / self._waveform_resolution)
-        current_time_steps = self._pulse_seq.total_points() - 1
+        current_time_steps = self._start_point + self._pulse_seq.total_points() - 1
         residual_time_steps = total_time_steps - current_time_steps
         self.add_zero_pulse(residual_time_steps * self._waveform_resolution)
         return self
@@ -210,6 +260,10 @@ class IQPulseBuilder():
             iqmx_calibration.get_radiation_parameters()["waveform_resolution"]
         self._pulse_seq_I = PulseSequence(self._waveform_resolution)
         self._pulse_seq_Q = PulseSequence(self._waveform_resolution)
+        self._sine_calibration = None
+        # number of time steps preceding the sequence being built, used by
+        # lib2.PulseSequenceTemplate to build single segments in place
+        self._start_point = 0
 
     def add_dc_pulse(self, duration, dc_voltage=None):
         """
@@ -277,57 +331,35 @@ class IQPulseBuilder():
         hd_amplitude: float
             correction for the Half Derivative method, theoretically should be 1
         """
-        if_offs1, if_offs2 = \
-            self._iqmx_calibration.get_optimization_results()[0]["if_offsets"]
-
-        if_amp1, if_amp2 = \
-            self._iqmx_calibration.get_optimization_results()[0]["if_amplitudes"]
-        if_amp1, if_amp2 = \
-            if_amp1 * amplitude, if_amp2 * amplitude
-
-        if_phase = \
-            self._iqmx_calibration.get_optimization_results()[0]["if_phase"]
-        frequency = \
-            2 * pi * self._iqmx_calibration.get_radiation_parameters()["if_frequency"] / 1e9
+        if_offs1, if_offs2, if_amp1, if_amp2, if_phase, frequency = \
+            self._get_sine_calibration()
 
-        N_time_steps = round(duration / self._waveform_resolution)
-        duration = N_time_steps * self._waveform_resolution
+        N_time_steps = int(round(duration / self._waveform_resolution))
 
-        phase += (self._pulse_seq_I.total_points() - 1) * \
+        phase += (self._start_point + self._pulse_seq_I.total_points() - 1) * \
                  self._waveform_resolution * frequency
 
-        points = linspace(0, duration, N_time_steps + 1)
-        carrier_I = if_amp1 * exp(1j * (frequency * points + if_phase + phase))
-        carrier_Q = if_amp2 * exp(1j * (frequency * points + phase))
-
-        # print(real(carrier_Q)
-
-        def rectangular():
-            return ones_like(points), zeros_like(points)
-
-        def gaussian():
-            B = exp(-(duration / 2) ** 2 / 2 / (duration / 3) ** 2)
-            window = (exp(-(points - duration / 2) ** 2 / 2 / (duration / 3) ** 2) - B) / (1 - B)
-            derivative = gradient(window, self._waveform_resolution)
-            return window, derivative
-
-        def hahn():
-            window = sin(pi * linspace(0, N_time_steps, N_time_steps + 1) / N_time_steps) ** 2
-            derivative = gradient(window, self._waveform_resolution)
-            derivative[0] = derivative[-1] = 0
-            return window, derivative
-
-        windows = {"rectangular": rectangular, "gaussian": gaussian, "hahn": hahn}
-        window, derivative = windows[window]()
-
-        hd_correction = - derivative * hd_amplitude / 2 / (-2 * pi * 0.2)  # anharmonicity
-        carrier_I = window * real(carrier_I) + hd_correction * imag(carrier_I)
-        carrier_Q = window * real(carrier_Q) + hd_correction * imag(carrier_Q)
+        # the window with the half derivative correction modulated by the
+        # carrier is cached, so only the complex amplitudes are applied here
+        modulated = _modulated_envelope(N_time_steps, self._waveform_resolution,
+                                        window, hd_amplitude, frequency)
+        carrier_I = real(if_amp1 * amplitude * exp(1j * (if_phase + phase)) * modulated)
+        carrier_Q = real(if_amp2 * amplitude * exp(1j * phase) * modulated)
 
         self._pulse_seq_I.append_pulse(carrier_I + if_offs1)
         self._pulse_seq_Q.append_pulse(carrier_Q + if_offs2)
         return self
 
+    def _get_sine_calibration(self):
+        if self._sine_calibration is None:
+            results = self._iqmx_calibration.get_optimization_results()[0]
+            frequency = 2 * pi * self._iqmx_calibration \
+                .get_radiation_parameters()["if_frequency"] / 1e9
+            self._sine_calibration = tuple(results["if_offsets"]) + \
+                                     tuple(results["if_amplitudes"]) + \
+                                     (results["if_phase"], frequency)
+        return self._sine_calibration
+
     def add_sine_pulse_from_string(self, pulse_string, pulse_duration,
                                    pulse_amplitude, window='gaussian'):
         """
@@ -376,7 +408,7 @@ class IQPulseBuilder():
             Duration of the whole sequence
         """
         total_time_steps = round(total_duration / self._waveform_resolution)
-        current_time_steps = self._pulse_seq_I.total_points() - 1
+        current_time_steps = self._start_point + self._pulse_seq_I.total_points() - 1
         residual_time_steps = total_time_steps - current_time_steps
         self.add_zero_pulse(residual_time_steps * self._waveform_resolution)
         return self
@@ -1,20 +1,32 @@
-from queue import Queue
-from threading import Thread
+"""
+Logging and telemetry of the measurements: the calls only append records to a
+ring buffer, which a background thread writes to log/fulaut.log and
+log/fulaut.jsonl.
+"""
 
+import json
 import logging
+import os
+from collections import deque
+from contextlib import contextmanager
 from logging import Formatter
 from logging.handlers import TimedRotatingFileHandler
+from threading import Condition, Thread
+from time import perf_counter, time
+
+from numpy import generic
+
+# arguments that can not change before the message is formatted
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, type(None), generic)
 
 
 class LoggingServer():
-    loggingHandler = TimedRotatingFileHandler(
-        'log/fulaut.log', when="midnight", backupCount=1)
+    LEVELS = {"debug": logging.DEBUG, "info": logging.INFO,
+              "warn": logging.WARNING, "error": logging.ERROR}
     loggingFormat = '%(asctime)s.%(msecs)03d [%(levelname)s] %(message)s'
     loggingFormatter = Formatter(fmt=loggingFormat, datefmt='%I:%M:%S')
-    loggingHandler.setFormatter(loggingFormatter)
     logger = logging.getLogger('fulaut')
     logger.setLevel("DEBUG")
-    logger.addHandler(loggingHandler)
 
     INSTANCE = None
 
@@ -25,22 +37,203 @@ class LoggingServer():
         else:
             return LoggingServer.INSTANCE
 
-    def __init__(self):
-        self._messageQueue = Queue()
+    def __init__(self, log_dir="log", level="debug", capacity=10000,
+                 batch_size=500, flush_interval=1):
+        """
+        Parameters
+        ----------
+        log_dir: str
+        level: str
+            "debug", "info", "warn" or "error", the messages below it are
+            ignored; events are always recorded
+        capacity: int
+            size of the ring buffer of the records waiting to be written
+        batch_size: int
+            number of records that wakes up the writer before flush_interval
+        flush_interval: float
+            maximum time in seconds the records wait to be written
+        """
+        self._log_dir = log_dir
+        self._level = LoggingServer.LEVELS[level]
+        self._buffer = deque(maxlen=capacity)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._condition = Condition()
+        self._dropped = 0
+        self._pending = 0  # taken from the buffer, but not written yet
+        self._flush_requested = False
+        self._text_handler = None
+        self._sink = None
         t = Thread(target=self.run)
-        t.setDaemon(True)
+        t.daemon = True
         t.start()
 
-    def debug(self, *args):
-        self._messageQueue.put(("debug", args))
+    def set_level(self, level):
+        self._level = LoggingServer.LEVELS[level]
+
+    def is_enabled_for(self, level):
+        """
+        Allows to skip the preparation of the arguments of a message that
+        will not be recorded
+        """
+        return LoggingServer.LEVELS[level] >= self._level
+
+    def debug(self, msg, *args):
+        if self._level <= logging.DEBUG:
+            self._put_message("debug", msg, args)
+
+    def info(self, msg, *args):
+        if self._level <= logging.INFO:
+            self._put_message("info", msg, args)
+
+    def warn(self, msg, *args):
+        if self._level <= logging.WARNING:
+            self._put_message("warn", msg, args)
+
+    def error(self, msg, *args):
+        if self._level <= logging.ERROR:
+            self._put_message("error", msg, args)
+
+    def event(self, name, value, unit=None):
+        """
+        Records a numeric event, e.g. a duration of a setter call
+        """
+        self._put((time(), None, name, (value, unit)))
+
+    def count(self, name, increment=1):
+        self.event(name, increment, "count")
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Records the duration of the with-block in seconds as the event name
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.event(name, perf_counter() - start, "s")
 
-    def warn(self, *args):
-        self._messageQueue.put(("warn", args))
+    def get_dropped_records_number(self):
+        return self._dropped
+
+    def flush(self, timeout=None):
+        """
+        Waits until all the records put before the call are written
+        """
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: len(self._buffer) == 0 and self._pending == 0, timeout)
+
+    def query(self, name=None, level=None, since=None, until=None, path=None):
+        """
+        Reads the records from the structured log
+
+        Parameters
+        ----------
+        name: str
+            name of the events to be returned; if None, events are not
+            filtered by name
+        level: str
+            level of the messages to be returned; if neither name nor level
+            is given, all the records are returned
+        since, until: float
+            limits of the time of the records as returned by time.time()
+        path: str
+            the fulaut.jsonl of the log_dir of this instance by default
+
+        Returns
+        -------
+        records: list of dict
+            {"t": time, "l": level, "m": message} for the messages and
+            {"t": time, "e": name, "v": value, "u": unit} for the events
+        """
+        if path is None:
+            path = os.path.join(self._log_dir, 'fulaut.jsonl')
+        records = []
+        with open(path) as sink:
+            for line in sink:
+                record = json.loads(line)
+                if since is not None and record["t"] < since or \
+                        until is not None and record["t"] > until:
+                    continue
+                if name is None and level is None or \
+                        name is not None and record.get("e") == name or \
+                        level is not None and record.get("l") == level:
+                    records.append(record)
+        return records
+
+    def _put_message(self, level, msg, args):
+        if not all(isinstance(arg, IMMUTABLE_TYPES) for arg in args):
+            msg, args = self._format(msg, args), ()
+        self._put((time(), level, msg, args))
+
+    def _put(self, record):
+        with self._condition:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+            self._buffer.append(record)
+            if len(self._buffer) >= self._batch_size:
+                self._condition.notify_all()
 
     def run(self):
         while True:
-            msg = self._messageQueue.get()
-            if msg[0] == "debug":
-                self.logger.debug(*msg[1])
-            elif msg[0] == "warn":
-                self.logger.warning(*msg[1])
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._buffer) >= self._batch_size
+                                                 or self._flush_requested,
+                                         self._flush_interval)
+                self._flush_requested = False
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._pending = len(batch)
+            if len(batch) > 0:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # the log must never stop the measurements
+                    print("LoggingServer:", e)
+            with self._condition:
+                self._pending = 0
+                self._condition.notify_all()
+
+    def _write(self, batch):
+        if self._sink is None:
+            os.makedirs(self._log_dir, exist_ok=True)
+            self._text_handler = TimedRotatingFileHandler(
+                os.path.join(self._log_dir, 'fulaut.log'), when="midnight", backupCount=1)
+            self._text_handler.setFormatter(LoggingServer.loggingFormatter)
+            LoggingServer.logger.addHandler(self._text_handler)
+            self._sink = open(os.path.join(self._log_dir, 'fulaut.jsonl'), "a")
+
+        lines = []
+        for (t, level, msg, args) in batch:
+            if level is None:
+                value, unit = args
+                if not isinstance(value, (int, float)):
+                    value = float(value)  # numpy scalars
+                lines.append(json.dumps({"t": t, "e": msg, "v": value, "u": unit},
+                                        separators=(",", ":")))
+                continue
+            text = self._format(msg, args)
+            lines.append(json.dumps({"t": t, "l": level, "m": text},
+                                    separators=(",", ":")))
+            record = logging.makeLogRecord({"name": LoggingServer.logger.name,
+                                            "levelno": LoggingServer.LEVELS[level],
+                                            "levelname": logging.getLevelName(
+                                                LoggingServer.LEVELS[level]),
+                                            "msg": text, "created": t,
+                                            "msecs": (t - int(t)) * 1000})
+            LoggingServer.logger.handle(record)
+        self._sink.write("\n".join(lines) + "\n")
+        self._sink.flush()
+
+    @staticmethod
+    def _format(msg, args):
+        if len(args) == 0:
+            return str(msg)
+        try:
+            return msg % args
+        except (TypeError, ValueError):
+            return " ".join([str(msg)] + [str(arg) for arg in args])
@@ -33,12 +33,10 @@ from time import sleep
 
 from numpy import *
 import copy
-import pyvisa
 # import sys.stdout.flush
 # from sys.stdout import flush
 import os, fnmatch
 import pickle
-from drivers import *
 # from drivers.Agilent_PNA_L import *
 # from drivers.Agilent_PNA_L import *
 # from drivers.Yokogawa_GS200 import *
@@ -47,18 +45,21 @@ from drivers import *
 # from drivers.Agilent_DSO import *
 from matplotlib import pyplot as plt, animation
 from datetime import datetime as dt
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 from resonator_tools import circuit
 
 from lib2.MeasurementResult import MeasurementResult
 from lib2.ResonatorDetector import *
 from itertools import product
-from functools import reduce
-from operator import mul
 import traceback
 import sys
 
 from lib2.LoggingServer import LoggingServer
+from lib2.ProgressService import ProgressService, format_time_delta, print_status
+from lib2.DeviceRegistry import DeviceRegistry, DeviceProxy
+from lib2.SessionManager import SessionManager
 
 
 class Measurement:
@@ -69,30 +70,32 @@ class Measurement:
     """
     logger = LoggingServer.getInstance()
     _actual_devices = {}
+    _actual_devices_lock = Lock()
     _log = []
     _devs_dict = \
-        {'vna1': [["PNA-L", "PNA-L1"], [Agilent_PNA_L, "Agilent_PNA_L"]],
-         'vna2': [["PNA-L-2", "PNA-L2"], [Agilent_PNA_L, "Agilent_PNA_L"]],
-         'vna3': [["pna"], [Agilent_PNA_L, "Agilent_PNA_L"]],
-         'vna4': [["ZNB"], [znb, "Znb"]],
-         'exa': [["EXA"], [Agilent_EXA, "Agilent_EXA_N9010A"]],
-         'exg': [["EXG"], [E8257D, "EXG"]],
-         'psg2': [['PSG'], [E8257D, "EXG"]],
-         'mxg': [["MXG"], [E8257D, "MXG"]],
-         'psg1': [["psg1"], [E8257D, "EXG"]],
-         'awg1': [["AWG", "AWG1"], [KeysightAWG, "KeysightAWG"]],
-         'awg2': [["AWG_Vadik", "AWG2"], [KeysightAWG, "KeysightAWG"]],
-         'awg3': [["AWG3"], [KeysightAWG, "KeysightAWG"]],
-         'awg4': [["TEK1"], [Tektronix_AWG5014, "Tektronix_AWG5014"]],
-         'dso': [["DSO"], [Keysight_DSOX2014, "Keysight_DSOX2014"]],
-         'yok1': [["GS210_1"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'yok2': [["GS210_2"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'yok3': [["GS210_3"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'yok4': [["gs210"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'yok5': [["GS_210_3"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'yok6': [["YOK1"], [Yokogawa_GS200, "Yokogawa_GS210"]],
-         'k6220': [["k6220"], [k6220, "K6220"]]
+        {'vna1': [["PNA-L", "PNA-L1"], ["Agilent_PNA_L", "Agilent_PNA_L"]],
+         'vna2': [["PNA-L-2", "PNA-L2"], ["Agilent_PNA_L", "Agilent_PNA_L"]],
+         'vna3': [["pna"], ["Agilent_PNA_L", "Agilent_PNA_L"]],
+         'vna4': [["ZNB"], ["znb", "Znb"]],
+         'exa': [["EXA"], ["Agilent_EXA", "Agilent_EXA_N9010A"]],
+         'exg': [["EXG"], ["E8257D", "EXG"]],
+         'psg2': [['PSG'], ["E8257D", "EXG"]],
+         'mxg': [["MXG"], ["E8257D", "MXG"]],
+         'psg1': [["psg1"], ["E8257D", "EXG"]],
+         'awg1': [["AWG", "AWG1"], ["KeysightAWG", "KeysightAWG"]],
+         'awg2': [["AWG_Vadik", "AWG2"], ["KeysightAWG", "KeysightAWG"]],
+         'awg3': [["AWG3"], ["KeysightAWG", "KeysightAWG"]],
+         'awg4': [["TEK1"], ["Tektronix_AWG5014", "Tektronix_AWG5014"]],
+         'dso': [["DSO"], ["Keysight_DSOX2014", "Keysight_DSOX2014"]],
+         'yok1': [["GS210_1"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'yok2': [["GS210_2"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'yok3': [["GS210_3"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'yok4': [["gs210"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'yok5': [["GS_210_3"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'yok6': [["YOK1"], ["Yokogawa_GS200", "Yokogawa_GS210"]],
+         'k6220': [["k6220"], ["k6220", "K6220"]]
          }
+    _device_registry = DeviceRegistry(_devs_dict)
 
     def __init__(self, name, sample_name, devs_aliases_map, plot_update_interval=5):
         """
@@ -119,21 +122,25 @@ class Measurement:
 
         """
         self._interrupted = False
+        # if True, _preload_point is called for the next point of the sweep
+        # while the current one is recorded
+        self._preloading = False
         self._name = name
         self._sample_name = sample_name
         self._plot_update_interval = plot_update_interval
+        self._progress = ProgressService()
+        self._progress.subscribe(print_status)
         self._resonator_detector = ResonatorDetector()
 
         self._devs_aliases_map = devs_aliases_map
         self._list = ""
-        rm = pyvisa.ResourceManager()
-        temp_list = list(rm.list_resources_info().values())
-        Measurement.logger.debug("Measurement " + name + " init")
-        Measurement.logger.debug("Measurement " + name + " devs:" + str(devs_aliases_map))
-        self._devs_info = [item[4] for item in list(temp_list)]
-        # returns list of tuples: (IP Address string, alias) for all
-        # devices present in VISA
+        Measurement.logger.debug("Measurement %s init", name)
+        Measurement.logger.debug("Measurement %s devs:%s", name, devs_aliases_map)
         self._write_to_log()
+        with Measurement._actual_devices_lock:
+            self._init_devices()
+
+    def _init_devices(self):
         for field_name, dev_list in self._devs_aliases_map.items():
             atr_name = "_" + field_name
             self.__setattr__(atr_name, [None] * len(dev_list))
@@ -146,24 +153,46 @@ class Measurement:
                         self.__getattribute__(atr_name)[index] = device_object
                         continue
                     if name in Measurement._devs_dict.keys():
-                        for device_address in self._devs_info:
-                            if device_address in Measurement._devs_dict[name][0]:
-                                # print(name, device_address)
-                                device_object = getattr(*Measurement._devs_dict[name][1])(device_address)
-                                Measurement._actual_devices[name] = device_object
-                                print("The device %s is detected as %s" % (name, device_address))
-                                self.__getattribute__(atr_name)[index] = device_object
-                                break
+                        # the driver is imported and the device is connected
+                        # when the proxy is used for the first time
+                        device_object = Measurement._device_registry.get_device(name)
+                        if device_object is not None:
+                            Measurement._actual_devices[name] = device_object
+                            print("The device %s is detected as %s" % (name, device_object._address))
+                            self.__getattribute__(atr_name)[index] = device_object
                     else:
                         print("Device", name, "is unknown!")
                 else:
                     self.__getattribute__(atr_name)[index] = value
 
+    def get_devices(self):
+        """
+        Returns the list of the devices used by the measurement, e.g. to
+        reserve them with the SessionManager
+        """
+        devices = []
+        for field_name in self._devs_aliases_map.keys():
+            for device in getattr(self, "_" + field_name):
+                if device is not None and id(device) not in [id(other) for other in devices]:
+                    devices.append(device)
+        return devices
+
+    @staticmethod
+    def invalidate_devices_info():
+        """
+        Makes the next measurement scan VISA for the devices again instead of
+        using the cached list, e.g. after a new device was switched on
+        """
+        Measurement._device_registry.invalidate()
+
     @staticmethod
     def close_devs(devs_to_close):
-        for name in devs_to_close:
-            if name in Measurement._actual_devices.keys():
-                Measurement._actual_devices.pop(name)._visainstrument.close()
+        with Measurement._actual_devices_lock:
+            for name in devs_to_close:
+                if name in Measurement._actual_devices.keys():
+                    device_object = Measurement._actual_devices.pop(name)
+                    if not isinstance(device_object, DeviceProxy) or device_object.is_connected():
+                        device_object._visainstrument.close()
 
     def _load_fixed_parameters_into_devices(self):
         """
@@ -189,19 +218,82 @@ class Measurement:
     def set_swept_parameters(self, **swept_pars):
         """
         swept_pars :{'par1': (setter1, [value1, value2, ...]),
-                     'par2': (setter2, [value1, value2, ...]), ...}
+                     'par2': (setter2, [value1, value2, ...], [dev1, dev2]), ...}
+
+        The optional third element lists the devices that the setter
+        touches. If all the setters changed in a step have it, the setters
+        of different devices are called concurrently.
         """
         self._swept_pars = swept_pars
         self._swept_pars_names = list(swept_pars.keys())
         self._measurement_result.set_parameter_names(self._swept_pars_names)
         self._last_swept_pars_values = \
             {name: None for name in self._swept_pars_names}
+        self._setters_timing = {name: [0, 0] for name in self._swept_pars_names}
 
     def _call_setters(self, values_group):
+        changed = []
         for name, value in zip(self._swept_pars_names, values_group):
             if self._last_swept_pars_values[name] != value:
                 self._last_swept_pars_values[name] = value
-                self._swept_pars[name][0](value)  # this is setter call, look carefully
+                changed.append((name, value))
+
+        groups = self._group_setters_by_devices([name for name, value in changed])
+        if groups is None or len(groups) < 2:
+            self._call_setters_group(changed)
+            return
+
+        values = dict(changed)
+        if getattr(self, "_setters_executor", None) is None:
+            self._setters_executor = ThreadPoolExecutor(max_workers=len(self._swept_pars_names))
+        futures = [self._setters_executor.submit(self._call_setters_group,
+                                                 [(name, values[name]) for name in group])
+                   for group in groups]
+        for future in futures:
+            future.result()  # waits for all the setters and re-raises their errors
+
+    def _call_setters_group(self, names_and_values):
+        for name, value in names_and_values:
+            start = perf_counter()
+            self._swept_pars[name][0](value)  # this is setter call, look carefully
+            duration = perf_counter() - start
+            timing = self._setters_timing[name]
+            timing[0] += 1
+            timing[1] += duration
+            Measurement.logger.event("setter:" + name, duration, "s")
+
+    def _group_setters_by_devices(self, names):
+        """
+        Splits the setters into groups that do not share any devices, keeping
+        the order of the setters within each group; returns None if any of
+        the setters has not declared its devices
+        """
+        groups = []
+        for name in names:
+            if len(self._swept_pars[name]) < 3:
+                return None
+            devices = set(id(device) for device in self._swept_pars[name][2])
+            overlapping = [group for group in groups if group[1] & devices]
+            merged = ([name for group in overlapping for name in group[0]] + [name],
+                      devices.union(*[group[1] for group in overlapping]))
+            groups = [group for group in groups if group not in overlapping] + [merged]
+        return [group[0] for group in groups]
+
+    def get_setters_timing(self):
+        """
+        Returns the average time in seconds spent in each of the setters
+        """
+        return {name: timing[1] / timing[0] if timing[0] > 0 else 0
+                for name, timing in self._setters_timing.items()}
+
+    def get_progress(self):
+        """
+        Returns the ProgressService of the measurement: its get_status()
+        returns the current ProgressStatus, and the callbacks passed to its
+        subscribe() receive the statuses at most once per second. The status
+        is printed by the print_status subscriber, which may be unsubscribed.
+        """
+        return self._progress
 
     def launch(self):
 
@@ -237,6 +329,14 @@ class Measurement:
         except Exception:
             self._measurement_result.set_is_finished(True)
             self._measurement_result.set_exception_info(sys.exc_info())
+        finally:
+            self._progress.finish()
+            if getattr(self, "_setters_executor", None) is not None:
+                self._setters_executor.shutdown()
+                self._setters_executor = None
+            if getattr(self, "_preload_executor", None) is not None:
+                self._preload_executor.shutdown()
+                self._preload_executor = None
 
     def set_measurement_result(self, measurement_result : MeasurementResult):
         self._measurement_result = measurement_result
@@ -255,14 +355,35 @@ class Measurement:
             [list(range(len(self._swept_pars[parameter_name][1]))) for parameter_name in par_names]
         raw_data_shape = \
             [len(indices) for indices in parameters_idxs]
-        total_iterations = reduce(mul, raw_data_shape, 1)
+        self._progress.start(par_names, raw_data_shape, self.get_setters_timing)
+
+        skipped_iterations = 0
+        points = list(zip(product(*parameters_idxs), product(*parameters_values)))
 
-        for idx_group, values_group in zip(product(*parameters_idxs), product(*parameters_values)):
+        for point_idx, (idx_group, values_group) in enumerate(points):
+
+            if not self._is_point_in_scan_area(idx_group, values_group):
+                skipped_iterations += 1
+                continue
 
             self._call_setters(values_group)
+            self._current_idx_group = idx_group
+
+            preload = None
+            next_point_idx = self._find_next_recorded_point(points, point_idx) \
+                if self._preloading else None
+            if next_point_idx is not None:
+                if getattr(self, "_preload_executor", None) is None:
+                    self._preload_executor = ThreadPoolExecutor(max_workers=1)
+                preload = self._preload_executor.submit(self._preload_point,
+                                                        points[next_point_idx][1])
 
             # This should be implemented in child classes:
-            data = self._recording_iteration()
+            with Measurement.logger.timer("recording_iteration:" + self._name):
+                data = self._recording_iteration()
+
+            if preload is not None:
+                preload.result()
 
             if done_iterations == 0:
                 try:
@@ -277,31 +398,49 @@ class Measurement:
             self._measurement_result.set_data(measurement_data)
 
             done_iterations += 1
-
-            avg_time = (dt.now() - start_time).total_seconds() / done_iterations
-            time_left = self._format_time_delta(avg_time * (total_iterations - done_iterations))
-
-            formatted_values_group = \
-                '[' + "".join(["%s: %.2e, " % (par_names[idx], value)
-                               for idx, value in enumerate(values_group)])[:-2] + ']' \
-                if isinstance(values_group[0], (float, int)) else \
-                '[' + "".join(["%s: %s, " % (par_names[idx], str(value))
-                               for idx, value in enumerate(values_group)])[:-2] + ']'
-
-            print("\rTime left: " + time_left + ", %s" % formatted_values_group +
-                  ", average cycle time: " + str(round(avg_time, 2)) + " s       ",
-                  end="", flush=True)
+            self._progress.update(idx_group, values_group, skipped_iterations)
 
             if self._interrupted:
+                self._progress.finish()
                 self._measurement_result.set_is_finished(True)
                 return
 
         self._measurement_result.set_recording_time(dt.now() - start_time)
-        print("\nElapsed time: %s" %
-              self._format_time_delta((dt.now() - start_time)
-                                      .total_seconds()))
+        self._progress.finish()
         self._measurement_result.set_is_finished(True)
 
+    def _is_point_in_scan_area(self, idx_group, values_group):
+        """
+        This method MAY be overridden to skip some of the points of the
+        parameter grid, e.g. the ones outside of an adaptive frequency window
+        (see lib2.AdaptiveWindow). The data of the skipped points stays zero.
+        """
+        return True
+
+    def _is_point_expected_in_scan_area(self, idx_group, values_group):
+        """
+        This method MAY be overridden together with _is_point_in_scan_area to
+        predict whether a point ahead of the current one will be recorded, so
+        that the skipped points are not preloaded. It must not change the
+        state of the measurement.
+        """
+        return True
+
+    def _find_next_recorded_point(self, points, point_idx):
+        for next_point_idx in range(point_idx + 1, len(points)):
+            if self._is_point_expected_in_scan_area(*points[next_point_idx]):
+                return next_point_idx
+        return None
+
+    def _preload_point(self, values_group):
+        """
+        This method MAY be overridden together with setting self._preloading
+        to prepare the devices for the next point of the sweep, e.g. to load
+        its waveforms into the idle buffers of the AWGs. It is called in a
+        background thread while the current point is recorded.
+        """
+        pass
+
     def _recording_iteration(self):
         """
         This method must be overridden for each new measurement type.
@@ -332,12 +471,13 @@ class Measurement:
         """
         vna = self._vna[0]
         for i in range(0, tries_number):
-            vna.avg_clear();
-            vna.prepare_for_stb();
-            vna.sweep_single();
-            vna.wait_for_stb()
-            frequencies, sdata = vna.get_frequencies(), vna.get_sdata()
-            vna.autoscale_all()
+            with SessionManager.getInstance().transaction(vna):
+                vna.avg_clear();
+                vna.prepare_for_stb();
+                vna.sweep_single();
+                vna.wait_for_stb()
+                frequencies, sdata = vna.get_frequencies(), vna.get_sdata()
+                vna.autoscale_all()
             self._resonator_detector.set_data(frequencies, sdata)
             self._resonator_detector.set_plot(plot)
             result = self._resonator_detector.detect()
@@ -400,6 +540,4 @@ class Measurement:
             return self._fixed_params
 
     def _format_time_delta(self, delta):
-        hours, remainder = divmod(delta, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        return '%s h %s m %s s' % (int(hours), int(minutes), round(seconds, 2))
+        return format_time_delta(delta)
@@ -0,0 +1,252 @@
+"""
+Progress of the measurements for the consoles, notebooks and monitors,
+published by a background thread with a cost-based prediction of the time
+left.
+"""
+
+from threading import Condition, Thread
+from time import perf_counter
+
+from numpy import *
+
+from lib2.LoggingServer import LoggingServer
+
+
+class ProgressStatus:
+
+    def __init__(self, done, total, skipped, position, elapsed, time_left,
+                 rate, finished):
+        """
+        Parameters
+        ----------
+        done: int
+            number of the recorded points
+        total: int
+            number of the points in the grid
+        skipped: int
+            number of the points skipped as out of the scan area
+        position: list
+            [(name, index, number of values, value), ...] of the last
+            recorded point for each of the axes
+        elapsed: float
+            seconds since the start
+        time_left: float
+            predicted seconds until the end
+        rate: float
+            recent number of the points per second
+        finished: bool
+        """
+        self.done = done
+        self.total = total
+        self.skipped = skipped
+        self.position = position
+        self.elapsed = elapsed
+        self.time_left = time_left
+        self.rate = rate
+        self.finished = finished
+
+    def get_fraction_done(self):
+        return (self.done + self.skipped) / self.total if self.total > 0 else 1
+
+    def to_dict(self):
+        return {"done": self.done, "total": self.total, "skipped": self.skipped,
+                "position": [{"name": name, "index": idx, "size": size,
+                              "value": value}
+                             for name, idx, size, value in self.position],
+                "elapsed": self.elapsed, "time_left": self.time_left,
+                "rate": self.rate, "finished": self.finished}
+
+    def __str__(self):
+        if self.finished:
+            return "Elapsed time: %s" % format_time_delta(self.elapsed)
+        values = ", ".join(["%s: %.2e" % (name, value)
+                            if isinstance(value, (float, int)) else
+                            "%s: %s" % (name, str(value))
+                            for name, idx, size, value in self.position])
+        cycle_time = 1 / self.rate if self.rate > 0 else 0
+        return "Time left: %s, [%s], average cycle time: %s s" % \
+               (format_time_delta(self.time_left), values, round(cycle_time, 2))
+
+
+class ProgressService:
+    logger = LoggingServer.getInstance()
+
+    def __init__(self, min_interval=1, rate_smoothing=0.1):
+        """
+        Parameters
+        ----------
+        min_interval: float
+            minimum time in seconds between the published statuses
+        rate_smoothing: float
+            weight of the last point in the moving average of the rate
+        """
+        self._min_interval = min_interval
+        self._rate_smoothing = rate_smoothing
+        self._subscribers = []
+        self._condition = Condition()
+        self._thread = None
+        self._reset([], [], None)
+
+    def subscribe(self, callback):
+        """
+        callback(status) is called with a ProgressStatus from the publishing
+        thread, the last call has status.finished set
+        """
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def get_status(self):
+        """
+        Returns the status of the last report, or of the finished measurement
+        """
+        with self._condition:
+            return self._make_status()
+
+    def start(self, names, shape, setters_timing_getter=None):
+        """
+        Parameters
+        ----------
+        names: list
+            names of the axes of the grid, the first one is the outermost
+        shape: list
+            numbers of the values of the axes
+        setters_timing_getter: callable
+            returns {name: average duration of the setter} like
+            Measurement.get_setters_timing
+        """
+        self.finish()
+        with self._condition:
+            self._reset(names, shape, setters_timing_getter)
+        self._thread = Thread(target=self._publish_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def update(self, idx_group, values_group, skipped=0):
+        """
+        Reports a recorded point of the grid
+
+        Parameters
+        ----------
+        idx_group, values_group: tuple
+            indices and values of the point along each of the axes
+        skipped: int
+            number of the points skipped so far
+        """
+        now = perf_counter()
+        with self._condition:
+            duration = now - self._last_time
+            self._last_time = now
+            self._done += 1
+            self._skipped = skipped
+            self._idx_group = idx_group
+            self._values_group = values_group
+            if self._point_duration is None:
+                self._point_duration = duration
+            else:
+                self._point_duration += \
+                    self._rate_smoothing * (duration - self._point_duration)
+            self._version += 1
+
+    def finish(self):
+        """
+        Publishes the final status and stops the publishing thread
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+        thread.join()
+        self._thread = None
+
+    def _reset(self, names, shape, setters_timing_getter):
+        self._names = list(names)
+        self._shape = [int(size) for size in shape]
+        self._total = int(prod(self._shape)) if len(self._shape) > 0 else 0
+        self._setters_timing_getter = setters_timing_getter
+        self._done = 0
+        self._skipped = 0
+        self._idx_group = None
+        self._values_group = None
+        self._start_time = self._last_time = perf_counter()
+        self._point_duration = None
+        self._finished = False
+        self._version = 0
+
+    def _publish_loop(self):
+        published_version = -1
+        while True:
+            with self._condition:
+                self._condition.wait(self._min_interval)
+                finished = self._finished
+                if self._version == published_version and not finished:
+                    continue
+                published_version = self._version
+                status = self._make_status()
+            self._publish(status)
+            if finished:
+                return
+
+    def _publish(self, status):
+        for callback in list(self._subscribers):
+            try:
+                callback(status)
+            except Exception as e:
+                # the subscribers must never stop the measurement
+                ProgressService.logger.warn("Progress subscriber %s failed: %s",
+                                            callback, e)
+
+    def _make_status(self):
+        position = []
+        if self._idx_group is not None:
+            position = [(name, int(idx), size, value) for name, idx, size, value
+                        in zip(self._names, self._idx_group, self._shape,
+                               self._values_group)]
+        rate = 1 / self._point_duration if self._point_duration else 0
+        return ProgressStatus(self._done, self._total, self._skipped, position,
+                              perf_counter() - self._start_time,
+                              0 if self._finished else self._predict_time_left(),
+                              rate, self._finished)
+
+    def _predict_time_left(self):
+        points_left = self._total - self._done - self._skipped
+        if self._done == 0 or points_left <= 0:
+            return 0
+
+        setters_timing = self._setters_timing_getter() \
+            if self._setters_timing_getter is not None else {}
+        setters_time_left = 0
+        setters_time_done = 0
+        for axis, name in enumerate(self._names):
+            cost = setters_timing.get(name, 0)
+            # the setter of an axis is called each time the indices of the
+            # axes up to it change
+            calls = int(prod(self._shape[:axis + 1]))
+            calls_done = int(ravel_multi_index(self._idx_group[:axis + 1],
+                                               self._shape[:axis + 1])) + 1
+            setters_time_left += cost * (calls - calls_done)
+            setters_time_done += cost * calls_done
+
+        elapsed = self._last_time - self._start_time
+        point_cost = maximum(elapsed - setters_time_done, 0) / self._done
+        return float(points_left * point_cost + setters_time_left)
+
+
+def print_status(status):
+    """
+    Subscriber printing the status in one line of the console or notebook
+    """
+    if status.finished:
+        print("\n" + str(status), flush=True)
+    else:
+        print("\r" + str(status) + "       ", end="", flush=True)
+
+
+def format_time_delta(delta):
+    hours, remainder = divmod(delta, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return '%s h %s m %s s' % (int(hours), int(minutes), round(seconds, 2))
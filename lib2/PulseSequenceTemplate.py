@@ -0,0 +1,217 @@
+"""
+Pulse sequences of a sweep compiled once and patched for each point, so that
+only the changed segments are built again and only the changed channels are
+uploaded.
+"""
+
+from numpy import *
+
+from lib2.IQPulseSequence import IQPulseBuilder, IQPulseSequence, PulseSequence
+
+# segments whose waveforms depend on their position in the sequence
+POSITION_DEPENDENT_SEGMENTS = ("add_sine_pulse", "add_sine_pulse_from_string",
+                               "add_zero_until")
+
+
+class SegmentRecorder:
+    """
+    Stands in for a PulseBuilder or an IQPulseBuilder in a sequence generator
+    and records the calls of its add_... methods as segments
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._segments = []
+
+    def __getattr__(self, attr):
+        if not attr.startswith("add_"):
+            raise AttributeError(attr)
+
+        def record(*args, **kwargs):
+            self._segments.append((attr, args, tuple(sorted(kwargs.items()))))
+            return self
+
+        return record
+
+    def build(self):
+        segments, self._segments = self._segments, []
+        return RecordedSequence(self._builder, segments)
+
+
+class RecordedSequence:
+
+    def __init__(self, builder, segments):
+        self.builder = builder
+        self.segments = segments
+
+
+class ChannelTemplate:
+    """
+    Cached waveforms of one channel (a PulseSequence or an IQPulseSequence)
+    with the positions of its segments
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._sequence = None
+        self._entries = []  # (segment, start, waveforms)
+
+    def get_sequence(self):
+        return self._sequence
+
+    def update(self, segments):
+        """
+        Patches the cached waveforms for the new segments
+
+        Returns
+        -------
+        changed: bool
+            False if the waveforms are the same as before
+        """
+        entries = []
+        start = 0
+        first_changed = None
+        for idx, segment in enumerate(segments):
+            old = self._entries[idx] if idx < len(self._entries) else None
+            if old is not None and _same_segment(old[0], segment) and \
+                    (old[1] == start or segment[0] not in POSITION_DEPENDENT_SEGMENTS):
+                waveforms = old[2]
+            else:
+                waveforms = self._build_segment(segment, start)
+            if first_changed is None and (old is None or old[1] != start or
+                                          old[2] is not waveforms):
+                first_changed = idx
+            entries.append((segment, start, waveforms))
+            start += len(waveforms[0]) - 1
+
+        if first_changed is None and len(entries) == len(self._entries) \
+                and self._sequence is not None:
+            return False
+
+        old_entries, self._entries = self._entries, entries
+        total_points = start + 1
+        changed = False
+        if self._sequence is None or self._get_total_points() != total_points:
+            changed = True
+            # the waveforms before the first changed segment are kept
+            first_changed = first_changed if first_changed is not None else 0
+            prefix = entries[first_changed][1] if self._sequence is not None \
+                and first_changed < len(entries) else 0
+            self._allocate(total_points, prefix)
+            to_write = entries[first_changed:]
+        else:
+            old_positions = set((id(entry[2]), entry[1]) for entry in old_entries)
+            to_write = [entry for entry in entries
+                        if (id(entry[2]), entry[1]) not in old_positions]
+
+        arrays = self._get_arrays()
+        for (segment, start, waveforms) in to_write:
+            for (array, points) in zip(arrays, waveforms):
+                # the last point of each segment is overwritten by the first
+                # point of the next one, as in PulseSequence.append_pulse
+                region = slice(start, start + len(points) - 1)
+                # e.g. a longer zero pulse replacing a shorter one and the
+                # following zeros changes nothing
+                changed = changed or not array_equal(array[region], points[:-1])
+                array[region] = points[:-1]
+        non_empty = [entry for entry in entries if len(entry[2][0]) > 1]
+        if len(non_empty) > 0:
+            for (array, points) in zip(arrays, non_empty[-1][2]):
+                changed = changed or array[-1] != points[-1]
+                array[-1] = points[-1]
+        return bool(changed)
+
+    def _build_segment(self, segment, start):
+        name, args, kwargs = segment
+        self._builder._start_point = start
+        try:
+            getattr(self._builder, name)(*args, **dict(kwargs))
+        finally:
+            self._builder._start_point = 0
+        sequence = self._builder.build()
+        if isinstance(sequence, IQPulseSequence):
+            waveforms = (sequence.get_I_waveform(), sequence.get_Q_waveform())
+        else:
+            waveforms = (sequence.get_waveform(),)
+        if len(waveforms[0]) < 2:
+            # segments of zero length are ignored by the builders
+            return tuple(waveform[:1] for waveform in waveforms)
+        return waveforms
+
+    def _allocate(self, total_points, prefix):
+        old_arrays = self._get_arrays() if self._sequence is not None else None
+        n_arrays = 2 if isinstance(self._builder, IQPulseBuilder) else 1
+        sequences = []
+        for idx in range(n_arrays):
+            sequence = PulseSequence(self._builder._waveform_resolution)
+            sequence._waveform = zeros(total_points)
+            if old_arrays is not None:
+                sequence._waveform[:prefix] = old_arrays[idx][:prefix]
+            sequences.append(sequence)
+        self._sequence = IQPulseSequence(*sequences) if n_arrays == 2 \
+            else sequences[0]
+
+    def _get_arrays(self):
+        if isinstance(self._sequence, IQPulseSequence):
+            return [self._sequence.get_I_waveform(), self._sequence.get_Q_waveform()]
+        return [self._sequence.get_waveform()]
+
+    def _get_total_points(self):
+        return len(self._get_arrays()[0])
+
+
+class PulseSequenceTemplate:
+
+    def __init__(self, sequence_generator, **pbs):
+        """
+        Parameters
+        ----------
+        sequence_generator: callable
+            one of the IQPulseBuilder.build_... static methods
+        pbs: dict
+            {'q_pbs': [...], 'ro_pbs': [...], 'q_z_pbs': [...]} pulse builders
+            as for the sequence generator
+        """
+        self._sequence_generator = sequence_generator
+        self._recorders = {key: [SegmentRecorder(pb) if pb is not None else None
+                                 for pb in builders]
+                           for key, builders in pbs.items()}
+        self._channels = {}  # id(builder) -> ChannelTemplate
+
+    def get_sequence_generator(self):
+        return self._sequence_generator
+
+    def update(self, pulse_sequence_parameters):
+        """
+        Brings the sequences up to date with the parameters
+
+        Returns
+        -------
+        seqs: dict
+            {'q_seqs': [...], 'ro_seqs': [...], ...} as returned by the
+            sequence generator
+        changed: dict
+            {'q_seqs': [bool, ...], ...}, True for the channels whose
+            waveforms have changed since the previous update
+        """
+        recorded = self._sequence_generator(pulse_sequence_parameters,
+                                            **self._recorders)
+        seqs, changed = {}, {}
+        for key, recorded_sequences in recorded.items():
+            seqs[key], changed[key] = [], []
+            for recorded_sequence in recorded_sequences:
+                builder = recorded_sequence.builder
+                if id(builder) not in self._channels:
+                    self._channels[id(builder)] = ChannelTemplate(builder)
+                channel = self._channels[id(builder)]
+                changed[key].append(channel.update(recorded_sequence.segments))
+                seqs[key].append(channel.get_sequence())
+        return seqs, changed
+
+
+def _same_segment(segment, other):
+    try:
+        return bool(segment == other)
+    except ValueError:
+        # array arguments
+        return False
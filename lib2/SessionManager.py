@@ -0,0 +1,152 @@
+"""
+Coordination of several measurements sharing the same set of instruments
+through per-device locks and all-or-nothing reservations.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime as dt
+from threading import Condition, Lock, RLock, Thread
+
+
+class DeviceReservationError(Exception):
+    pass
+
+
+class SessionManager:
+
+    INSTANCE = None
+
+    def getInstance():
+        if SessionManager.INSTANCE is None:
+            SessionManager.INSTANCE = SessionManager()
+        return SessionManager.INSTANCE
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_lock = Lock()
+        self._reservations = {}  # device key -> owner
+        self._reservations_condition = Condition()
+
+    def get_lock(self, device):
+        """
+        Returns the reentrant lock guarding the session of the device
+        """
+        key = self._device_key(device)
+        with self._locks_lock:
+            if key not in self._locks:
+                self._locks[key] = RLock()
+            return self._locks[key]
+
+    @contextmanager
+    def transaction(self, *devices):
+        """
+        Holds the locks of the devices for the duration of the with-block, so
+        that a sequence of commands is not interleaved with the commands from
+        other threads. Locks are always taken in the same order to avoid
+        deadlocks between transactions on overlapping sets of devices.
+        """
+        locks = [self.get_lock(device) for device in
+                 sorted(set(devices), key=self._device_key)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def reserve(self, owner, devices, timeout=None):
+        """
+        Reserves all the devices for the owner at once, waiting until none of
+        them is reserved by somebody else
+
+        Parameters
+        ----------
+        owner: object
+            usually a Measurement
+        devices: iterable
+            device objects or proxies
+        timeout: float
+            maximum waiting time in seconds, infinite if None
+
+        Raises
+        ------
+        DeviceReservationError
+            if the devices were not released in time
+        """
+        keys = set(self._device_key(device) for device in devices)
+        with self._reservations_condition:
+            is_free = lambda: all(self._reservations.get(key, owner) is owner
+                                  for key in keys)
+            if not self._reservations_condition.wait_for(is_free, timeout):
+                busy = [key for key in keys if not self._reservations.get(key, owner) is owner]
+                raise DeviceReservationError("Devices %s are reserved by other measurements" % busy)
+            for key in keys:
+                self._reservations[key] = owner
+
+    def release(self, owner):
+        """
+        Releases all the devices reserved by the owner
+        """
+        with self._reservations_condition:
+            for key in [key for key, value in self._reservations.items() if value is owner]:
+                del self._reservations[key]
+            self._reservations_condition.notify_all()
+
+    @contextmanager
+    def reservation(self, owner, devices, timeout=None):
+        self.reserve(owner, devices, timeout)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+    def get_reservations(self):
+        with self._reservations_condition:
+            return dict(self._reservations)
+
+    def schedule(self, measurement, timeout=None):
+        """
+        Starts the measurement in a background thread as soon as all of its
+        devices are free; the devices are released when it is finished
+
+        Returns
+        -------
+        thread: Thread
+        """
+        thread = Thread(target=self._run_measurement, args=(measurement, timeout))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run_all(self, measurements, timeout=None):
+        """
+        Runs the measurements concurrently as far as their devices allow and
+        waits for all of them to finish
+
+        Returns
+        -------
+        results: list of MeasurementResult
+        """
+        threads = [self.schedule(measurement, timeout) for measurement in measurements]
+        for thread in threads:
+            thread.join()
+        return [measurement._measurement_result for measurement in measurements]
+
+    def _run_measurement(self, measurement, timeout):
+        result = measurement._measurement_result
+        try:
+            with self.reservation(measurement, measurement.get_devices(), timeout):
+                result.set_start_datetime(dt.now())
+                result.set_is_finished(False)
+                measurement.measure()
+        except DeviceReservationError as e:
+            result.set_is_finished(True)
+            print(measurement._name + ":", e)
+
+    @staticmethod
+    def _device_key(device):
+        # proxies of the same device are interchangeable, so they are
+        # identified by the standard name of the device they stand for
+        name = getattr(device, "_session_name", None)
+        return name if name is not None else "id%d" % id(device)
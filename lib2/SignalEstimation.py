@@ -0,0 +1,153 @@
+"""
+Deterministic initial guesses for the fits of the time-domain measurements,
+for complex data sampled on a uniform grid t.
+"""
+
+from numpy import *
+
+from lib2.BatchFitter import oscillation_initial_guess
+
+
+def estimate_frequency(t, data, oversampling=8):
+    """
+    Angular frequency of the strongest oscillation in the data, in radians
+    per unit of t
+
+    The complex data is projected on its main axis before the FFT, so that
+    oscillations along any direction in the IQ plane are treated equally.
+    """
+    return oscillation_initial_guess(t, [data], oversampling)[0, 3]
+
+
+def matrix_pencil_rates(t, data, n_exponentials, pencil_parameter=None):
+    """
+    Complex rates s_j for the representation data = sum_j b_j exp(s_j t)
+
+    Parameters
+    ----------
+    t: array
+        uniform time grid
+    data: array
+    n_exponentials: int
+        model order; 2 for a decay with an offset, 3 for a damped
+        oscillation with an offset
+    pencil_parameter: int
+        defaults to a third of the number of points
+
+    Returns
+    -------
+    rates: complex array of shape (n_exponentials,)
+    """
+    t, data = asarray(t), asarray(data, dtype=complex)
+    n_points = len(data)
+    if pencil_parameter is None:
+        pencil_parameter = n_points // 3
+    pencil_parameter = maximum(pencil_parameter, n_exponentials)
+
+    hankel = array([data[idx:idx + pencil_parameter + 1]
+                    for idx in range(n_points - pencil_parameter)])
+    u, s, vh = linalg.svd(hankel, full_matrices=False)
+    v = vh[:n_exponentials].conj().T
+    poles = linalg.eigvals(linalg.pinv(v[:-1]).dot(v[1:]))
+    return log(poles.astype(complex)) / (t[1] - t[0])
+
+
+def fit_linear_coefficients(basis, data):
+    """
+    Complex coefficients c minimizing |sum_j c_j basis_j - data|
+
+    Parameters
+    ----------
+    basis: list of arrays of the same length as data
+    data: array
+    """
+    design = column_stack(basis).astype(complex)
+    return linalg.lstsq(design, asarray(data, dtype=complex), rcond=None)[0]
+
+
+def estimate_decay_time(t, data, omega=0, default=None):
+    """
+    Decay time of a (possibly oscillating) signal with an offset found by the
+    matrix pencil method; for oscillations the pair of rates closest to
+    +-1j*omega is used
+
+    If the estimate is not positive and finite, default (the span of t
+    unless specified) is returned.
+    """
+    t = asarray(t)
+    if default is None:
+        default = t[-1] - t[0]
+    n_exponentials = 2 if omega == 0 else 3
+    try:
+        rates = matrix_pencil_rates(t, data, n_exponentials)
+    except linalg.LinAlgError:
+        return default
+
+    # the rate closest to zero describes the offset
+    rates = delete(rates, argmin(abs(rates)))
+    if omega != 0:
+        rates = rates[argsort(abs(abs(imag(rates)) - omega))[:2]]
+    decay_rate = -mean(real(rates))
+    if not isfinite(decay_rate) or decay_rate <= 0:
+        return default
+    return 1 / decay_rate
+
+
+def estimate_damped_oscillation(t, data, phase=None):
+    """
+    Initial guess for data = c*exp(-t/T)*cos(Omega*t + phase) + offset
+
+    Parameters
+    ----------
+    t: array
+    data: array
+    phase: float
+        if specified, the phase is kept fixed and only the complex amplitude
+        is estimated
+
+    Returns
+    -------
+    amplitude: complex
+    decay_time: float
+    omega: float
+    phase: float
+    offset: complex
+    """
+    t, data = asarray(t), asarray(data, dtype=complex)
+    omega = estimate_frequency(t, data)
+    decay_time = estimate_decay_time(t, data, omega)
+    envelope = exp(-t / decay_time)
+
+    if phase is not None:
+        amplitude, offset = fit_linear_coefficients(
+            [envelope * cos(omega * t + phase), ones_like(t)], data)
+        return amplitude, decay_time, omega, phase, offset
+
+    # c*cos(Omega*t + phase) = a*cos(Omega*t) + b*sin(Omega*t) with
+    # a = c*cos(phase) and b = -c*sin(phase)
+    a, b, offset = fit_linear_coefficients(
+        [envelope * cos(omega * t), envelope * sin(omega * t), ones_like(t)], data)
+    # (cos(phase), -sin(phase)) is the real direction along which the complex
+    # vector (a, b) is the longest
+    direction = linalg.svd(array([[real(a), real(b)],
+                                  [imag(a), imag(b)]]))[2][0]
+    phase = arctan2(-direction[1], direction[0])
+    amplitude = a * cos(phase) - b * sin(phase)
+    return amplitude, decay_time, omega, phase, offset
+
+
+def estimate_exponential_decay(t, data):
+    """
+    Initial guess for data = c*exp(-t/T) + offset
+
+    Returns
+    -------
+    amplitude: complex
+    decay_time: float
+    offset: complex
+    """
+    t, data = asarray(t), asarray(data, dtype=complex)
+    decay_time = estimate_decay_time(t, data)
+    amplitude, offset = fit_linear_coefficients(
+        [exp(-t / decay_time), ones_like(t)], data)
+    return amplitude, decay_time, offset
@@ -0,0 +1,186 @@
+"""
+Single-shot readout: streaming IQ histograms and state discrimination.
+"""
+
+from numpy import *
+
+
+class IQHistogram:
+
+    def __init__(self, bins=100, iq_range=None):
+        """
+        Parameters
+        ----------
+        bins: int
+            number of bins along each of the quadratures
+        iq_range: tuple
+            ((i_min, i_max), (q_min, q_max)); taken from the first batch of
+            shots with margins if not specified
+        """
+        self._bins = bins
+        self._range = iq_range
+        self._counts = None
+        self._i_edges = None
+        self._q_edges = None
+        self._outliers = 0
+
+    def add(self, shots):
+        """
+        Adds the complex shots to the histogram
+        """
+        shots = asarray(shots).ravel()
+        if self._range is None:
+            self._range = tuple(self._padded_range(quadrature)
+                                for quadrature in (real(shots), imag(shots)))
+        counts, i_edges, q_edges = histogram2d(real(shots), imag(shots),
+                                               bins=self._bins, range=self._range)
+        if self._counts is None:
+            self._counts = zeros_like(counts, dtype=int)
+            self._i_edges, self._q_edges = i_edges, q_edges
+        self._counts += counts.astype(int)
+        self._outliers += len(shots) - int(counts.sum())
+
+    def get_counts(self):
+        """
+        Returns
+        -------
+        counts: array of shape (bins, bins)
+            the first index is along the I quadrature; None before the
+            first shots are added
+        i_edges, q_edges: arrays of shape (bins+1,)
+        """
+        return self._counts, self._i_edges, self._q_edges
+
+    def get_total_shots(self):
+        return 0 if self._counts is None else int(self._counts.sum()) + self._outliers
+
+    def get_outliers(self):
+        """
+        Returns the number of shots that fell outside of the histogram range
+        """
+        return self._outliers
+
+    def reset(self):
+        self._counts = None
+        self._outliers = 0
+
+    @staticmethod
+    def _padded_range(values):
+        low, high = values.min(), values.max()
+        margin = 0.5 * (high - low) if high > low else 1
+        return low - margin, high + margin
+
+
+class StateDiscriminator:
+
+    def __init__(self):
+        self._ground_center = None
+        self._excited_center = None
+        self._threshold = None
+        self._assignment_fidelities = None
+
+    def calibrate(self, ground_shots, excited_shots):
+        """
+        Finds the threshold from the shots taken with the qubit prepared in
+        the ground and in the excited state
+
+        Returns
+        -------
+        assignment_fidelities: tuple
+            probabilities to assign the right state to the ground and to the
+            excited state shots
+        """
+        ground_shots = asarray(ground_shots).ravel()
+        excited_shots = asarray(excited_shots).ravel()
+        self._ground_center = mean(ground_shots)
+        self._excited_center = mean(excited_shots)
+
+        ground_projections = self._project(ground_shots)
+        excited_projections = self._project(excited_shots)
+        self._threshold = self._equal_density_point(
+            mean(ground_projections), std(ground_projections),
+            mean(excited_projections), std(excited_projections))
+
+        self._assignment_fidelities = (mean(~self.classify(ground_shots)),
+                                       mean(self.classify(excited_shots)))
+        return self._assignment_fidelities
+
+    def is_calibrated(self):
+        return self._threshold is not None
+
+    def get_basis(self):
+        """
+        Returns the centers of the ground and the excited state clouds, which
+        can be used as the basis of the averaged measurements
+        """
+        return self._ground_center, self._excited_center
+
+    def get_iq_range(self, margin=1):
+        """
+        Returns the range ((i_min, i_max), (q_min, q_max)) around both of the
+        clouds extended by margin distances between their centers, e.g. for
+        an IQHistogram
+        """
+        centers = array([self._ground_center, self._excited_center])
+        padding = margin * abs(self._excited_center - self._ground_center)
+        return tuple((quadrature.min() - padding, quadrature.max() + padding)
+                     for quadrature in (real(centers), imag(centers)))
+
+    def get_assignment_fidelities(self):
+        return self._assignment_fidelities
+
+    def classify(self, shots):
+        """
+        Returns a bool array, True for the shots assigned to the excited state
+        """
+        return self._project(asarray(shots)) > self._threshold
+
+    def get_excited_population(self, shots, correct_assignment_errors=True):
+        """
+        Fraction of the shots in the excited state and its standard error
+
+        Parameters
+        ----------
+        shots: complex array
+        correct_assignment_errors: bool
+            if True, the fraction is corrected for the assignment errors
+            found in the calibration
+
+        Returns
+        -------
+        population: float
+        error: float
+        """
+        shots = asarray(shots).ravel()
+        n_shots = len(shots)
+        fraction = count_nonzero(self.classify(shots)) / n_shots
+        error = sqrt(fraction * (1 - fraction) / n_shots)
+        if correct_assignment_errors:
+            ground_fidelity, excited_fidelity = self._assignment_fidelities
+            contrast = ground_fidelity + excited_fidelity - 1
+            if contrast > 0:
+                fraction = (fraction - (1 - ground_fidelity)) / contrast
+                error = error / contrast
+        return fraction, error
+
+    def _project(self, shots):
+        # position along the line from the ground to the excited center, the
+        # ground center is at 0 and the excited one at 1
+        axis = self._excited_center - self._ground_center
+        return real((shots - self._ground_center) * conj(axis)) / abs(axis) ** 2
+
+    @staticmethod
+    def _equal_density_point(mean_g, sigma_g, mean_e, sigma_e):
+        if isclose(sigma_g, sigma_e) or sigma_g == 0 or sigma_e == 0:
+            return (mean_g + mean_e) / 2
+        # roots of the equality of the two Gaussian log-densities; the one
+        # between the centers is taken
+        a = 1 / sigma_g ** 2 - 1 / sigma_e ** 2
+        b = -2 * (mean_g / sigma_g ** 2 - mean_e / sigma_e ** 2)
+        c = mean_g ** 2 / sigma_g ** 2 - mean_e ** 2 / sigma_e ** 2 + \
+            2 * log(sigma_g / sigma_e)
+        candidates = roots([a, b, c])
+        candidates = real(candidates[isreal(candidates)])
+        between = candidates[(candidates >= minimum(mean_g, mean_e)) &
+                             (candidates <= maximum(mean_g, mean_e))]
+        return between[0] if len(between) > 0 else (mean_g + mean_e) / 2
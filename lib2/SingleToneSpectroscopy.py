@@ -9,6 +9,7 @@ from datetime import datetime as dt
 from matplotlib import pyplot as plt, colorbar
 from resonator_tools import circuit
 from lib2.Measurement import *
+from lib2.AdaptiveWindow import find_line
 from time import sleep
 
 
@@ -34,21 +35,40 @@ class SingleToneSpectroscopy(Measurement):
             --  remove_delay(self)
             --  _remove_delay(self,frequencies, s_data)
     ----------------
+
+    For several resonators at once the VNA parameters may contain
+    "segments": [(start, stop, nop), ...] instead of "freq_limits" and "nop";
+    then one segmented sweep is made for each parameter value
     """
 
     def __init__(self, name, sample_name, plot_update_interval=5, **devs_aliases_map):
         super().__init__(name, sample_name, devs_aliases_map, plot_update_interval)
         self._measurement_result = SingleToneSpectroscopyResult(name, sample_name)
         self._frequencies = []
+        self._frequency_window = None
+        self._vna_parameters = None
 
-    def set_fixed_parameters(self, **dev_params):
+    def set_fixed_parameters(self, frequency_window=None, **dev_params):
         """
         SingleToneSpectroscopy only requires vna parameters in format
         {"bandwidth":int, ...}
+
+        If frequency_window (lib2.AdaptiveWindow.AdaptiveWindow) is given,
+        for each parameter value the VNA sweeps only the part of the
+        frequency grid within the window around the predicted resonator
         """
+        self._frequency_window = frequency_window
         super().set_fixed_parameters(**dev_params)
-        self._frequencies = linspace(*dev_params['vna'][0]["freq_limits"],
-                                     dev_params['vna'][0]["nop"])
+        vna_parameters = dev_params['vna'][0]
+        # the sweep is restored after the scan in the frequency window
+        self._vna_parameters = vna_parameters
+        if vna_parameters.get("segments") is not None:
+            # segmented sweep over several windows, e.g. around all the
+            # resonators at once; see SingleToneSpectroscopyResult.split
+            self._frequencies = segments_frequencies(vna_parameters["segments"])
+        else:
+            self._frequencies = linspace(*vna_parameters["freq_limits"],
+                                         vna_parameters["nop"])
         self._vna[0].sweep_hold()
 
     def set_swept_parameters(self, swept_parameter):
@@ -62,14 +82,95 @@ class SingleToneSpectroscopy(Measurement):
         par_setter(par_values[0])
         sleep(1)
 
+    def _record_data(self):
+        try:
+            super()._record_data()
+        finally:
+            if self._frequency_window is not None:
+                self._restore_vna_sweep()
+
+    def _restore_vna_sweep(self):
+        """
+        Sets back the sweep of the fixed parameters, which is narrowed to the
+        frequency window for each of the parameter values
+        """
+        vna = self._vna[0]
+        with SessionManager.getInstance().transaction(vna):
+            if self._vna_parameters.get("segments") is not None:
+                vna.set_segments(self._vna_parameters["segments"])
+            else:
+                vna.set_nop(self._vna_parameters["nop"])
+                vna.set_freq_limits(*self._vna_parameters["freq_limits"])
+
     def _recording_iteration(self):
+        if self._frequency_window is not None:
+            return self._recording_iteration_in_window()
         vna = self._vna[0]
-        vna.avg_clear()
-        vna.prepare_for_stb()
-        vna.sweep_single()
+        with SessionManager.getInstance().transaction(vna):
+            vna.avg_clear()
+            vna.prepare_for_stb()
+            vna.sweep_single()
+
+            vna.wait_for_stb()
+            return vna.get_sdata()
+
+    def _recording_iteration_in_window(self):
+        parameter_value = self._last_swept_pars_values[self._swept_pars_names[0]]
+        low, high = self._frequency_window.get_window(parameter_value)
+        data = zeros(len(self._frequencies), dtype=complex)
+        in_window, segments = self._get_window_segments(low, high)
+        if len(in_window) < 2:
+            return data
 
-        vna.wait_for_stb()
-        return vna.get_sdata()
+        vna = self._vna[0]
+        with SessionManager.getInstance().transaction(vna):
+            if self._vna_parameters.get("segments") is not None:
+                vna.set_segments(segments)
+            else:
+                start, stop, nop = segments[0]
+                vna.set_nop(nop)
+                vna.set_freq_limits(start, stop)
+            vna.avg_clear()
+            vna.prepare_for_stb()
+            vna.sweep_single()
+
+            vna.wait_for_stb()
+            # the points of the segments follow each other in the trace
+            data[in_window] = vna.get_sdata()
+
+        res_freq = find_line(self._frequencies[in_window], data[in_window], dip=True)
+        if res_freq is not None:
+            self._frequency_window.add_line_point(parameter_value, res_freq)
+        return data
+
+    def _get_window_segments(self, low, high):
+        """
+        Intersects the frequency grid, linear or segmented, with the window
+
+        Returns
+        -------
+        in_window: array
+            indices of the frequencies within the window
+        segments: list
+            [(start, stop, nop), ...] of the grid points within the window
+            for each of the segments that intersect it
+        """
+        grid_segments = self._vna_parameters.get("segments")
+        if grid_segments is None:
+            grid_segments = [(self._frequencies[0], self._frequencies[-1],
+                              len(self._frequencies))]
+        in_window, segments = [], []
+        offset = 0
+        for nop in [int(segment[2]) for segment in grid_segments]:
+            frequencies = self._frequencies[offset:offset + nop]
+            indices = offset + nonzero((frequencies >= low) & (frequencies <= high))[0]
+            if len(indices) > 0:
+                in_window.append(indices)
+                segments.append((self._frequencies[indices[0]],
+                                 self._frequencies[indices[-1]], len(indices)))
+            offset += nop
+        in_window = concatenate(in_window) if len(in_window) > 0 else array([], dtype=int)
+        return in_window, segments
 
     def _prepare_measurement_result_data(self, parameter_names, parameters_values):
         measurement_data = super()._prepare_measurement_result_data(parameter_names, parameters_values)
@@ -77,6 +178,35 @@ class SingleToneSpectroscopy(Measurement):
         return measurement_data
 
 
+def segments_frequencies(segments):
+    """
+    Frequencies of a segmented sweep [(start, stop, nop), ...]
+    """
+    return concatenate([linspace(start, stop, nop) for start, stop, nop in segments])
+
+
+def merge_windows(windows, nop):
+    """
+    Turns frequency windows [(start, stop), ...] into segments for a
+    segmented sweep: the windows are sorted and the overlapping ones are
+    merged, the frequency step of nop points per window is kept
+
+    Returns
+    -------
+    segments: list of (start, stop, nop)
+    """
+    merged = []
+    for start, stop in sorted(windows):
+        step = (stop - start) / (nop - 1)
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1][1] = maximum(merged[-1][1], stop)
+            merged[-1][2] = minimum(merged[-1][2], step)
+        else:
+            merged.append([start, stop, step])
+    return [(start, stop, int(round((stop - start) / step)) + 1)
+            for start, stop, step in merged]
+
+
 class SingleToneSpectroscopyResult(MeasurementResult):
 
     def __init__(self, name, sample_name):
@@ -204,6 +334,44 @@ class SingleToneSpectroscopyResult(MeasurementResult):
         # s_data = self.remove_background('avg_cur')
         return parameter_list, data["Frequency [Hz]"] / 1e9, s_data
 
+    def split(self, windows, names=None):
+        """
+        Splits the result of a segmented sweep into separate results for each
+        of the frequency windows
+
+        Parameters
+        ----------
+        windows: list of (start, stop)
+            frequency windows, e.g. the ones around each of the resonators
+        names: list of str
+            names of the new results, by default the name of this one with
+            the index of the window
+
+        Returns
+        -------
+        results: list of SingleToneSpectroscopyResult
+        """
+        if names is None:
+            names = ["%s-%d" % (self._name, idx) for idx in range(len(windows))]
+        data = self.get_data()
+        frequencies = data["Frequency [Hz]"]
+        results = []
+        for (start, stop), name in zip(windows, names):
+            mask = (frequencies >= start) & (frequencies <= stop)
+            window_data = dict(data)
+            window_data["Frequency [Hz]"] = frequencies[mask]
+            if "data" in data.keys():
+                window_data["data"] = data["data"][..., mask]
+            result = SingleToneSpectroscopyResult(name, self._sample_name)
+            result.set_parameter_names(self._parameter_names)
+            result._context = self._context
+            result.set_start_datetime(self.get_start_datetime())
+            result.set_recording_time(self.get_recording_time())
+            result.set_is_finished(self.is_finished())
+            result.set_data(window_data)
+            results.append(result)
+        return results
+
     def remove_delay(self):
         copy = self.copy()
         s_data, frequencies = copy.get_data()["data"], copy.get_data()["frequencies"]
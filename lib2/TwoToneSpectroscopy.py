@@ -6,6 +6,7 @@ passed to the SingleToneSpectroscopy class when it is created.
 
 from numpy import *
 from lib2.TwoToneSpectroscopyBase import *
+from lib2.AdaptiveWindow import find_line
 from time import sleep
 
 
@@ -17,11 +18,20 @@ class FluxTwoToneSpectroscopy(TwoToneSpectroscopyBase):
         self._adaptive = False
         self._last_resonator_result = None
         self._resonator_fits = []
+        self._frequency_window = None
+        self._window_row_idx = None
 
     def set_fixed_parameters(self, sweet_spot_current=None, sweet_spot_voltage=None, adaptive=False,
-                             **dev_params):
+                             frequency_window=None, **dev_params):
+        """
+        If frequency_window (lib2.AdaptiveWindow.AdaptiveWindow) is given,
+        only the excitation frequencies within the window around the
+        predicted qubit line are measured for each current or voltage
+        """
         self._resonator_area = dev_params['vna'][0]["freq_limits"]
         self._adaptive = adaptive
+        self._frequency_window = frequency_window
+        self._window_row_idx = None
         super().set_fixed_parameters(current=sweet_spot_current, voltage=sweet_spot_voltage,
                                      detect_resonator=not adaptive,
                                      **dev_params)
@@ -33,13 +43,51 @@ class FluxTwoToneSpectroscopy(TwoToneSpectroscopyBase):
         base_parameter_setter = \
             self._adaptive_setter if self._adaptive else self._base_parameter_setter
 
+        base_parameter_devices = \
+            self._current_src if voltage_values is None else self._voltage_src
+        if self._adaptive:
+            base_parameter_devices = base_parameter_devices + self._vna + self._mw_src
+
         swept_pars = \
             {self._base_parameter_name:
-             (base_parameter_setter, base_parameter_values),
+             (base_parameter_setter, base_parameter_values, base_parameter_devices),
              "Frequency [Hz]":
-                 (self._mw_src[0].set_frequency, mw_src_frequencies)}
+                 (self._mw_src[0].set_frequency, mw_src_frequencies, self._mw_src)}
         super().set_swept_parameters(**swept_pars)
 
+    def _record_data(self):
+        # the rows of a previous launch must not refine the window
+        self._window_row_idx = None
+        self._raw_data = None
+        super()._record_data()
+
+    def _is_point_in_scan_area(self, idx_group, values_group):
+        if self._frequency_window is None:
+            return True
+        if idx_group[0] != self._window_row_idx:
+            if self._window_row_idx is not None:
+                self._add_line_point(self._window_row_idx)
+            self._window_row_idx = idx_group[0]
+        return self._frequency_window.contains(*values_group)
+
+    def _is_point_expected_in_scan_area(self, idx_group, values_group):
+        # the window may still be refined when the current row is finished
+        return self._frequency_window is None or \
+            self._frequency_window.contains(*values_group)
+
+    def _add_line_point(self, row_idx):
+        # the qubit line found in a finished row refines the prediction
+        if getattr(self, "_raw_data", None) is None:
+            return
+        base_parameter_values, mw_src_frequencies = \
+            [self._swept_pars[name][1] for name in self._swept_pars_names]
+        row = self._raw_data[row_idx]
+        measured = row != 0
+        line_frequency = find_line(asarray(mw_src_frequencies)[measured], row[measured])
+        if line_frequency is not None:
+            self._frequency_window.add_line_point(base_parameter_values[row_idx],
+                                                  line_frequency)
+
     def _adaptive_setter(self, value):
         self._base_parameter_setter(value)
 
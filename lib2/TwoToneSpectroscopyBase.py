@@ -9,6 +9,7 @@ from lib2.SingleToneSpectroscopy import *
 from datetime import datetime as dt
 from lib2.Measurement import *
 from scipy.optimize import curve_fit
+from lib2.BatchFitter import BatchFitter, lorentzian_initial_guess
 
 
 class TwoToneSpectroscopyBase(Measurement):
@@ -105,16 +106,14 @@ class TwoToneSpectroscopyResult(SingleToneSpectroscopyResult):
         return amplitude * (0.5 * width) ** 2 / ((frequency - res_frequency) ** 2 + (0.5 * width) ** 2) + offset
 
     def _find_peaks(self, freqs, data):
-        peaks = []
-        for row in data:
-            try:
-                popt = curve_fit(self._lorentzian_peak,
-                                 freqs, row, p0=(ptp(row), median(row),
-                                                 freqs[argmax(row)], 10e6))[0]
-                peaks.append(popt[2])
-            except:
-                peaks.append(freqs[argmax(row)])
-        return array(peaks)
+        data = asarray(data)
+        fitter = BatchFitter(self._lorentzian_peak)
+        popt, perr, success = \
+            fitter.fit(freqs, data, lorentzian_initial_guess(freqs, data))
+        peaks = popt[:, 2]
+        failed = ~success | (peaks < freqs.min()) | (peaks > freqs.max())
+        peaks[failed] = freqs[argmax(data[failed], axis=1)]
+        return peaks
 
     def find_transmon_spectrum(self, axes, parameter_limits=(0, -1),
                                format="abs"):
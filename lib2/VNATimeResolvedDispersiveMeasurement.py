@@ -1,7 +1,11 @@
 from lib2.Measurement import *
 from lib2.MeasurementResult import *
 from lib2.IQPulseSequence import *
+from lib2.PulseSequenceTemplate import PulseSequenceTemplate
+from lib2.DigitizerReadout import DigitizerReadout
+from lib2.SingleShotReadout import IQHistogram
 
+from contextlib import ExitStack
 from scipy.optimize import curve_fit
 
 
@@ -27,8 +31,14 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
         super().__init__(name, sample_name, devs_aliases_map,
                          plot_update_interval=plot_update_interval)
         self._sequence_generator = None
+        self._sequence_template = None
+        self._preload_template = None
         self._basis = None
         self._ult_calib = False
+        self._readout = None
+        self._discriminator = None
+        self._iq_histogram = None
+        self._population_errors = None
         self._pulse_sequence_parameters = \
             {"modulating_window": "rectangular", "excitation_amplitude": 1,
              "z_smoothing_coefficient": 0}
@@ -42,13 +52,33 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
                 'vna': 0
                 'q_awg': 0
                 'ro_awg': 0
+            If 'dso' is present, e.g. [{"channels": [Channel.ONE, Channel.TWO],
+            "if_frequency": 0, "integration_window": (start, stop)}], the
+            readout is made with the digitizer instead of the VNA, see
+            lib2.DigitizerReadout
         """
         # TODO check carefully. All single device functions should be deleted?
         self._pulse_sequence_parameters.update(pulse_sequence_parameters)
+        # the calibrations of the AWGs may change
+        self._sequence_template = None
         self._measurement_result.get_context() \
             .get_pulse_sequence_parameters() \
             .update(pulse_sequence_parameters)
 
+        dso_parameters = dev_params.pop('dso', [None])[0]
+        if dso_parameters is not None:
+            # the digitizer has no parameters to be loaded like the other
+            # devices, they only define the demodulation
+            self._readout = DigitizerReadout(self._dso[0], **dso_parameters)
+            self._measurement_result.get_context() \
+                .get_equipment()["dso"] = dso_parameters
+        else:
+            self._readout = None
+
+        if 'vna' not in dev_params.keys():
+            super().set_fixed_parameters(**dev_params)
+            return
+
         dev_params['vna'][0]["trigger_type"] = "single"
         freq_limits = dev_params['vna'][0]["freq_limits"]
 
@@ -82,28 +112,78 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
 
         self._basis = basis
 
+    def set_discriminator(self, discriminator, histogram_bins=100):
+        """
+        Switches the digitizer readout to the single-shot mode: for each point
+        the shots are classified with the calibrated discriminator
+        (lib2.SingleShotReadout.StateDiscriminator) and the excited state
+        population is recorded instead of the averaged transmission. The
+        standard errors of the populations and the histogram of all the
+        shots are added to the data.
+
+        Requires the 'dso' readout with more than one shot per point.
+        """
+        if self._readout is None or self._readout.get_shots_number() < 2:
+            raise ValueError("Single-shot readout requires the digitizer with shots > 1")
+        self._discriminator = discriminator
+        self._iq_histogram = IQHistogram(histogram_bins, discriminator.get_iq_range())
+        self._population_errors = None
+
+    def get_iq_histogram(self):
+        return self._iq_histogram
+
     def set_ult_calib(self, value=False):
         self._ult_calib = value
 
+    def _record_data(self):
+        # the AWGs may have been loaded by other measurements since the
+        # previous run, so all the channels are uploaded again
+        self._sequence_template = None
+        self._preload_template = None
+        self._preloading = any(dev.supports_preloading() for dev in self._get_awgs()
+                               if hasattr(dev, "supports_preloading"))
+        super()._record_data()
+
+    def _preload_point(self, values_group):
+        """
+        Loads the pulse sequences of the next point into the idle buffers of
+        the AWGs that have them if the swept parameters are pulse sequence
+        parameters, e.g. the delays in the 1D measurements
+        """
+        parameters = dict(self._pulse_sequence_parameters)
+        swept = [name for name in self._swept_pars_names if name in parameters]
+        if len(swept) == 0:
+            return
+        for name, value in zip(self._swept_pars_names, values_group):
+            if name in swept:
+                parameters[name] = value
+
+        template = self._preload_template
+        if template is None or \
+                template.get_sequence_generator() is not self._sequence_generator:
+            # a separate template, so that the one of the output is not
+            # patched for the next point in advance
+            template = self._make_sequence_template()
+            self._preload_template = template
+        seqs, changed = template.update(parameters)
+        for (key, devs) in (('q_seqs', self._q_awg), ('ro_seqs', self._ro_awg),
+                            ('q_z_seqs', getattr(self, '_q_z_awg', []))):
+            for (seq, dev) in zip(seqs.get(key, []), devs):
+                if hasattr(dev, "supports_preloading") and dev.supports_preloading():
+                    dev.preload_pulse_sequence(seq)
+
     def _recording_iteration(self):
-        vna = self._vna[0]
+        if self._discriminator is not None:
+            return self._record_excited_population()
         q_lo = self._q_lo[0]
-        vna.avg_clear()
-        vna.prepare_for_stb()
-        vna.sweep_single()
-        vna.wait_for_stb()
-        data = vna.get_sdata()
+        data = self._measure_readout()
         if self._ult_calib:
             q_lo.set_output_state("OFF")
-            vna.avg_clear()
-            vna.prepare_for_stb()
-            vna.sweep_single()
-            vna.wait_for_stb()
-            bg = vna.get_sdata()
+            bg = self._measure_readout()
             q_lo.set_output_state("ON")
-            mean_data = mean(data) / mean(bg)
+            mean_data = data / bg
         else:
-            mean_data = mean(data)
+            mean_data = data
         if self._basis is None:
             return mean_data
         basis = self._basis
@@ -111,6 +191,39 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
         p_i = (imag(mean_data) - imag(basis[0])) / (imag(basis[1]) - imag(basis[0]))
         return p_r + 1j * p_i
 
+    def _record_excited_population(self):
+        shots = self._readout.measure_shots()
+        self._iq_histogram.add(shots)
+        population, error = self._discriminator.get_excited_population(shots)
+
+        shape = tuple(len(self._swept_pars[name][1]) for name in self._swept_pars_names)
+        if self._population_errors is None or self._population_errors.shape != shape:
+            self._population_errors = zeros(shape)
+        self._population_errors[self._current_idx_group] = error
+        return complex(population)
+
+    def _prepare_measurement_result_data(self, parameter_names, parameters_values):
+        measurement_data = super()._prepare_measurement_result_data(parameter_names,
+                                                                    parameters_values)
+        if self._discriminator is not None:
+            measurement_data["population_errors"] = self._population_errors
+            measurement_data["iq_histogram"] = self._iq_histogram.get_counts()
+        return measurement_data
+
+    def _measure_readout(self):
+        """
+        Returns the complex transmission measured with the VNA or, if the
+        digitizer readout is set up, the demodulated amplitude
+        """
+        if self._readout is not None:
+            return self._readout.measure()
+        vna = self._vna[0]
+        vna.avg_clear()
+        vna.prepare_for_stb()
+        vna.sweep_single()
+        vna.wait_for_stb()
+        return mean(vna.get_sdata())
+
     def _detect_resonator(self, vna_parameters, ro_calibration, q_calibration,
                           q_z_calibration=None, plot_resonator_fit=True):
 
@@ -144,7 +257,40 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
         return res_freq
 
     def _output_pulse_sequence(self):
-
+        """
+        Outputs the pulse sequences for the current pulse sequence parameters.
+        The sequences are patched in the cached template (see
+        lib2.PulseSequenceTemplate), and only the channels that have changed
+        since the previous call are uploaded.
+        """
+        template = self._sequence_template
+        if template is None or \
+                template.get_sequence_generator() is not self._sequence_generator:
+            template = self._make_sequence_template()
+            self._sequence_template = template
+        seqs, changed = template.update(self._pulse_sequence_parameters)
+
+        with ExitStack() as stack:
+            # the AWGs that can stage waveforms (e.g. Tektronix_AWG5014) load
+            # all of their channels at once with a single run
+            for awg in self._get_staging_awgs():
+                stack.enter_context(awg.staged_output())
+
+            for (seq, dev, is_changed) in zip(seqs['q_seqs'], self._q_awg,
+                                              changed['q_seqs']):
+                if is_changed:
+                    dev.output_pulse_sequence(seq)
+            for (seq, dev, is_changed) in zip(seqs['ro_seqs'], self._ro_awg,
+                                              changed['ro_seqs']):
+                if is_changed:
+                    dev.output_pulse_sequence(seq, asynchronous=True)
+            if 'q_z_seqs' in seqs.keys():
+                for (seq, dev, is_changed) in zip(seqs['q_z_seqs'], self._q_z_awg,
+                                                  changed['q_z_seqs']):
+                    if is_changed:
+                        dev.output_pulse_sequence(seq, asynchronous=True)
+
+    def _make_sequence_template(self):
         q_pbs = [q_awg.get_pulse_builder() for q_awg in self._q_awg]
         ro_pbs = [ro_awg.get_pulse_builder() for ro_awg in self._ro_awg]
         q_z_pbs = [q_z_awg.get_pulse_builder() for q_z_awg in self._q_z_awg] \
@@ -152,15 +298,19 @@ class VNATimeResolvedDispersiveMeasurement(Measurement):
         pbs = {'q_pbs': q_pbs,
                'ro_pbs': ro_pbs,
                'q_z_pbs': q_z_pbs}
-        seqs = self._sequence_generator(self._pulse_sequence_parameters, **pbs)
-
-        for (seq, dev) in zip(seqs['q_seqs'], self._q_awg):
-            dev.output_pulse_sequence(seq)
-        for (seq, dev) in zip(seqs['ro_seqs'], self._ro_awg):
-            dev.output_pulse_sequence(seq, asynchronous=True)
-        if 'q_z_seqs' in seqs.keys():
-            for (seq, dev) in zip(seqs['q_z_seqs'], self._q_z_awg):
-                dev.output_pulse_sequence(seq, asynchronous=True)
+        return PulseSequenceTemplate(self._sequence_generator, **pbs)
+
+    def _get_awgs(self):
+        return self._q_awg + self._ro_awg + getattr(self, '_q_z_awg', [])
+
+    def _get_staging_awgs(self):
+        awgs = []
+        for dev in self._get_awgs():
+            for awg in (dev.get_host_awgs() if hasattr(dev, "get_host_awgs") else []):
+                if hasattr(awg, "staged_output") and \
+                        not any(awg is other for other in awgs):
+                    awgs.append(awg)
+        return awgs
 
 
 class VNATimeResolvedDispersiveMeasurementResult(MeasurementResult):
@@ -3,7 +3,8 @@ from lib2.VNATimeResolvedDispersiveMeasurement import *
 from lib2.IQPulseSequence import *
 
 from numpy.linalg import inv
-from scipy.optimize import least_squares, curve_fit
+from scipy.optimize import least_squares
+from threading import Thread, Condition, Lock
 
 
 class VNATimeResolvedDispersiveMeasurement1D(VNATimeResolvedDispersiveMeasurement):
@@ -21,8 +22,9 @@ class VNATimeResolvedDispersiveMeasurement1D(VNATimeResolvedDispersiveMeasuremen
                 'q_awg': 0
                 'ro_awg'
         """
-        dev_params['vna'][0]["power"] = dev_params['ro_awg'][0]["calibration"] \
-            .get_radiation_parameters()["lo_power"]
+        if 'vna' in dev_params.keys():
+            dev_params['vna'][0]["power"] = dev_params['ro_awg'][0]["calibration"] \
+                .get_radiation_parameters()["lo_power"]
 
         super().set_fixed_parameters(pulse_sequence_parameters,
                                      **dev_params)
@@ -36,6 +38,54 @@ class VNATimeResolvedDispersiveMeasurement1D(VNATimeResolvedDispersiveMeasuremen
         super()._output_pulse_sequence()
 
 
+class FitWorker:
+    """
+    Fits the data of a VNATimeResolvedDispersiveMeasurement1DResult in a
+    background thread, so that the dynamic plotting and the recording are not
+    slowed down by the fits.
+
+    The data is submitted on every plot update, but a refit is performed only
+    if at least min_new_points were recorded since the previous one. The
+    result publishes new parameters and errors atomically.
+    """
+
+    def __init__(self, result, min_new_points=5):
+        self._result = result
+        self._min_new_points = min_new_points
+        self._condition = Condition()
+        self._pending = None
+        self._fitted_points = 0
+        self._stopped = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, X, data):
+        with self._condition:
+            if len(data) - self._fitted_points < self._min_new_points:
+                return
+            self._pending = (X, data)
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                X, data = self._pending
+                self._pending = None
+                self._fitted_points = len(data)
+            self._result._fit_data(X, data)
+
+
 class VNATimeResolvedDispersiveMeasurement1DResult( \
         VNATimeResolvedDispersiveMeasurementResult):
 
@@ -50,58 +100,108 @@ class VNATimeResolvedDispersiveMeasurement1DResult( \
         self._lines = [None] * 2
         self._fit_lines = [None] * 2
         self._anno = [None] * 2
+        self._fit_lock = Lock()
+        self._fit_worker = None
+        self._cold_fit_points = 0
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        del d['_fit_lock']
+        d['_fit_worker'] = None
+        return d
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._fit_lock = Lock()
+        self._fit_worker = None
+        self.__dict__.setdefault('_cold_fit_points', 0)
 
     def _cost_function(self, params, x, data):
         return abs(self._model(x, *params) - data)
 
     def _fit_complex_curve(self, X, data):
         p0, bounds = self._generate_fit_arguments(X, data)
-        try:
-            p0, err = curve_fit(lambda x, *params: real(self._model(x, *params)) + imag(self._model(x, *params)),
-                                X, real(data) + imag(data),
-                                p0=p0,
-                                bounds=bounds)
-        finally:
+
+        # Warm start from the previous parameters is tried first; a full fit
+        # is only repeated when the number of points has doubled since the
+        # last full fit or if the warm start has failed
+        if self._fit_params is not None and len(data) < 2 * self._cold_fit_points:
             try:
-                result = least_squares(self._cost_function, p0, args=(X, data),
-                                       bounds=bounds, x_scale="jac", max_nfev=10000, ftol=1e-5)
-
-                # print(result.x)
-                sigma = std(abs(self._model(X, *result.x) - data))
-
-                if self._fit_params is not None:
-                    result_2 = least_squares(self._cost_function, self._fit_params,
-                                             args=(X, data), bounds=bounds, x_scale="jac",
-                                             max_nfev=1000, ftol=1e-5)
-                    sigma_2 = std(abs(self._model(X, *result_2.x) - data))
-                    if sigma_2 < sigma:
-                        result = result_2
-                        sigma = sigma_2
-
-                return result, sqrt(diag(sigma ** 2 * inv(result.jac.T.dot(result.jac))))
-            except Exception as e:
-                print("Fit failed unexpectedly:", e)
-                print(p0, bounds)
-                raise e
+                result = least_squares(self._cost_function,
+                                       clip(self._fit_params, *bounds),
+                                       args=(X, data), bounds=bounds,
+                                       x_scale="jac", max_nfev=1000, ftol=1e-5)
+                if result.success:
+                    return result, self._estimate_fit_errors(result, X, data)
+            except ValueError:
+                pass
 
-    def fit(self, verbose=True):
+        # The initial guesses are deterministic estimates close to the
+        # optimum, so least squares is started from them directly
+        self._cold_fit_points = len(data)
+        try:
+            result = least_squares(self._cost_function, clip(p0, *bounds),
+                                   args=(X, data), bounds=bounds,
+                                   x_scale="jac", max_nfev=10000, ftol=1e-5)
+            sigma = std(abs(self._model(X, *result.x) - data))
+
+            if self._fit_params is not None:
+                result_2 = least_squares(self._cost_function,
+                                         clip(self._fit_params, *bounds),
+                                         args=(X, data), bounds=bounds, x_scale="jac",
+                                         max_nfev=1000, ftol=1e-5)
+                sigma_2 = std(abs(self._model(X, *result_2.x) - data))
+                if sigma_2 < sigma:
+                    result = result_2
 
+            return result, self._estimate_fit_errors(result, X, data)
+        except Exception as e:
+            print("Fit failed unexpectedly:", e)
+            print(p0, bounds)
+            raise e
+
+    def _estimate_fit_errors(self, result, X, data):
+        sigma = std(abs(self._model(X, *result.x) - data))
+        return sqrt(diag(sigma ** 2 * inv(result.jac.T.dot(result.jac))))
+
+    def fit(self, verbose=True):
         meas_data = self.get_data()
-        data = meas_data["data"][meas_data["data"] != 0]
-        if len(data) < 5:
+        if "data" not in meas_data.keys():
             return
+        X, data = self._prepare_data_for_fit(meas_data)
+        self._fit_data(X, data)
 
-        X = self._prepare_data_for_plot(meas_data)[0]
-        X = X[:len(data)]
+    def _prepare_data_for_fit(self, data):
+        X, Y = self._prepare_data_for_plot(data)
+        Y = data["data"][data["data"] != 0]
+        return X[:len(Y)], Y
 
+    def _fit_data(self, X, data):
+        if len(data) < 5:
+            return
         try:
             result, err = self._fit_complex_curve(X, data)
             if result.success:
-                self._fit_params = result.x
-                self._fit_errors = err
+                with self._fit_lock:
+                    self._fit_params = result.x
+                    self._fit_errors = err
         except Exception as e:
             print("Fit failed unexpectedly:", e)
 
+    def get_fit(self):
+        """
+        Returns the last published fit parameters and their errors
+        """
+        with self._fit_lock:
+            return self._fit_params, self._fit_errors
+
+    def finalize(self):
+        super().finalize()
+        if self._fit_worker is not None:
+            self._fit_worker.stop()
+            self._fit_worker = None
+        self.fit()
+
     def _prepare_figure(self):
         fig, axes = plt.subplots(2, 1, figsize=(15, 7), sharex=True)
         fig.canvas.set_window_title(self._name)
@@ -144,7 +244,14 @@ class VNATimeResolvedDispersiveMeasurement1DResult( \
         # axes["phase"].set_xlabel(xlabel)
         axes["imag"].set_xlabel(xlabel)
         plt.tight_layout(pad=2)
-        self._plot_fit(axes)
+
+        if getattr(self, "_dynamic", False):
+            if self._fit_worker is None:
+                self._fit_worker = FitWorker(self)
+            self._fit_worker.submit(*self._prepare_data_for_fit(data))
+        else:
+            self.fit(verbose=False)
+        self._plot_fit(axes, X)
 
     def _generate_annotation_string(self, opt_params, err):
         """
@@ -166,16 +273,13 @@ class VNATimeResolvedDispersiveMeasurement1DResult( \
             self._anno[idx].set_x(h_pos)
             self._anno[idx].set_y(v_pos)
 
-    def _plot_fit(self, axes):
-        self.fit(verbose=False)
-        if self._fit_params is None:
+    def _plot_fit(self, axes, X):
+        opt_params, err = self.get_fit()
+        if opt_params is None:
             return
 
         for idx, name in enumerate(self._data_formats_used):
             ax = axes[name]
-            opt_params = self._fit_params
-            err = self._fit_errors
-            X = self._prepare_data_for_plot(self.get_data())[0]
             Y = self._data_formats[name][0](self._model(X, *opt_params))
             if self._fit_lines[idx] is None or not self._dynamic:
                 self._fit_lines[idx], = ax.plot(X, Y, "C%d" % idx)
@@ -1,5 +1,6 @@
 from matplotlib import pyplot as plt, colorbar
 from lib2.VNATimeResolvedDispersiveMeasurement import *
+from lib2.BatchFitter import BatchFitter, oscillation_initial_guess
 
 
 class VNATimeResolvedDispersiveMeasurement2D(VNATimeResolvedDispersiveMeasurement):
@@ -10,8 +11,9 @@ class VNATimeResolvedDispersiveMeasurement2D(VNATimeResolvedDispersiveMeasuremen
 
     def set_fixed_parameters(self, pulse_sequence_parameters,
                              detect_resonator=True, **dev_params):
-        dev_params['vna'][0]["power"] = dev_params['ro_awg'][0]["calibration"] \
-            .get_radiation_parameters()["lo_power"]
+        if 'vna' in dev_params.keys():
+            dev_params['vna'][0]["power"] = dev_params['ro_awg'][0]["calibration"] \
+                .get_radiation_parameters()["lo_power"]
 
         dev_params['q_lo'][0]["power"] = dev_params['q_awg'][0]["calibration"] \
             .get_radiation_parameters()["lo_power"]
@@ -23,6 +25,10 @@ class VNATimeResolvedDispersiveMeasurement2D(VNATimeResolvedDispersiveMeasuremen
 
 class VNATimeResolvedDispersiveMeasurement2DResult(VNATimeResolvedDispersiveMeasurementResult):
 
+    # index of the axis of the map returned by _prepare_data_for_plot along
+    # which the time is swept: 0 for the vertical axis, 1 for the horizontal
+    _time_axis = 0
+
     def _prepare_figure(self):
         fig, axes, caxes = super()._prepare_figure()
         plt.tight_layout(pad=2, h_pad=5, w_pad=0)
@@ -43,6 +49,45 @@ class VNATimeResolvedDispersiveMeasurement2DResult(VNATimeResolvedDispersiveMeas
         """
         pass
 
+    def _trace_model(self, t, A_r, A_i, T, Omega, phase, offset_r, offset_i):
+        return (A_r + 1j * A_i) * exp(-t / T) * cos(Omega * t + phase) + \
+               offset_r + 1j * offset_i
+
+    def fit_time_traces(self):
+        """
+        Fits damped oscillations to all the traces of the map along the time
+        axis at once. Time is in the units of the plot axes.
+
+        Returns
+        -------
+        other_values: array
+            values of the other swept parameter, one per trace
+        params, errors: arrays of shape (n_traces, 7)
+            (A_r, A_i, T, Omega, phase, offset_r, offset_i) and their errors
+            for each trace, nan for the traces that are not complete yet or
+            could not be fitted
+        """
+        X, Y, Z = self._prepare_data_for_plot(self.get_data())
+        if self._time_axis == 0:
+            t, other_values, traces = Y, X, Z.T
+        else:
+            t, other_values, traces = X, Y, Z
+
+        params = full((len(traces), 7), nan)
+        errors = full((len(traces), 7), nan)
+        complete = all(traces != 0, axis=1)
+        if any(complete):
+            fitter = BatchFitter(self._trace_model)
+            lower_bounds = array([-inf, -inf, abs(t[1] - t[0]), 0, -inf, -inf, -inf])
+            popt, perr, success = \
+                fitter.fit(t, traces[complete],
+                           oscillation_initial_guess(t, traces[complete]),
+                           bounds=(lower_bounds, inf))
+            indices = nonzero(complete)[0][success]
+            params[indices] = popt[success]
+            errors[indices] = perr[success]
+        return other_values, params, errors
+
     def _plot(self, data):
 
         axes = self._axes
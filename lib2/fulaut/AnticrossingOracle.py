@@ -1,9 +1,16 @@
+"""
+Fits the resonator line of the single-tone flux scans with the anticrossing
+of the resonator and the qubit.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from matplotlib import pyplot as plt
-from IPython.display import clear_output
 from lib2.fulaut.qubit_spectra import *
 from lib2.ResonatorDetector import *
 from lib2.LoggingServer import *
+from lib2.AdaptiveWindow import fill_unmeasured
 
 import scipy
 from scipy import *
@@ -29,14 +36,28 @@ class AnticrossingOracle():
         self._minimum_points_around_zero = 5
         self._distance_from_intersection = 2
         self._logger = LoggingServer.getInstance()
-        self._fast = True
         self._fast_res_detect = fast_res_detect
         self._noisy_data = False
         self._hints = hints
-        self._iteration_counter = 0
         self._extract_data()
 
-    def launch(self):
+    def launch(self, processes=None, chunk_size=2000):
+        """
+        Parameters
+        ----------
+        processes: int
+            number of the processes fitting the candidate sweet spots, one
+            per candidate by default; 1 to fit them in this process
+        chunk_size: int
+            number of the points of the brute-force grid evaluated at once
+
+        Returns
+        -------
+        params: array
+            [f_res, g, period, sweet_spot_cur, q_max_freq, d]
+        loss: float
+            RMS deviation of the model from the resonator points in MHz
+        """
 
         self._period = self._find_period()
         potential_sweet_spots = self._find_potential_sweet_spots()
@@ -52,39 +73,45 @@ class AnticrossingOracle():
             q_freq_range = slice(4e9, 12.1e9, 100e6)
 
         g_range = slice(20e6, 40.1e6, 20e6/5)
-        Ns = 3
+        ranges = (f_range, g_range, q_freq_range, d_range)
         args = (self._res_points[:, 0], self._res_points[:, 1])
-        # self._logger.debug(str(res_freq)
 
-        best_fit_loss = 1e100
-        best_fitresult = None
         # We are not sure where the sweet spot is, so let's choose the best
         # fit among two possibilities:
+        candidates = []
         for sweet_spot_cur in potential_sweet_spots:
-
             mean_cur = mean(self._res_points[:, 0])
             distance_to_sws = abs(mean_cur - sweet_spot_cur)
             shift = round(distance_to_sws / self._period) * self._period * sign(
                 mean_cur - sweet_spot_cur)
-            sweet_spot_cur += shift
-
-            self._iteration_counter = 0
-            result = brute(self._brute_cost_function,
-                           (f_range, g_range, q_freq_range, d_range), Ns=Ns,
-                           args=args+(self._period, sweet_spot_cur), finish=None)
-
-            freq, g, q_max_freq, d = list(result)
-            full_params = [freq, g, self._period, sweet_spot_cur, q_max_freq, d]
-
-            self._iteration_counter = 0
-            result = minimize(self._cost_function, full_params,
-                              args=args, method="Nelder-Mead")
-
-            loss =\
-                sqrt(self._cost_function(result.x, *args)/len(self._res_points))/1e6
+            candidates.append(sweet_spot_cur + shift)
+
+        fit_args = (self._qubit_spectrum, self._res_points,
+                    (self._freqs[0], self._freqs[-1]), ranges, self._period)
+        processes = len(candidates) if processes is None else processes
+        if processes > 1 and len(candidates) > 1 and \
+                not multiprocessing.current_process().daemon:
+            # daemonic processes, e.g. the workers of multiprocessing.Pool,
+            # can not start their own ones
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                fits = list(executor.map(_fit_sweet_spot,
+                                         *zip(*[fit_args + (sweet_spot_cur, chunk_size)
+                                                for sweet_spot_cur in candidates])))
+        else:
+            fits = []
+            for sweet_spot_cur in candidates:
+                fits.append(_fit_sweet_spot(*fit_args, sweet_spot_cur, chunk_size))
+                if self._rms_loss(fits[-1][1].x, *args) < 0.05:
+                    break
 
-            brute_loss =\
-                sqrt(self._cost_function(full_params, *args)/len(self._res_points))/1e6
+        best_fit_loss = 1e100
+        best_fitresult = None
+        for full_params, result in fits:
+            loss = self._rms_loss(result.x, *args)
+            brute_loss = self._rms_loss(full_params, *args)
+            self._logger.debug("Anticrossing fit: brute %s, loss %.2f MHz; "
+                               "final %s, loss %.2f MHz", full_params,
+                               brute_loss, result.x, loss)
 
             if loss < best_fit_loss:
                 self._brute_opt_params = full_params
@@ -94,9 +121,6 @@ class AnticrossingOracle():
                 best_fit_loss = loss
                 best_fitresult = result
 
-            if loss<0.05:
-                break
-
         res_freq, g, period, sweet_spot_cur, q_freq, d = best_fitresult.x
 
         if self._plot:
@@ -139,7 +163,8 @@ class AnticrossingOracle():
         except:
             freqs = data["Frequency [Hz]"]
 
-        self._data = data["data"]
+        # the points skipped by an adaptive scan are zero
+        self._data = fill_unmeasured(data["data"])
 
         data = self._data
         res_freqs = []
@@ -350,55 +375,107 @@ class AnticrossingOracle():
     #     return array(res_freqs_model)
 
     def _model_fast(self, curs, params, plot = False):
-        f_r, g = params[:2]
-        qubit_params = params[2:]
-    #     phis_fine = linspace(phis[0],phis[-1], 1000)
-        f_qs = self._qubit_spectrum(curs, *qubit_params)
-
-        freq_span = self._freqs[-1] - self._freqs[0]
-        levels = self._eigenlevels(f_qs, f_r, g)
-
         if plot:
+            f_qs = self._qubit_spectrum(curs, *params[2:])
+            levels = self._eigenlevels(f_qs, *params[:2])
             plt.plot(curs, levels[0,:])
             plt.plot(curs, levels[1,:])
             plt.plot(curs, levels[2,:])
             plt.ylim(self._freqs[0], self._freqs[-1])
 
-        upper_limit = f_r+freq_span
-        lower_limit = f_r-freq_span
+        return _resonator_model(curs, params, self._qubit_spectrum,
+                                (self._freqs[0], self._freqs[-1]))
 
-        res_freqs_model = zeros_like(curs)+0.5*(self._freqs[-1]+self._freqs[0])
-        idcs1 = where(logical_and(lower_limit<levels[1,:],
-                        levels[1,:]<upper_limit))
-        idcs2 = where(logical_and(lower_limit<levels[2,:],
-                        levels[2,:]<upper_limit))
+    def _cost_function(self, params, curs, res_freqs):
+        return sum((self._model_fast(curs, params) - res_freqs)**2)
 
-        res_freqs_model[idcs1] = levels[1,:][idcs1]
-        res_freqs_model[idcs2] = levels[2,:][idcs2]
+    def _rms_loss(self, params, curs, res_freqs):
+        return sqrt(self._cost_function(params, curs, res_freqs)/len(curs))/1e6
 
-        return res_freqs_model
+    def get_res_points(self):
+        return self._res_points
 
-    def _brute_cost_function(self, params, curs, res_freqs, period, sws_cur):
-        f_res, g, q_max_freq, d = list(params)
-        full_params =\
-            [f_res, g, period, sws_cur, q_max_freq, d]
-        return self._cost_function(full_params, curs,
-                                   res_freqs, freqs_fine_number=100)
 
-    def _cost_function(self, params, curs, res_freqs, freqs_fine_number=5e3):
+def _resonator_model(curs, params, qubit_spectrum, freq_limits):
+    """
+    Resonator frequencies predicted by the anticrossing model
+
+    Parameters
+    ----------
+    curs: array of shape (n_curs,)
+    params: sequence
+        [f_res, g, period, sweet_spot_cur, q_max_freq, d], each of them a
+        number or an array of shape (n, 1) to evaluate n parameter sets at once
+    qubit_spectrum: callable
+    freq_limits: tuple
+        first and last frequencies of the scan
+
+    Returns
+    -------
+    res_freqs: array of shape (n_curs,) or (n, n_curs)
+    """
+    f_r, g = params[:2]
+    f_qs = qubit_spectrum(curs, *params[2:])
 
-        if self._fast:
-            cost = (self._model_fast(curs, params) - res_freqs)**2
-        else:
-            cost = abs(self._model(curs, params,
-                        freqs_fine_number=freqs_fine_number) - res_freqs)
-        if self._iteration_counter%100 == 0:
-            clear_output(wait=True)
-            print((("{:.4e}, "*len(params))[:-2]).format(*params),
-                  "loss:",
-                  "%.2f"%(sqrt(sum(cost)/len(curs))/1e6), "MHz")
-        self._iteration_counter += 1
-        return sum(cost)
+    # the dressed levels counted from E0, see AnticrossingOracle._eigenlevels
+    E0 = (f_r - f_qs)/2
+    splitting = 1/2*sqrt(4*g**2+(f_qs-f_r)**2)
+    E1 = f_r - splitting - E0
+    E2 = f_r + splitting - E0
 
-    def get_res_points(self):
-        return self._res_points
+    freq_span = freq_limits[1] - freq_limits[0]
+    lower_limit, upper_limit = f_r - freq_span, f_r + freq_span
+    res_freqs = full(broadcast(E1, E2).shape, 0.5*(freq_limits[1]+freq_limits[0]))
+    res_freqs = where((lower_limit < E1) & (E1 < upper_limit), E1, res_freqs)
+    res_freqs = where((lower_limit < E2) & (E2 < upper_limit), E2, res_freqs)
+    return res_freqs
+
+
+def _brute(qubit_spectrum, res_points, freq_limits, ranges, period,
+           sweet_spot_cur, chunk_size):
+    """
+    Finds the point of the (f_res, g, q_max_freq, d) grid with the lowest
+    cost; the grid and the choice of the point are the same as in
+    scipy.optimize.brute with finish=None
+    """
+    curs, res_freqs = res_points[:, 0], res_points[:, 1]
+    grid = mgrid[tuple(ranges)].reshape(len(ranges), -1).T
+
+    best_cost, best_point = inf, None
+    for start in range(0, len(grid), chunk_size):
+        chunk = grid[start:start + chunk_size]
+        f_res, g, q_max_freq, d = [column[:, newaxis] for column in chunk.T]
+        model = _resonator_model(curs, (f_res, g, period, sweet_spot_cur,
+                                        q_max_freq, d),
+                                 qubit_spectrum, freq_limits)
+        costs = sum((model - res_freqs)**2, axis=1)
+        idx = argmin(costs)
+        if costs[idx] < best_cost:
+            best_cost, best_point = costs[idx], chunk[idx]
+    return best_point
+
+
+def _fit_sweet_spot(qubit_spectrum, res_points, freq_limits, ranges, period,
+                    sweet_spot_cur, chunk_size):
+    """
+    Fits the resonator points with the sweet spot at sweet_spot_cur. Defined
+    at the module level so that it can be executed in a worker process.
+
+    Returns
+    -------
+    brute_params: list
+        full parameters found by the brute-force search
+    result: OptimizeResult
+        of the Nelder-Mead refinement
+    """
+    curs, res_freqs = res_points[:, 0], res_points[:, 1]
+    freq, g, q_max_freq, d = _brute(qubit_spectrum, res_points, freq_limits,
+                                    ranges, period, sweet_spot_cur, chunk_size)
+    full_params = [freq, g, period, sweet_spot_cur, q_max_freq, d]
+
+    def cost_function(params):
+        return sum((_resonator_model(curs, params, qubit_spectrum,
+                                     freq_limits) - res_freqs)**2)
+
+    result = minimize(cost_function, full_params, method="Nelder-Mead")
+    return full_params, result
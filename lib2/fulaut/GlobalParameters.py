@@ -20,3 +20,11 @@ class GlobalParameters():
     exc_ssb_power = {"I": -20, "II":-20, "III":-20,
                         "IV":-20, "VI":-20, "V":-20,
                         "VII":-20, "VIII":-20}
+
+    # width of the excitation frequency window around the predicted qubit
+    # line in the two-tone flux scans, None to scan the full rectangle
+    tts_adaptive_band = 500e6
+
+    # width of the window around the resonator line in the final single-tone
+    # scan as a fraction of the scan area, None to scan the full rectangle
+    sts_adaptive_band_fraction = 0.4
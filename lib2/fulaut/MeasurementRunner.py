@@ -22,6 +22,8 @@ from drivers.Agilent_EXA import *
 
 from scipy.constants import pi
 import pickle
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 from time import sleep
 
@@ -67,41 +69,116 @@ class MeasurementRunner():
         self._launch_date = datetime.today()
 
         self._logger = LoggingServer.getInstance()
+        self._checkpoint = self._load_checkpoint()
 
-    def run(self, qubits_to_measure=[0, 1, 2, 3, 4, 5]):
+    def run(self, qubits_to_measure=[0, 1, 2, 3, 4, 5], analysis_workers=1,
+            joint_sts=False):
+        """
+        Characterizes the qubits in a pipeline: while the anticrossing or
+        the spectrum of one qubit is being fitted in a worker process, the
+        hardware is used to measure the next qubit.
 
-        self._logger.debug("Started measurement for qubits ##:" + str(qubits_to_measure))
+        If joint_sts is True, the anticrossings of all the qubits are first
+        recorded together with one segmented sweep per current, and only
+        fitted separately.
+
+        The progress of each qubit is checkpointed after every finished
+        stage, so a run interrupted today restarts from the last finished
+        stage of each qubit.
+        """
+        self._logger.debug("Started measurement for qubits ##:%s", qubits_to_measure)
 
         self._open_only_readout_mixer()
 
-        ro = ResonatorOracle(self._vna, self._s_parameter, 3e6)
-        scan_areas = ro.launch()[:]
+        if "scan_areas" not in self._checkpoint:
+            ro = ResonatorOracle(self._vna, self._s_parameter, 3e6)
+            self._checkpoint["scan_areas"] = ro.launch()[:]
+            self._save_checkpoint()
+        scan_areas = self._checkpoint["scan_areas"]
 
+        qubit_names = []
         for idx, res_limits in enumerate(scan_areas):
             if idx not in qubits_to_measure:
                 continue
-
             qubit_name = self._qubit_names[idx]
-            self._res_limits[qubit_name] = res_limits
-
-            if qubit_name not in self._sts_fit_params.keys():
+            qubit_names.append(qubit_name)
+            self._res_limits.setdefault(qubit_name, res_limits)
+
+        if joint_sts and not self._checkpoint.get("joint_sts_done", False):
+            self._measure_anticrossings_jointly(qubit_names)
+
+        pending = {}  # qubit name -> (future, runner, stage)
+        with ProcessPoolExecutor(max_workers=analysis_workers) as executor:
+            while True:
+                self._collect_analyses(pending, block=False)
+                ready = [qubit_name for qubit_name in qubit_names
+                         if qubit_name not in pending and
+                         self._get_qubit_stage(qubit_name) not in ("done", "failed")]
+                if len(ready) > 0:
+                    self._advance_qubit(ready[0], executor, pending)
+                elif len(pending) > 0:
+                    self._collect_analyses(pending, block=True)
+                else:
+                    break
+
+    def _measure_anticrossings_jointly(self, qubit_names):
+        """
+        Records the anticrossings of the qubits that are at the "sts" stage in
+        one segmented scan; STSRunner.measure() then finds them on the disk
+        """
+        sts_runners = [STSRunner(self._sample_name,
+                                 qubit_name,
+                                 mean(self._res_limits[qubit_name]),
+                                 vna=self._vna,
+                                 cur_src=self._cur_src,
+                                 awgs={"q_awg": self._q_awg,
+                                       "ro_awg": self._ro_awg})
+                       for qubit_name in qubit_names
+                       if self._get_qubit_stage(qubit_name) == "sts"]
+        if len(sts_runners) > 1:
+            measure_jointly(sts_runners)
+        self._checkpoint["joint_sts_done"] = True
+        self._save_checkpoint()
+
+    def _get_qubit_stage(self, qubit_name):
+        """
+        The stages are "sts", "tts", "time_domain", "done" or "failed"
+        """
+        return self._checkpoint["qubits"].get(qubit_name, {}).get("stage", "sts")
+
+    def _set_qubit_stage(self, qubit_name, stage, **values):
+        qubit_checkpoint = self._checkpoint["qubits"].setdefault(qubit_name, {})
+        qubit_checkpoint.update(values)
+        qubit_checkpoint["stage"] = stage
+        self._save_checkpoint()
+
+    def _advance_qubit(self, qubit_name, executor, pending):
+        """
+        Performs the next hardware stage of the qubit and submits its
+        analysis to the executor if needed
+        """
+        stage = self._get_qubit_stage(qubit_name)
+        try:
+            if stage == "sts":
                 STSR = STSRunner(self._sample_name,
                                  qubit_name,
-                                 mean(res_limits),
+                                 mean(self._res_limits[qubit_name]),
                                  vna=self._vna,
                                  cur_src=self._cur_src,
                                  awgs={"q_awg": self._q_awg,
-                                       "ro_awg": self._ro_awg})  # {"q_awg": self._q_awg,"ro_awg": self._ro_awg}
-
+                                       "ro_awg": self._ro_awg})
                 self._sts_runners[qubit_name] = STSR
-                self._sts_fit_params[qubit_name], loss = STSR.run()
-                self._res_limits[qubit_name] = STSR.get_scan_area()
-            #continue
-
-            if qubit_name not in self._tts_fit_params.keys():
+                known_fit = STSR.measure()
+                if known_fit is not None:
+                    self._finish_sts(qubit_name, STSR, known_fit)
+                else:
+                    pending[qubit_name] = \
+                        (executor.submit(fit_anticrossing, STSR.get_result()), STSR, stage)
+
+            elif stage == "tts":
                 TTSR = TTSRunner(self._sample_name,
                                  qubit_name,
-                                 STSR.get_scan_area(),
+                                 self._res_limits[qubit_name],
                                  self._sts_fit_params[qubit_name],
                                  vna=self._vna,
                                  mw_src=self._mw_src,
@@ -109,33 +186,114 @@ class MeasurementRunner():
                                  awgs={"q_awg": self._q_awg,
                                        "ro_awg": self._ro_awg})
                 self._tts_runners[qubit_name] = TTSR
-                self._tts_fit_params[qubit_name] = TTSR.run()
-
-            self._exact_qubit_freqs[qubit_name] = self._tts_fit_params[qubit_name][2]
-            self._ro_cal = self._calibrate_readout(qubit_name)
-            self._exc_cal = self._calibrate_excitation(qubit_name)
-
-            q_freq = transmon_spectrum(*self._tts_fit_params[qubit_name])
-            self._cur_src.set_current(self._tts_fit_params[qubit_name][1])
-
-            self._perform_Rabi_oscillations(qubit_name)
-
-            self._max_ramsey_delay = .5e3
-            self._ramsey_offset = 5e6
-            self._ramsey_nop = 201
-
-            self._perform_Ramsey_oscillations(qubit_name)
-            detected_ramsey_freq = \
-                self._dr_results[qubit_name].get_ramsey_frequency()
-            frequency_error = self._ramsey_offset - detected_ramsey_freq
-            self._exact_qubit_freqs[qubit_name] -= frequency_error
-            self._ramsey_offset = 0.5e6
-            self._max_ramsey_delay = 1e4
-            self._ramsey_nop = 201
-
-            self._perform_Rabi_oscillations(qubit_name, True)
-            self._perform_Ramsey_oscillations(qubit_name, True)
-            self._perform_decay(qubit_name, True)
+                TTSR.measure()
+                pending[qubit_name] = \
+                    (executor.submit(fit_spectrum, TTSR.get_result(),
+                                     self._sts_fit_params[qubit_name]), TTSR, stage)
+
+            elif stage == "time_domain":
+                self._perform_time_domain_measurements(qubit_name)
+                self._set_qubit_stage(qubit_name, "done",
+                                      exact_qubit_freq=self._exact_qubit_freqs[qubit_name])
+        except Exception as e:
+            self._logger.warn("Qubit %s failed at stage %s: %s", qubit_name, stage, e)
+            self._set_qubit_stage(qubit_name, "failed")
+
+    def _collect_analyses(self, pending, block):
+        if len(pending) == 0:
+            return
+        futures = {future: qubit_name for qubit_name, (future, runner, stage) in pending.items()}
+        done, not_done = wait(futures.keys(), timeout=None if block else 0,
+                              return_when=FIRST_COMPLETED)
+        for future in done:
+            qubit_name = futures[future]
+            future, runner, stage = pending.pop(qubit_name)
+            try:
+                if stage == "sts":
+                    self._finish_sts(qubit_name, runner,
+                                     runner.process_fit(*future.result()))
+                else:
+                    self._tts_fit_params[qubit_name] = runner.process_fit(future.result())
+                    self._set_qubit_stage(qubit_name, "time_domain",
+                                          tts_fit_params=self._tts_fit_params[qubit_name])
+            except Exception as e:
+                self._logger.warn("Analysis for qubit %s failed: %s", qubit_name, e)
+                self._set_qubit_stage(qubit_name, "failed")
+
+    def _finish_sts(self, qubit_name, STSR, fit_result):
+        self._sts_fit_params[qubit_name], loss = fit_result
+        self._res_limits[qubit_name] = STSR.get_scan_area()
+        self._set_qubit_stage(qubit_name, "tts",
+                              sts_fit_params=self._sts_fit_params[qubit_name],
+                              res_limits=self._res_limits[qubit_name])
+
+    def _perform_time_domain_measurements(self, qubit_name):
+        self._exact_qubit_freqs[qubit_name] = self._tts_fit_params[qubit_name][2]
+        self._ro_cal = self._calibrate_readout(qubit_name)
+        self._exc_cal = self._calibrate_excitation(qubit_name)
+
+        q_freq = transmon_spectrum(*self._tts_fit_params[qubit_name])
+        self._cur_src.set_current(self._tts_fit_params[qubit_name][1])
+
+        self._perform_Rabi_oscillations(qubit_name)
+
+        self._max_ramsey_delay = .5e3
+        self._ramsey_offset = 5e6
+        self._ramsey_nop = 201
+
+        self._perform_Ramsey_oscillations(qubit_name)
+        detected_ramsey_freq = \
+            self._dr_results[qubit_name].get_ramsey_frequency()
+        frequency_error = self._ramsey_offset - detected_ramsey_freq
+        self._exact_qubit_freqs[qubit_name] -= frequency_error
+        self._ramsey_offset = 0.5e6
+        self._max_ramsey_delay = 1e4
+        self._ramsey_nop = 201
+
+        self._perform_Rabi_oscillations(qubit_name, True)
+        self._perform_Ramsey_oscillations(qubit_name, True)
+        self._perform_decay(qubit_name, True)
+
+    def _get_checkpoint_path(self):
+        return os.path.join("data", self._sample_name,
+                            self._launch_date.strftime("%b %d %Y"),
+                            "fulaut-checkpoint.pkl")
+
+    def _load_checkpoint(self):
+        """
+        Loads today's progress and restores the fit parameters of the qubits
+        from it
+        """
+        checkpoint = {"qubits": {}}
+        try:
+            with open(self._get_checkpoint_path(), "rb") as f:
+                checkpoint = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return checkpoint
+
+        for qubit_name, qubit_checkpoint in checkpoint["qubits"].items():
+            if "res_limits" in qubit_checkpoint:
+                self._res_limits[qubit_name] = qubit_checkpoint["res_limits"]
+            if "sts_fit_params" in qubit_checkpoint:
+                self._sts_fit_params[qubit_name] = qubit_checkpoint["sts_fit_params"]
+            if "tts_fit_params" in qubit_checkpoint:
+                self._tts_fit_params[qubit_name] = qubit_checkpoint["tts_fit_params"]
+            if "exact_qubit_freq" in qubit_checkpoint:
+                self._exact_qubit_freqs[qubit_name] = qubit_checkpoint["exact_qubit_freq"]
+            if qubit_checkpoint.get("stage") == "failed":
+                # failed qubits are retried on restart
+                qubit_checkpoint["stage"] = "sts" if "sts_fit_params" not in qubit_checkpoint \
+                    else "tts" if "tts_fit_params" not in qubit_checkpoint else "time_domain"
+        self._logger.debug("Restored checkpoint: %s",
+                           {name: q["stage"] for name, q in checkpoint["qubits"].items()})
+        return checkpoint
+
+    def _save_checkpoint(self):
+        path = self._get_checkpoint_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self._checkpoint, f)
+        os.replace(path + ".tmp", path)
 
     def _perform_decay(self, qubit_name, save=False):
 
@@ -277,27 +435,27 @@ class MeasurementRunner():
         ssb_power = GlobalParameters.ro_ssb_power[qubit_name]
         waveform_resolution=1
 
-        db = load_IQMX_calibration_database("CHGRO", 0)
-        if db is not None:
-            ro_cal = \
-                db.get(frozenset(dict(lo_power=lo_power,
-                                      ssb_power=ssb_power,
-                                      lo_frequency=ro_resonator_frequency,
-                                      if_frequency=if_frequency,
-                                      waveform_resolution=waveform_resolution)\
-                                 .items()))
-            if ro_cal is not None and not GlobalParameters.recalibrate_mixers[qubit_name]:
-                return ro_cal
+        radiation_parameters = dict(lo_frequency=ro_resonator_frequency,
+                                    if_frequency=if_frequency,
+                                    lo_power=lo_power,
+                                    ssb_power=ssb_power,
+                                    waveform_resolution=waveform_resolution)
+        ro_cal = IQMX_calibration_database.get_interpolated("CHGRO", 0,
+                                                            **radiation_parameters)
+        if ro_cal is not None and not GlobalParameters.recalibrate_mixers[qubit_name]:
+            return ro_cal
+        warm_start = IQMX_calibration_database.get_nearest("CHGRO", 0,
+                                                           **radiation_parameters)
 
         self._set_vna_to_ro_lo()
 
         ig = {"dc_offsets": (0.1, +0.1), "dc_offset_open": 0.3}
-        cal = IQCalibrator(self._ro_awg,
-                           self._sa,
-                           self._vna,
-                           "CHGRO",
-                           0,
-                           sidebands_to_suppress=1)
+        cal = IQSurrogateCalibrator(self._ro_awg,
+                                    self._sa,
+                                    self._vna,
+                                    "CHGRO",
+                                    0,
+                                    sidebands_to_suppress=1)
 
         ro_cal = cal.calibrate(lo_frequency=ro_resonator_frequency,
                                if_frequency=if_frequency,
@@ -305,9 +463,8 @@ class MeasurementRunner():
                                ssb_power=ssb_power,
                                waveform_resolution=1,
                                iterations=3,
-                               minimize_iterlimit=20,
                                sa_res_bandwidth=100,
-                               initial_guess=ig)
+                               initial_guess=ig if warm_start is None else warm_start)
         save_IQMX_calibration(ro_cal)
         return ro_cal
 
@@ -319,26 +476,27 @@ class MeasurementRunner():
         ssb_power = GlobalParameters.exc_ssb_power[qubit_name]
         waveform_resolution = 1
 
-        db = load_IQMX_calibration_database("CHGQ", 0)
-        exc_cal = \
-            db.get(frozenset(dict(lo_power=lo_power,
-                                  ssb_power=ssb_power,
-                                  lo_frequency=qubit_frequency + if_frequency,
-                                  if_frequency=if_frequency,
-                                  waveform_resolution=waveform_resolution) \
-                             .items()))
+        radiation_parameters = dict(lo_frequency=qubit_frequency + if_frequency,
+                                    if_frequency=if_frequency,
+                                    lo_power=lo_power,
+                                    ssb_power=ssb_power,
+                                    waveform_resolution=waveform_resolution)
+        exc_cal = IQMX_calibration_database.get_interpolated("CHGQ", 0,
+                                                             **radiation_parameters)
         if exc_cal is not None and not GlobalParameters.recalibrate_mixers[qubit_name]:
             return exc_cal
+        warm_start = IQMX_calibration_database.get_nearest("CHGQ", 0,
+                                                           **radiation_parameters)
 
         ig = {"dc_offsets": (-0.017, -0.04),
               "if_amplitudes": (.1, .1),
               "if_phase": -pi * 0.54}
-        cal = IQCalibrator(self._q_awg,
-                           self._sa,
-                           self._mw_src,
-                           "CHGQ",
-                           0,
-                           sidebands_to_suppress=6)
+        cal = IQSurrogateCalibrator(self._q_awg,
+                                    self._sa,
+                                    self._mw_src,
+                                    "CHGQ",
+                                    0,
+                                    sidebands_to_suppress=6)
 
         exc_cal = cal.calibrate(lo_frequency=qubit_frequency + if_frequency,
                                 if_frequency=if_frequency,
@@ -346,9 +504,8 @@ class MeasurementRunner():
                                 ssb_power=ssb_power,
                                 waveform_resolution=waveform_resolution,
                                 iterations=2,
-                                minimize_iterlimit=20,
                                 sa_res_bandwidth=500,
-                                initial_guess=ig)
+                                initial_guess=ig if warm_start is None else warm_start)
         save_IQMX_calibration(exc_cal)
         return exc_cal
 
@@ -1,6 +1,7 @@
 from scipy import *
 from scipy.signal import argrelextrema
 from matplotlib import pyplot as plt
+from lib2.SingleToneSpectroscopy import merge_windows
 
 class ResonatorOracle():
 
@@ -8,12 +9,23 @@ class ResonatorOracle():
         self._vna = vna
         self._vna.select_S_param(s_param)
         self._area_size = area_size
+        self._survey_limits = (6.4e9, 7.5e9)
 
-    def launch(self, n_peaks = 8):
+    def launch(self, n_peaks = 8, survey_nop = 25000, refine_nop = None):
+        """
+        Parameters:
+        -----------
+            survey_nop : int
+                number of points in the sweep over the whole band
+            refine_nop : int
+                if specified, the found areas are measured again with this
+                number of points in each in one segmented sweep and are
+                centered at the resonances, so a coarse survey is enough
+        """
         vna = self._vna
         vna.sweep_hold()
-        vna.set_nop(25000)
-        vna.set_xlim(6.4e9, 7.5e9)  # setting the scan area
+        vna.set_nop(survey_nop)
+        vna.set_xlim(*self._survey_limits)  # setting the scan area
         vna.set_bandwidth(10000)
         vna.set_averages(1)
         vna.set_power(0)
@@ -30,6 +42,9 @@ class ResonatorOracle():
                                                 self._area_size, depth)
             depth+=1
 
+        if refine_nop is not None and len(scan_areas) > 0:
+            scan_areas = self.refine_scan_areas(scan_areas, refine_nop)
+
         plt.plot(freqs/1e9, 20*log10(abs(s_data)))
 
         for scan_area in scan_areas:
@@ -46,6 +61,35 @@ class ResonatorOracle():
         return scan_areas
 
 
+    def refine_scan_areas(self, scan_areas, nop):
+        """
+        Measures all the scan areas in one segmented sweep with nop points in
+        each of them and centers each area at the deepest point found in it
+
+        Returns:
+            scan_areas : list
+                A list of tuples of the same size as scan_areas
+        """
+        vna = self._vna
+        vna.set_segments(merge_windows(scan_areas, nop))
+        try:
+            vna.prepare_for_stb()
+            vna.sweep_single()
+            vna.wait_for_stb()
+            freqs, s_data = vna.get_frequencies(), vna.get_sdata()
+        finally:
+            # back to the linear sweep, so that the callers setting only nop
+            # or bandwidth do not sweep the segments
+            vna.set_xlim(*self._survey_limits)
+
+        refined_areas = []
+        for start, stop in scan_areas:
+            area_mask = (freqs >= start) & (freqs <= stop)
+            res_freq = freqs[area_mask][argmin(abs(s_data[area_mask]))]
+            refined_areas.append((res_freq - self._area_size / 2,
+                                  res_freq + self._area_size / 2))
+        return refined_areas
+
     def guess_scan_areas(self, freqs, s_data, area_size, depth):
         """
         Function to get the approximate positions of the resonator dips
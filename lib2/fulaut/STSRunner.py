@@ -1,5 +1,7 @@
 from lib2.SingleToneSpectroscopy import *
 from lib2.fulaut.AnticrossingOracle import *
+from lib2.fulaut.GlobalParameters import GlobalParameters
+from lib2.AdaptiveWindow import AdaptiveWindow
 from lib2.LoggingServer import LoggingServer
 from datetime import datetime
 
@@ -37,7 +39,20 @@ class STSRunner():
         self._logger = LoggingServer.getInstance()
 
     def run(self):
-
+        known_fit = self.measure()
+        if known_fit is not None:
+            return known_fit
+        return self.process_fit(*fit_anticrossing(self._sts_result, plot=True))
+
+    def measure(self):
+        """
+        Records the anticrossing or takes today's one from the disk
+
+        Returns
+        -------
+        fit_result: tuple (params, loss) or None
+            the fit stored with today's result if it was already fitted
+        """
         # Check if today's anticrossing is present
 
         known_results = \
@@ -52,15 +67,22 @@ class STSRunner():
                 return known_results[-1]._fit_result
         else:
             self._iterate_STS()
-
-        ao = AnticrossingOracle("transmon", self._sts_result, plot=True)
-        res_points = ao.get_res_points()
-        params, loss = ao.launch()
-
-        self._logger.debug("Error: " + str(loss) + \
-                           ", ptp: " + str(ptp(res_points[:, 1]) / 1e6))
-        if loss < 0.2 * ptp(res_points[:, 1]) / 1e6:
-            self._logger.debug("Success! " + str(params) + " " + str(loss))
+            # saved before the fit so that an interrupted run does not
+            # repeat the measurement
+            self._sts_result.save()
+        return None
+
+    def get_result(self):
+        return self._sts_result
+
+    def process_fit(self, params, loss, res_points_ptp):
+        """
+        Checks the anticrossing fit found by fit_anticrossing and saves it
+        with the result
+        """
+        self._logger.debug("Error: %s, ptp: %s", loss, res_points_ptp / 1e6)
+        if loss < 0.2 * res_points_ptp / 1e6:
+            self._logger.debug("Success! %s %s", params, loss)
             self._sts_result._fit_result = (params, loss)
             print("Saving...", end="")
             self._sts_result.save()
@@ -82,8 +104,8 @@ class STSRunner():
             ao = AnticrossingOracle("transmon", self._sts_result, plot=True)
             res_points = ao.get_res_points()
 
-            self._logger.debug("Scan: " + str(self._scan_area / 1e6))
-            self._logger.debug("Ptp: " + str(ptp(res_points[:, 1]) / 1e6))
+            self._logger.debug("Scan: %s", self._scan_area / 1e6)
+            self._logger.debug("Ptp: %s", ptp(res_points[:, 1]) / 1e6)
             if 0.1 * self._scan_area < ptp(res_points[:, 1]) < 0.5 * self._scan_area:
                 self._logger.debug("Flux dependence found. Zooming...")
                 self._scan_area = max(ptp(res_points[:, 1]) / 0.25, 3e6)
@@ -107,22 +129,22 @@ class STSRunner():
         period = ao._find_period()
 
         N_periods = ptp(self._currents) / period
-        self._logger.debug("Periods: %.2f" % N_periods)
+        self._logger.debug("Periods: %.2f", N_periods)
 
         if N_periods > 1:
             self._currents = \
                 (self._currents - mean(self._currents)) / N_periods*1.5 + mean(self._currents)
-            self._perform_STS()
+            self._perform_STS(self._get_frequency_window(ao.get_res_points(), period))
         elif N_periods < 1:
             if max(abs(self._currents)) > 1e-3:
                 raise ValueError("Flux period is too large!")
 
-            self._logger.debug("Current range too narrow" + str(N_periods))
+            self._logger.debug("Current range too narrow %s", N_periods)
             self._currents =\
                 (self._currents-mean(self._currents)) * 2 + mean(self._currents)
             self._perform_STS()
 
-    def _perform_STS(self):
+    def _perform_STS(self, frequency_window=None):
 
         self._vna_parameters["freq_limits"] = \
             (self._res_freq - self._scan_area / 2,
@@ -132,12 +154,27 @@ class STSRunner():
                                            self._sample_name, plot_update_interval=1,
                                            vna=self._vna, src=self._cur_src)
 
-        self._STS.set_fixed_parameters(self._vna_parameters)
+        self._STS.set_fixed_parameters(vna=[self._vna_parameters],
+                                       frequency_window=frequency_window)
         self._STS.set_swept_parameters({'Current [A]': \
-                                            (self._STS._src.set_current, self._currents)})
+                                            (self._STS._src[0].set_current, self._currents)})
 
         self._sts_result = self._STS.launch()
 
+    def _get_frequency_window(self, res_points, period):
+        """
+        Window following the resonator line found in the previous scan, which
+        covered more than one flux period, so the line is known at all the
+        currents of the next one up to the periodicity
+        """
+        if GlobalParameters.sts_adaptive_band_fraction is None or len(res_points) < 2:
+            return None
+        res_points = res_points[argsort(res_points[:, 0])]
+        curs, res_freqs = res_points[:, 0], res_points[:, 1]
+        return AdaptiveWindow(lambda x: interp(x, curs, res_freqs, period=period),
+                              band=GlobalParameters.sts_adaptive_band_fraction * self._scan_area,
+                              refitted_params=[])
+
     def get_scan_area(self):
         return (self._res_freq - self._scan_area / 2,
                 self._res_freq + self._scan_area / 2)
@@ -149,3 +186,53 @@ class STSRunner():
         self._q_awg.output_continuous_IQ_waves(frequency=0, amplitudes=(0, 0),
                                                relative_phase=0, offsets=(0, 0),
                                                waveform_resolution=1)
+
+
+def fit_anticrossing(sts_result, plot=False):
+    """
+    Fits the anticrossing with the AnticrossingOracle. Defined at the module
+    level so that it can be executed in a worker process.
+
+    Returns
+    -------
+    params, loss, res_points_ptp
+    """
+    ao = AnticrossingOracle("transmon", sts_result, plot=plot)
+    res_points = ao.get_res_points()
+    params, loss = ao.launch()
+    return params, loss, ptp(res_points[:, 1])
+
+
+def measure_jointly(sts_runners):
+    """
+    Records the anticrossings of several resonators with one segmented VNA
+    sweep over all of their scan areas for each current instead of a separate
+    scan for each resonator. The result is split into the results of the
+    runners and saved, so that their measure() takes it from the disk.
+
+    The scan areas, VNA parameters and currents are those of the runners, so
+    the runners should share the VNA and the current source; the currents of
+    the first one are used.
+
+    Returns
+    -------
+    sts_results: list of SingleToneSpectroscopyResult
+    """
+    first_runner = sts_runners[0]
+    windows = [runner.get_scan_area() for runner in sts_runners]
+    vna_parameters = dict(first_runner._vna_parameters)
+    vna_parameters["segments"] = merge_windows(windows, vna_parameters.pop("nop"))
+
+    STS = SingleToneSpectroscopy("-".join(runner._qubit_name for runner in sts_runners) + "-sts",
+                                 first_runner._sample_name, plot_update_interval=1,
+                                 vna=first_runner._vna, src=first_runner._cur_src)
+    STS.set_fixed_parameters(vna=[vna_parameters])
+    STS.set_swept_parameters({'Current [A]': (STS._src[0].set_current,
+                                              first_runner._currents)})
+    joint_result = STS.launch()
+
+    sts_results = joint_result.split(windows, [runner._sts_name for runner in sts_runners])
+    for runner, sts_result in zip(sts_runners, sts_results):
+        runner._sts_result = sts_result
+        sts_result.save()
+    return sts_results
@@ -7,6 +7,7 @@ from IPython.display import clear_output
 from operator import itemgetter
 
 from lib2.fulaut.qubit_spectra import *
+from lib2.AdaptiveWindow import fill_unmeasured
 
 
 class SpectrumOracle():
@@ -233,7 +234,9 @@ class SpectrumOracle():
             self._frequencies = data["frequency"][:] / 1e9
 
         self._freq_resolution = self._frequencies[1] - self._frequencies[0]
-        self._Z = (data["data"].T - mean(data["data"], -1)).T
+        # the points skipped by an adaptive scan are zero
+        Z = fill_unmeasured(data["data"])
+        self._Z = (Z.T - mean(Z, -1)).T
 
         self._threshold = sqrt(median(diff(abs(self._Z)) ** 2))
 
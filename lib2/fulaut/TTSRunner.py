@@ -2,6 +2,7 @@ from lib2.TwoToneSpectroscopy import *
 from lib2.fulaut.SpectrumOracle import *
 from lib2.fulaut.GlobalParameters import *
 from lib2.fulaut.qubit_spectra import *
+from lib2.AdaptiveWindow import AdaptiveWindow
 
 from datetime import datetime
 
@@ -71,7 +72,13 @@ class TTSRunner():
         self._launch_datetime = datetime.today()
 
     def run(self):
+        self.measure()
+        return self.process_fit(fit_spectrum(self._tts_result, self._fit_p0, plot=True))
 
+    def measure(self):
+        """
+        Records the two-tone spectrum or takes today's one from the disk
+        """
         # Check if today's spectrum is present
 
         known_results = \
@@ -84,17 +91,15 @@ class TTSRunner():
             self._tts_result = known_results[-1]
         else:
             self._perform_TTS()
-
-        so = SpectrumOracle("transmon",
-                            self._tts_result,
-                            self._fit_p0[2:], plot=True)
-        params = so.launch()
-        self._logger.debug("Two-tone fit: %s" % str(params))
-        if known_results is None:
             print("Saving...", end="")
             self._tts_result.save()
-        print("\n")
 
+    def get_result(self):
+        return self._tts_result
+
+    def process_fit(self, params):
+        self._logger.debug("Two-tone fit: %s", params)
+        print("\n")
         return params
 
     def _perform_TTS(self):
@@ -108,10 +113,21 @@ class TTSRunner():
                                       mw_src=self._mw_src,
                                       current_src=self._cur_src)
 
-        self._TTS.set_fixed_parameters(self._vna_parameters,
-                                 self._mw_src_parameters,
+        frequency_window = None
+        if GlobalParameters.tts_adaptive_band is not None:
+            # only a band around the qubit line predicted from the
+            # anticrossing is scanned; the sweet spot and the maximum
+            # frequency are refined on the go
+            frequency_window = AdaptiveWindow(transmon_spectrum,
+                                              (period, sweet_spot, max_q_freq, d),
+                                              band=GlobalParameters.tts_adaptive_band,
+                                              refitted_params=[1, 2])
+
+        self._TTS.set_fixed_parameters(vna=[self._vna_parameters],
+                                 mw_src=[self._mw_src_parameters],
                                  sweet_spot_current=mean(self._currents),
-                                 adaptive=True)
+                                 adaptive=True,
+                                 frequency_window=frequency_window)
 
         self._TTS.set_swept_parameters(self._mw_src_frequencies,
                                  current_values=self._currents)
@@ -131,3 +147,12 @@ class TTSRunner():
                                                relative_phase=0,
                                                offsets=(1, 1),
                                                waveform_resolution=1)
+
+
+def fit_spectrum(tts_result, fit_p0, plot=False):
+    """
+    Fits the two-tone spectrum with the SpectrumOracle. Defined at the module
+    level so that it can be executed in a worker process.
+    """
+    so = SpectrumOracle("transmon", tts_result, fit_p0[2:], plot=plot)
+    return so.launch()